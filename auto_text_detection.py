@@ -0,0 +1,149 @@
+from kv.image import Image, ImageMode
+from kv.mser import MSERDetector, MSERConfiguration
+from instrumentation import StageRecorder
+from detection_cache import DetectionCache
+from detection_result import DetectionResult
+from text_detection import TextDetection
+from tuning import TuningProfile
+
+
+class AutoTunedTextDetection(TextDetection):
+    """Text detection choosing its MSER delta, grouping thresholds and
+    detection size per image to stay within a time budget.
+
+    MSER first runs on a probe image downsized to the profile's
+    probe_dimension to estimate the region density of the image. The density
+    selects the parameters of a band of the TuningProfile, then the delta is
+    raised, and finally the image downsized for detection, until the
+    profile's CostModel predicts detection fits in the time budget.
+
+    The tuned parameters are set on the detector before every detection, so
+    an instance must not detect on several threads at once.
+    """
+    def __init__(self,
+                 profile: TuningProfile=None,
+                 time_budget: float=None,
+                 **kwargs):
+        super().__init__(**kwargs)
+        self._profile = profile or TuningProfile()
+        if time_budget is not None:
+            self._profile.time_budget = time_budget
+
+        # Parameters set by the constructor, the tuned ones start from these
+        self._base_parameters = self._tuned_parameters()
+
+        # Only a plain single delta MSER is tuned, explicit configurations
+        # are used as given
+        self._tunes_delta = self._mser.configurations == [MSERConfiguration(self._mser_delta)]
+
+        # MSERDetector of every delta used so far
+        self._msers = {self._mser_delta: self._mser}
+
+    @classmethod
+    def from_profile(cls, path: str, **kwargs):
+        return cls(profile=TuningProfile.load(path), **kwargs)
+
+    def detect_regions(self, image: Image, recorder=None) -> DetectionResult:
+        recorder = recorder or StageRecorder()
+        first_record = len(recorder.records)
+        with recorder.stage('tune') as stage:
+            # Converted once for tuning and detection, without caching the
+            # conversion on the caller's image
+            rgb_image = Image.view(image, target_mode=ImageMode.RGB, cache=False)
+            parameters = self.tune(rgb_image)
+            stage.details = parameters
+        self._apply(parameters)
+        result = super().detect_regions(rgb_image, recorder=recorder)
+        # The timings of the detection start after the tune stage
+        result.add_timings(recorder.records[first_record:first_record + 1])
+        return result
+
+    def tune(self, image: Image) -> dict:
+        """Return the parameters to detect the text of image with"""
+        profile = self._profile
+        model = profile.cost_model
+        parameters = dict(self._base_parameters)
+
+        if not self._tunes_delta:
+            return parameters
+
+        rgb_image = Image.view(image, target_mode=ImageMode.RGB, cache=False)
+        probe = rgb_image
+        if rgb_image.size.max_dimension > profile.probe_dimension:
+            probe = Image.downsize(rgb_image, profile.probe_dimension)
+        max_dimension = rgb_image.size.max_dimension
+        if parameters['largest_dimension'] is not None:
+            max_dimension = min(max_dimension, parameters['largest_dimension'])
+        num_pixels = rgb_image.width * rgb_image.height * (max_dimension / rgb_image.size.max_dimension) ** 2
+        region_scale = (num_pixels / (probe.width * probe.height)) ** profile.region_exponent
+
+        def estimated_regions(delta):
+            return len(self._mser_for(delta).detect(probe)) * region_scale
+
+        num_regions = estimated_regions(parameters['mser_delta'])
+        parameters.update(profile.parameters_for_density(num_regions / (num_pixels / 1e6)))
+
+        deltas = [parameters['mser_delta']] + [delta for delta in profile.deltas
+                                               if delta > parameters['mser_delta']]
+        # Raising the delta cannot help when the pixels alone exceed the budget
+        if model.predict(num_pixels, 0) <= profile.time_budget:
+            for delta in deltas:
+                if delta != deltas[0]:
+                    num_regions = estimated_regions(delta)
+                parameters['mser_delta'] = delta
+                if model.predict(num_pixels, num_regions) <= profile.time_budget:
+                    return parameters
+
+        # Downsize for detection, regions are assumed to scale with the pixels
+        for dimension in sorted(profile.largest_dimensions, reverse=True):
+            if dimension >= max_dimension:
+                continue
+            parameters['largest_dimension'] = dimension
+            area_scale = (dimension / max_dimension) ** 2
+            if model.predict(num_pixels * area_scale, num_regions * area_scale) <= profile.time_budget:
+                break
+        return parameters
+
+    def _tuned_parameters(self) -> dict:
+        return {
+            'mser_delta': self._mser_delta,
+            'threshold_delta_x': self._threshold_delta_x,
+            'threshold_delta_y': self._threshold_delta_y,
+            'threshold_num_groups': self._threshold_num_groups,
+            'largest_dimension': self._largest_dimension,
+        }
+
+    def _mser_for(self, delta: int) -> MSERDetector:
+        if delta not in self._msers:
+            self._msers[delta] = MSERDetector(delta=delta)
+        return self._msers[delta]
+
+    def _apply(self, parameters: dict):
+        if self._tunes_delta:
+            self._mser_delta = parameters['mser_delta']
+            self._mser = self._mser_for(self._mser_delta)
+        self._threshold_delta_x = parameters['threshold_delta_x']
+        self._threshold_delta_y = parameters['threshold_delta_y']
+        self._threshold_num_groups = parameters['threshold_num_groups']
+        self._largest_dimension = parameters['largest_dimension']
+
+
+def create_detector(detector_kwargs: dict) -> TextDetection:
+    """Return the detector for detector_kwargs.
+
+    When they hold a 'tuning_profile' path or a 'time_budget', an
+    AutoTunedTextDetection is returned, loading the profile, otherwise a
+    TextDetection. A 'cache_dir' gives the detector a DetectionCache whose
+    NPZ tier lives in that folder, shared by the processes using it.
+    """
+    detector_kwargs = dict(detector_kwargs)
+    profile_path = detector_kwargs.pop('tuning_profile', None)
+    time_budget = detector_kwargs.pop('time_budget', None)
+    cache_dir = detector_kwargs.pop('cache_dir', None)
+    if cache_dir is not None:
+        detector_kwargs['cache'] = DetectionCache(directory=cache_dir)
+    if profile_path is None and time_budget is None:
+        return TextDetection(**detector_kwargs)
+
+    profile = TuningProfile.load(profile_path) if profile_path else None
+    return AutoTunedTextDetection(profile=profile, time_budget=time_budget, **detector_kwargs)
@@ -0,0 +1,271 @@
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, as_completed, wait
+from kv.image import Image, ImageMode
+from instrumentation import StageRecorder
+from text_detection import TextDetection
+from auto_text_detection import create_detector
+from serialization import JsonLinesWriter, result_record
+import json
+import multiprocessing
+import time
+import os
+
+import cv2
+
+
+class BatchResult:
+    def __init__(self, input_path: str, output_path: str, mask_path: str,
+                 seconds: float = 0., skipped: bool = False, error: str = None,
+                 timings: dict = None, stages: [dict] = None, record: dict = None,
+                 name: str = None):
+        self.input_path = input_path
+
+        # Path of the outputs relative to the output folder, without the
+        # mask suffix
+        self.name = name or os.path.basename(input_path)
+        self.output_path = output_path
+        self.mask_path = mask_path
+        self.seconds = seconds
+        self.skipped = skipped
+        self.error = error
+
+        # Seconds spent in each step of processing the image, by step name
+        self.timings = timings or {}
+
+        # StageRecord.as_dict() of every detection stage
+        self.stages = stages or []
+
+        # serialization.result_record of the detection, when masks are
+        # written as RLE records instead of PNG files
+        self.record = record
+
+    def __str__(self):
+        if self.skipped:
+            return "{}: skipped".format(self.input_path)
+        if self.error:
+            return "{}: failed ({})".format(self.input_path, self.error)
+        return "{}: {:.3f}s".format(self.input_path, self.seconds)
+
+
+def iter_image_paths(folder):
+    """Lazily yield the paths of the files in folder, in name order"""
+    with os.scandir(folder) as entries:
+        names = sorted(entry.name for entry in entries if entry.is_file())
+    for name in names:
+        yield os.path.join(folder, name)
+
+
+# File of the output folder the RLE records are appended to
+RECORDS_FILENAME = 'masks.jsonl'
+
+
+def output_paths(input_path: str, output_folder: str, mask_only: bool = False,
+                 mask_format: str = 'png', name: str = None) -> (str, str):
+    """Return the paths of the inpainted image and the mask for input_path.
+
+    The outputs are named name, a path relative to output_folder, and
+    default to the file name of input_path. The inpainted image path is None
+    when only the mask is written, the mask path is None when masks are
+    written as RLE records.
+    """
+    name = name or os.path.basename(input_path)
+    stem, _ = os.path.splitext(name)
+    output_path = None if mask_only else os.path.join(output_folder, name)
+    mask_path = None
+    if mask_format == 'png':
+        mask_path = os.path.join(output_folder, "{}_mask.png".format(stem))
+    return output_path, mask_path
+
+
+# Detector of the current worker process, created once by init_worker
+_detector: TextDetection = None
+
+
+def init_worker(detector_kwargs: dict):
+    """Create the detector of the current worker process"""
+    global _detector
+    _detector = create_detector(detector_kwargs)
+
+
+def worker_detector() -> TextDetection:
+    """Return the detector created by init_worker in the current process"""
+    return _detector
+
+
+def worker_pool(workers: int, detector_kwargs: dict) -> ProcessPoolExecutor:
+    """Return a pool of worker processes each holding a detector"""
+    # Forking a process that has used OpenCV's thread pool can deadlock
+    # the child, so workers are spawned
+    return ProcessPoolExecutor(max_workers=workers,
+                               mp_context=multiprocessing.get_context('spawn'),
+                               initializer=init_worker,
+                               initargs=(detector_kwargs,))
+
+
+def _process_image(input_path: str, output_path: str, mask_path: str, name: str = None) -> BatchResult:
+    """Detect the text of the image at input_path, write the inpainted
+    image to output_path and the mask to mask_path when they are not None.
+    Without a mask path, the result holds the RLE record of the detection.
+    """
+    timings = {}
+    start = time.perf_counter()
+    # Any failure only fails this image, so that one bad file does not end
+    # a whole batch
+    try:
+        img_data = cv2.imread(input_path)
+        if img_data is None:
+            return BatchResult(input_path, output_path, mask_path, error="unreadable image", name=name)
+        image = Image(cv2.cvtColor(img_data, cv2.COLOR_BGR2RGB), mode=ImageMode.RGB)
+        timings['load'] = time.perf_counter() - start
+
+        recorder = StageRecorder()
+        detection = _detector.detect_regions(image, recorder=recorder)
+        mask = _detector.build_mask(detection, recorder=recorder)
+        inpainted = None
+        if output_path is not None:
+            inpainted = _detector.inpaint(detection, recorder=recorder)
+        timings.update(recorder.timings)
+
+        step_start = time.perf_counter()
+        if inpainted is not None:
+            inpainted_bgr = Image.copy(inpainted, target_mode=ImageMode.BGR)
+            cv2.imwrite(output_path, inpainted_bgr.data)
+        record = None
+        if mask_path is not None:
+            cv2.imwrite(mask_path, mask.data)
+        else:
+            record = result_record(detection)
+        timings['write'] = time.perf_counter() - step_start
+    except cv2.error as e:
+        return BatchResult(input_path, output_path, mask_path, error=str(e), name=name)
+    except Exception as e:
+        return BatchResult(input_path, output_path, mask_path,
+                           error="{}: {}".format(type(e).__name__, e), name=name)
+
+    seconds = time.perf_counter() - start
+    stages = [record.as_dict() for record in recorder.records]
+    return BatchResult(input_path, output_path, mask_path,
+                       seconds=seconds, timings=timings, stages=stages, record=record, name=name)
+
+
+def process_paths(input_paths, output_folder: str,
+                  detector_kwargs: dict = None,
+                  workers: int = None,
+                  max_in_flight: int = None,
+                  overwrite: bool = False,
+                  mask_only: bool = False,
+                  mask_format: str = 'png'):
+    """Remove text from the images at input_paths and write the results to
+    output_folder, yielding a BatchResult for every image as it finishes.
+
+    input_paths may be any iterable of paths, or of (path, name) pairs
+    naming the outputs relative to output_folder as in output_paths. Inputs
+    whose outputs would have the same name as an earlier input's fail
+    instead of overwriting them. input_paths is consumed lazily, so that at most
+    max_in_flight images (twice the number of workers by default) are queued
+    at once. Images whose outputs already exist are skipped unless
+    overwrite is set, which makes an interrupted run resumable. With
+    mask_only the images are not inpainted and only their masks are written.
+
+    With the 'png' mask_format, every mask is written as NAME_mask.png. With
+    'rle', the regions and run-length encoded mask of every image are
+    appended as a JSON line to RECORDS_FILENAME in output_folder instead,
+    see serialization. An image then counts as done once its record is in
+    the file, and its inpainted image exists unless mask_only is set. Runs
+    with overwrite append new records, readers keep the last record of an
+    image.
+    """
+    if mask_format not in ('png', 'rle'):
+        raise ValueError("Unknown mask format {}, use png or rle".format(mask_format))
+    detector_kwargs = detector_kwargs or {}
+    workers = workers or os.cpu_count() or 1
+    max_in_flight = max_in_flight or 2 * workers
+    os.makedirs(output_folder, exist_ok=True)
+    records_path = os.path.join(output_folder, RECORDS_FILENAME)
+    recorded = set()
+    if mask_format == 'rle' and not overwrite:
+        recorded = _recorded_names(records_path)
+
+    def is_done(name: str, outputs: [str]) -> bool:
+        if overwrite:
+            return False
+        if mask_format == 'rle' and name not in recorded:
+            return False
+        return all(os.path.exists(path) for path in outputs)
+
+    def pending_jobs():
+        # Input path of every output name, masks are named after the stem
+        claimed = {}
+        for item in input_paths:
+            input_path, name = item if isinstance(item, tuple) else (item, os.path.basename(item))
+            output_path, mask_path = output_paths(input_path, output_folder, mask_only=mask_only,
+                                                  mask_format=mask_format, name=name)
+            key = os.path.normcase(os.path.splitext(os.path.normpath(name))[0])
+            if key in claimed:
+                yield BatchResult(input_path, output_path, mask_path, name=name,
+                                  error="same output name as {}".format(claimed[key]))
+                continue
+            claimed[key] = input_path
+
+            outputs = [path for path in (output_path, mask_path) if path is not None]
+            if is_done(name, outputs):
+                yield BatchResult(input_path, output_path, mask_path, skipped=True, name=name)
+                continue
+            os.makedirs(os.path.dirname(os.path.join(output_folder, name)), exist_ok=True)
+            yield input_path, output_path, mask_path, name
+
+    results = _process_jobs(pending_jobs(), detector_kwargs, workers, max_in_flight)
+    if mask_format == 'png':
+        yield from results
+        return
+
+    with JsonLinesWriter(records_path, append=True) as writer:
+        for result in results:
+            if result.record is not None:
+                writer.write(result.record, image=result.name)
+            yield result
+
+
+def _recorded_names(records_path: str) -> set:
+    """Return the names of the images with a record in records_path"""
+    names = set()
+    if not os.path.exists(records_path):
+        return names
+    with open(records_path) as records_file:
+        for line in records_file:
+            try:
+                names.add(json.loads(line)['image'])
+            except (ValueError, KeyError):
+                # A line cut short by a crash
+                continue
+    return names
+
+
+def _process_jobs(jobs, detector_kwargs: dict, workers: int, max_in_flight: int):
+    """Yield the BatchResult of every job, passing skipped results through"""
+    # Avoid the cost of spawning a pool for a single worker
+    if workers == 1:
+        init_worker(detector_kwargs)
+        for job in jobs:
+            yield job if isinstance(job, BatchResult) else _process_image(*job)
+        return
+
+    with worker_pool(workers, detector_kwargs) as executor:
+        in_flight = set()
+        for job in jobs:
+            if isinstance(job, BatchResult):
+                yield job
+                continue
+
+            if len(in_flight) >= max_in_flight:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+            in_flight.add(executor.submit(_process_image, *job))
+
+        for future in as_completed(in_flight):
+            yield future.result()
+
+
+def process_folder(input_folder: str, output_folder: str, **kwargs):
+    """Remove text from every image in input_folder, see process_paths"""
+    return process_paths(iter_image_paths(input_folder), output_folder, **kwargs)
@@ -0,0 +1,338 @@
+"""Reproducible benchmarks of the text detection pipeline.
+
+Synthetic documents are rendered with cv2.putText, so no external data is
+needed. Every stage of the pipeline is timed separately and end to end:
+
+    python benchmark.py --output results.json
+    python benchmark.py --output new.json --baseline results.json
+
+Against a baseline, stages slower than the tolerance are reported as
+regressions, and stages whose region or pixel counts changed as well, since
+their timings measure different work.
+
+With --imports, the time to import the modules in IMPORTS is measured
+instead, each in a fresh interpreter, and imports loading heavy modules
+they should not are reported as regressions:
+
+    python benchmark.py --imports --output imports.json
+"""
+from kv.image import Image, ImageMode
+from text_detection import TextDetection
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+import numpy as np
+import cv2
+
+
+class DocumentSpec:
+    """Description of a synthetic document"""
+    def __init__(self, name: str, width: int, height: int,
+                 num_lines: int, font_scale: float, background: str = 'noise', seed: int = 0):
+        self.name = name
+        self.width = width
+        self.height = height
+        self.num_lines = num_lines
+        self.font_scale = font_scale
+        self.background = background
+        self.seed = seed
+
+    def as_dict(self) -> dict:
+        return dict(vars(self))
+
+
+DOCUMENTS: [DocumentSpec] = [
+    DocumentSpec('sparse-small', 640, 480, num_lines=4, font_scale=0.8),
+    DocumentSpec('dense-small', 640, 480, num_lines=24, font_scale=0.7, background='gradient'),
+    DocumentSpec('sparse-hd', 1920, 1080, num_lines=6, font_scale=2.0, background='gradient'),
+    DocumentSpec('dense-hd', 1920, 1080, num_lines=40, font_scale=0.9),
+    DocumentSpec('dense-4k', 3840, 2160, num_lines=60, font_scale=1.6),
+]
+
+QUICK_DOCUMENTS = ['sparse-small', 'dense-small', 'sparse-hd']
+
+WORDS = ['lorem', 'ipsum', 'dolor', 'sit', 'amet', 'consectetur', 'adipiscing',
+         'elit', 'sed', 'do', 'eiusmod', 'tempor', 'incididunt', 'ut', 'labore',
+         'et', 'dolore', 'magna', 'aliqua', '2019', 'No.', 'ABC']
+
+
+def render_document(spec: DocumentSpec) -> Image:
+    """Render the synthetic RGB document described by spec"""
+    rng = np.random.RandomState(spec.seed)
+    if spec.background == 'gradient':
+        ramp = np.linspace(150, 250, spec.width, dtype=np.float32)
+        data = np.repeat(ramp[np.newaxis, :, np.newaxis], spec.height, axis=0)
+        data = np.repeat(data, 3, axis=2)
+    else:
+        data = np.full((spec.height, spec.width, 3), 210, dtype=np.float32)
+    data += rng.normal(0, 8, data.shape)
+    data = np.clip(data, 0, 255).astype(np.uint8)
+
+    line_height = spec.height / (spec.num_lines + 1)
+    for line in range(spec.num_lines):
+        words = rng.choice(WORDS, size=rng.randint(2, 10))
+        text = " ".join(words)
+        x = int(rng.randint(0, max(1, spec.width // 4)))
+        y = int((line + 1) * line_height)
+        color = tuple(int(c) for c in rng.randint(0, 80, 3))
+        thickness = max(1, int(round(spec.font_scale * 2)))
+        cv2.putText(data, text, (x, y), cv2.FONT_HERSHEY_SIMPLEX,
+                    spec.font_scale, color, thickness, cv2.LINE_AA)
+
+    # Soften the document like the optics of a scanner or camera. MSER
+    # misses most of the hard edged glyphs putText draws over the noise.
+    data = cv2.GaussianBlur(data, (0, 0), 0.5 * spec.font_scale)
+    return Image(data, mode=ImageMode.RGB)
+
+
+def _time(function, repeat: int, setup=None) -> (float, object):
+    """Return the median wall time of repeat calls to function and its last result.
+
+    When setup is given, function is called with the result of a fresh,
+    untimed call to setup on every run.
+    """
+    times = []
+    result = None
+    for _ in range(repeat):
+        args = () if setup is None else (setup(),)
+        start = time.perf_counter()
+        result = function(*args)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times), result
+
+
+def benchmark_document(spec: DocumentSpec, repeat: int = 3, detector_kwargs: dict = None) -> dict:
+    detector_kwargs = detector_kwargs or {}
+    detector = TextDetection(**detector_kwargs)
+    image = render_document(spec)
+    image_rgb = Image.copy(image, target_mode=ImageMode.RGB)
+
+    timings = {}
+    counts = {}
+
+    timings['mser'], regions = _time(lambda: detector._mser.detect(image_rgb), repeat)
+    counts['mser'] = len(regions)
+
+    # Combining merges regions in place, so every run gets fresh regions
+    timings['combine'], combined = _time(TextDetection._combine_enclosing_regions,
+                                         repeat,
+                                         setup=lambda: detector._mser.detect(image_rgb))
+    counts['combine'] = len(combined)
+
+    timings['group'], groups = _time(
+        lambda: TextDetection._group_mser_regions(combined,
+                                                  threshold_delta_x=detector._threshold_delta_x,
+                                                  threshold_delta_y=detector._threshold_delta_y),
+        repeat
+    )
+    flattened = TextDetection._flatten_and_filter(groups,
+                                                  threshold_num_groups=detector._threshold_num_groups)
+    counts['group'] = len(flattened)
+
+    def build_mask():
+        mask = TextDetection._mask_from_groups(flattened, image_rgb.size,
+                                               bounding_boxes_only=detector._bounding_box_mask)
+        mask.dilate(iterations=detector._num_dilations)
+        return mask
+
+    timings['mask'], mask = _time(build_mask, repeat)
+    counts['mask'] = int(np.count_nonzero(mask.data))
+
+    timings['inpaint'], _ = _time(lambda: detector._inpaint(image_rgb, mask), repeat)
+    timings['end_to_end'], _ = _time(lambda: detector.detect(image), repeat)
+
+    return {'document': spec.as_dict(), 'timings': timings, 'counts': counts}
+
+
+def run(documents: [DocumentSpec], repeat: int = 3, detector_kwargs: dict = None) -> dict:
+    results = {}
+    for spec in documents:
+        results[spec.name] = benchmark_document(spec, repeat=repeat, detector_kwargs=detector_kwargs)
+    return {
+        'environment': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'opencv': cv2.__version__,
+            'machine': platform.machine(),
+        },
+        'repeat': repeat,
+        'detector': detector_kwargs or {},
+        'results': results,
+    }
+
+
+def compare(current: dict, baseline: dict, tolerance: float = 0.25) -> [str]:
+    """Return a line per stage comparing current with baseline timings,
+    marking stages more than tolerance slower than the baseline, and a line
+    per stage whose count differs from the baseline, as the timings of a
+    pipeline detecting something else are not comparable"""
+    lines = []
+    for name, result in current['results'].items():
+        baseline_result = baseline['results'].get(name)
+        if baseline_result is None:
+            continue
+        for stage, seconds in result['timings'].items():
+            baseline_seconds = baseline_result['timings'].get(stage)
+            if not baseline_seconds:
+                continue
+            ratio = seconds / baseline_seconds
+            flag = "REGRESSION" if ratio > 1 + tolerance else ""
+            lines.append("{:<14}{:<12}{:>10.2f}ms{:>10.2f}ms{:>8.2f}x  {}".format(
+                name, stage, 1000 * baseline_seconds, 1000 * seconds, ratio, flag
+            ).rstrip())
+        for stage, count in result.get('counts', {}).items():
+            baseline_count = baseline_result.get('counts', {}).get(stage)
+            if baseline_count is None or baseline_count == count:
+                continue
+            lines.append("{:<14}{:<12}{:>12}{:>12}{:>9}  COUNT CHANGED".format(
+                name, stage, baseline_count, count, ""))
+    return lines
+
+
+# Modules whose import dominates cold start times
+HEAVY_MODULES = ['cv2', 'numpy', 'matplotlib']
+
+# (import statement, heavy modules it must not load)
+IMPORTS = [
+    ('import kv', HEAVY_MODULES),
+    ('from kv.image import ImageMode', HEAVY_MODULES),
+    ('from kv.mser import MSERConfiguration', HEAVY_MODULES),
+    ('import utils', HEAVY_MODULES),
+    ('from kv.image import Image', ['matplotlib']),
+    ('import text_detection', ['matplotlib']),
+]
+
+_IMPORT_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+exec({statement!r})
+seconds = time.perf_counter() - start
+print(json.dumps({{'seconds': seconds, 'loaded': [name for name in {heavy!r} if name in sys.modules]}}))
+"""
+
+
+def time_import(statement: str, repeat: int = 3) -> dict:
+    """Return the median seconds statement takes in a fresh interpreter and
+    the heavy modules it loads"""
+    script = _IMPORT_SCRIPT.format(statement=statement, heavy=HEAVY_MODULES)
+    directory = os.path.dirname(os.path.abspath(__file__))
+    times = []
+    loaded = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, '-c', script], cwd=directory, check=True,
+                                stdout=subprocess.PIPE, universal_newlines=True).stdout
+        result = json.loads(output.splitlines()[-1])
+        times.append(result['seconds'])
+        loaded = result['loaded']
+    return {'seconds': statistics.median(times), 'loaded': loaded}
+
+
+def run_imports(repeat: int = 3) -> dict:
+    results = {}
+    for statement, forbidden in IMPORTS:
+        result = time_import(statement, repeat=repeat)
+        result['forbidden'] = [name for name in result['loaded'] if name in forbidden]
+        results[statement] = result
+    return {
+        'environment': {
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+        },
+        'repeat': repeat,
+        'imports': results,
+    }
+
+
+def compare_imports(current: dict, baseline: dict = None, tolerance: float = 0.25,
+                    slack: float = 0.005) -> [str]:
+    """Return a line per import, marking imports loading forbidden modules
+    or more than tolerance and slack seconds slower than the baseline"""
+    lines = []
+    baseline_imports = baseline['imports'] if baseline else {}
+    for statement, result in current['imports'].items():
+        seconds = result['seconds']
+        baseline_seconds = baseline_imports.get(statement, {}).get('seconds')
+        flag = ""
+        if baseline_seconds and seconds > baseline_seconds * (1 + tolerance) + slack:
+            flag = "REGRESSION"
+        if result['forbidden']:
+            flag = "REGRESSION loads " + ", ".join(result['forbidden'])
+        lines.append("{:<40}{:>10}{:>10.2f}ms  {:<24}{}".format(
+            statement,
+            "{:.2f}ms".format(1000 * baseline_seconds) if baseline_seconds else "-",
+            1000 * seconds, ", ".join(result['loaded']), flag
+        ).rstrip())
+    return lines
+
+
+def main_imports(args) -> int:
+    current = run_imports(repeat=args.repeat)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(current, output_file, indent=2)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+    lines = compare_imports(current, baseline, tolerance=args.tolerance)
+    print("{:<40}{:>10}{:>12}  {}".format("import", "baseline", "current", "loads"))
+    for line in lines:
+        print(line)
+    if any("REGRESSION" in line for line in lines):
+        return 1
+    return 0
+
+
+def main(argv: [str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the text detection pipeline.")
+    parser.add_argument("-o", "--output", help="file to write the JSON results to")
+    parser.add_argument("-b", "--baseline", help="JSON results to compare against")
+    parser.add_argument("-r", "--repeat", type=int, default=3,
+                        help="runs per measurement, the median is reported")
+    parser.add_argument("--quick", action="store_true", help="only benchmark the small documents")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="relative slowdown reported as a regression")
+    parser.add_argument("--imports", action="store_true",
+                        help="benchmark module import times instead of the pipeline")
+    args = parser.parse_args(argv)
+
+    if args.imports:
+        return main_imports(args)
+
+    documents = DOCUMENTS
+    if args.quick:
+        documents = [spec for spec in DOCUMENTS if spec.name in QUICK_DOCUMENTS]
+
+    current = run(documents, repeat=args.repeat)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(current, output_file, indent=2)
+
+    for name, result in current['results'].items():
+        stages = " ".join("{}={:.1f}ms".format(stage, 1000 * seconds)
+                          for stage, seconds in result['timings'].items())
+        print("{:<14}{}".format(name, stages))
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        lines = compare(current, baseline, tolerance=args.tolerance)
+        print()
+        print("{:<14}{:<12}{:>12}{:>12}{:>9}".format("document", "stage", "baseline", "current", "ratio"))
+        for line in lines:
+            print(line)
+        if any(line.endswith(("REGRESSION", "COUNT CHANGED")) for line in lines):
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,164 @@
+from collections import OrderedDict
+from kv import Size
+from kv.image import Image
+import hashlib
+import os
+import tempfile
+import threading
+
+import numpy as np
+
+
+class CacheEntry:
+    """Cached detection of one image: the undilated mask, the kept regions and
+    the size of the image they were detected on"""
+    def __init__(self, mask: np.ndarray, bboxes: np.ndarray, group_ids: np.ndarray,
+                 detection_size: Size):
+        # The mask is stored bit-packed, it only holds 0 and 255
+        self._mask_shape = mask.shape
+        self._packed_mask = np.packbits(mask > 0, axis=None)
+
+        # (N, 4) int32 (x0, y0, x1, y1) bounding boxes of the kept regions
+        self.bboxes = bboxes
+
+        # Index of the text group every kept region belongs to
+        self.group_ids = group_ids
+
+        # Size of the possibly downsized image the regions were detected on
+        self.detection_size = detection_size
+
+    @property
+    def mask(self) -> np.ndarray:
+        """Return a new uint8 copy of the undilated mask"""
+        num_pixels = int(np.prod(self._mask_shape))
+        bits = np.unpackbits(self._packed_mask, count=num_pixels)
+        return (bits * 255).astype(np.uint8).reshape(self._mask_shape)
+
+    @property
+    def nbytes(self) -> int:
+        return self._packed_mask.nbytes + self.bboxes.nbytes + self.group_ids.nbytes
+
+    def save(self, path: str):
+        np.savez_compressed(path,
+                            mask_shape=np.array(self._mask_shape),
+                            packed_mask=self._packed_mask,
+                            bboxes=self.bboxes,
+                            group_ids=self.group_ids,
+                            detection_size=np.array(self.detection_size.as_tuple()))
+
+    @classmethod
+    def load(cls, path: str):
+        with np.load(path) as npz:
+            entry = cls.__new__(cls)
+            entry._mask_shape = tuple(int(d) for d in npz['mask_shape'])
+            entry._packed_mask = npz['packed_mask']
+            entry.bboxes = npz['bboxes']
+            entry.group_ids = npz['group_ids']
+            entry.detection_size = Size(*(int(d) for d in npz['detection_size']))
+        return entry
+
+
+class DetectionCache:
+    """Cache of detection results keyed by image content and parameters.
+
+    Entries live in an in-memory LRU tier holding at most max_bytes and, when
+    a directory is given, in a compressed NPZ tier on disk which survives
+    restarts and is shared between processes.
+    """
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024, directory: str = None):
+        self._max_bytes = max_bytes
+        self._directory = directory
+        self._entries = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(image: Image, parameters: dict) -> str:
+        """Return a hash of the pixels and mode of image and the parameters"""
+        digest = hashlib.blake2b(digest_size=16)
+        data = np.ascontiguousarray(image.data)
+        digest.update(repr((data.shape, data.dtype.str, image.mode.value)).encode())
+        digest.update(repr(sorted(parameters.items())).encode())
+        digest.update(memoryview(data).cast('B'))
+        return digest.hexdigest()
+
+    @property
+    def nbytes(self) -> int:
+        return self._nbytes
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key: str) -> CacheEntry:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+
+        entry = self._load(key)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._add(key, entry)
+        return entry
+
+    def put(self, key: str, entry: CacheEntry):
+        with self._lock:
+            self._add(key, entry)
+        self._save(key, entry)
+
+    def clear(self):
+        """Empty the in-memory tier"""
+        with self._lock:
+            self._entries.clear()
+            self._nbytes = 0
+
+    def _add(self, key: str, entry: CacheEntry):
+        if key in self._entries:
+            self._nbytes -= self._entries.pop(key).nbytes
+        if entry.nbytes > self._max_bytes:
+            return
+
+        self._entries[key] = entry
+        self._nbytes += entry.nbytes
+        while self._nbytes > self._max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._nbytes -= evicted.nbytes
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self._directory, key + '.npz')
+
+    def _load(self, key: str) -> CacheEntry:
+        if self._directory is None:
+            return None
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            return CacheEntry.load(path)
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _save(self, key: str, entry: CacheEntry):
+        if self._directory is None:
+            return
+        # Write to a temporary file first so readers never see partial files
+        fd, temp_path = tempfile.mkstemp(suffix='.npz', dir=self._directory)
+        try:
+            with os.fdopen(fd, 'wb') as temp_file:
+                entry.save(temp_file)
+            os.replace(temp_path, self._path(key))
+        except OSError:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
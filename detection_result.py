@@ -0,0 +1,50 @@
+from kv.image import GrayscaleImage, Image
+import numpy as np
+
+
+class DetectionResult:
+    """Text detected in one image by TextDetection.detect_regions.
+
+    The mask is filled in by TextDetection.build_mask, so that detection can
+    run separately from, and without, mask building and inpainting.
+    """
+    __slots__ = ('image', 'bboxes', 'group_ids', 'groups', 'detection_size',
+                 'undilated_mask', 'mask', 'cache_key', 'timings')
+
+    def __init__(self, image: Image):
+        # The image in RGB the text was detected in
+        self.image = image
+
+        # (N, 4) int32 (x0, y0, x1, y1) bounding boxes of the kept regions,
+        # in image coordinates
+        self.bboxes = np.empty((0, 4), dtype=np.int32)
+
+        # Index of the text group every kept region belongs to
+        self.group_ids = np.empty(0, dtype=np.int32)
+
+        # Kept MSERRegion groups in detection coordinates, None when the
+        # result was restored from a cache. TiledTextDetection keeps regions
+        # without pixels instead, which refer to the tile they were found on.
+        self.groups = None
+
+        # Size of the possibly downsized image the regions were detected on
+        self.detection_size = image.size
+
+        self.undilated_mask: GrayscaleImage = None
+        self.mask: GrayscaleImage = None
+        self.cache_key: str = None
+
+        # Seconds spent in each stage, by stage name
+        self.timings = {}
+
+    @property
+    def has_text(self) -> bool:
+        return len(self.bboxes) > 0
+
+    @property
+    def num_groups(self) -> int:
+        return len(np.unique(self.group_ids))
+
+    def add_timings(self, records):
+        for record in records:
+            self.timings[record.name] = self.timings.get(record.name, 0.) + record.seconds
@@ -0,0 +1,234 @@
+"""Remove text from images on the command line.
+
+    python imagetextremover.py [options] INPUT [INPUT ...] --output-dir DIR
+
+Each INPUT may be an image file, a directory of images or a glob pattern.
+"""
+import argparse
+import glob
+import os
+import sys
+
+
+def iter_input_paths(inputs: [str]):
+    """Lazily expand files, directories and glob patterns into (path, name)
+    pairs of image paths and the names of their outputs.
+
+    Files and the images of directories keep their file name, the images
+    matched by a glob pattern their path relative to the part of the
+    pattern before the first wildcard, so that recursive patterns keep the
+    folder structure.
+    """
+    from batch import iter_image_paths
+
+    for pattern in inputs:
+        if os.path.isdir(pattern):
+            for path in iter_image_paths(pattern):
+                yield path, os.path.basename(path)
+        elif os.path.isfile(pattern):
+            yield pattern, os.path.basename(pattern)
+        else:
+            root = _glob_root(pattern)
+            for path in sorted(glob.iglob(pattern, recursive=True)):
+                if os.path.isfile(path):
+                    yield path, os.path.relpath(path, root)
+
+
+def _glob_root(pattern: str) -> str:
+    """Return the folder of pattern before its first wildcard"""
+    parts = []
+    for part in os.path.normpath(pattern).split(os.sep):
+        if any(character in part for character in '*?['):
+            break
+        parts.append(part)
+    return os.sep.join(parts) or os.curdir
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="imagetextremover",
+        description="Detect text in images and remove it by inpainting."
+    )
+    parser.add_argument("inputs", nargs="+", metavar="INPUT",
+                        help="image files, directories or glob patterns")
+    parser.add_argument("-o", "--output-dir", required=True,
+                        help="folder to write the inpainted images and masks to")
+    parser.add_argument("-w", "--workers", type=int, default=None,
+                        help="number of worker processes (default: number of CPUs)")
+    parser.add_argument("--max-in-flight", type=int, default=None,
+                        help="maximum number of images queued at once (default: 2 x workers)")
+    parser.add_argument("--mask-only", action="store_true",
+                        help="only write the text masks, skip inpainting")
+    parser.add_argument("--mask-format", choices=['png', 'rle'], default='png',
+                        help="write masks as NAME_mask.png files, or append the regions and "
+                             "run-length encoded masks to masks.jsonl")
+    parser.add_argument("--overwrite", action="store_true",
+                        help="process images whose outputs already exist")
+    parser.add_argument("--cache-dir", default=None,
+                        help="folder caching detections across runs, images already detected "
+                             "with the same detection parameters skip detection")
+    parser.add_argument("--profile", action="store_true",
+                        help="print a per-stage timing breakdown")
+    parser.add_argument("-q", "--quiet", action="store_true",
+                        help="do not print a line per image")
+
+    detection = parser.add_argument_group("detection parameters")
+    detection.add_argument("--mser-delta", type=int, default=25)
+    detection.add_argument("--mser-deltas", type=str, default=None,
+                           help="comma separated MSER deltas run concurrently and fused, "
+                                "overrides --mser-delta")
+    detection.add_argument("--mser-invert", action="store_true",
+                           help="also run MSER on the inverted image, for light text on dark")
+    detection.add_argument("--threshold-delta-x", type=float, default=1.8)
+    detection.add_argument("--threshold-delta-y", type=float, default=1.0)
+    detection.add_argument("--threshold-num-groups", type=int, default=2)
+    detection.add_argument("--num-dilations", type=int, default=0)
+    detection.add_argument("--inpaint-radius", type=int, default=10)
+    detection.add_argument("--bounding-box-mask", action="store_true",
+                           help="mask region bounding boxes instead of region pixels")
+    detection.add_argument("--largest-dimension", type=int, default=None,
+                           help="downsize larger images to this dimension for detection")
+    detection.add_argument("--no-roi-inpaint", dest="roi_inpaint", action="store_false",
+                           help="inpaint the whole image instead of crops around the text")
+    detection.add_argument("--inpaint-workers", type=int, default=1,
+                           help="number of threads inpainting crops of one image")
+    detection.add_argument("--inpaint-backend", default='ns',
+                           choices=['ns', 'telea', 'median', 'mean', 'pyramid'],
+                           help="backend inpainting the text")
+    detection.add_argument("--flat-threshold", type=float, default=None,
+                           help="fill text whose surroundings have at most this spread between "
+                                "their 10th and 90th percentile with --flat-backend instead")
+    detection.add_argument("--flat-backend", default='median',
+                           choices=['ns', 'telea', 'median', 'mean', 'pyramid'])
+
+    tuning = parser.add_argument_group("auto-tuning",
+                                       "choose the MSER delta, grouping thresholds and detection "
+                                       "size per image to stay within a time budget")
+    tuning.add_argument("--tuning-profile", default=None,
+                        help="profile written by tuning.py, loaded by every worker")
+    tuning.add_argument("--time-budget", type=float, default=None,
+                        help="seconds detection may take per image, overrides the profile's")
+
+    prefilter = parser.add_argument_group("region pre-filter",
+                                          "drop regions that are obviously not text before grouping")
+    prefilter.add_argument("--min-region-points", type=int, default=None,
+                           help="minimum number of pixels of a region")
+    prefilter.add_argument("--max-aspect-ratio", type=float, default=None,
+                           help="maximum ratio of the longer to the shorter bounding box side")
+    prefilter.add_argument("--min-fill-ratio", type=float, default=None,
+                           help="minimum ratio of region pixels to bounding box area")
+    prefilter.add_argument("--max-stroke-width-ratio", type=float, default=None,
+                           help="maximum ratio of the widest stroke to the longer bounding box side")
+    return parser
+
+
+def mser_configurations_from_args(args):
+    if args.mser_deltas is None and not args.mser_invert:
+        return None
+
+    from kv.mser import MSERConfiguration
+
+    deltas = [args.mser_delta]
+    if args.mser_deltas is not None:
+        deltas = [int(delta) for delta in args.mser_deltas.split(',') if delta.strip()]
+    inverts = [False, True] if args.mser_invert else [False]
+    return [MSERConfiguration(delta, invert=invert) for delta in deltas for invert in inverts]
+
+
+def detector_kwargs_from_args(args) -> dict:
+    kwargs = {
+        'mser_delta': args.mser_delta,
+        'mser_configurations': mser_configurations_from_args(args),
+        'threshold_delta_x': args.threshold_delta_x,
+        'threshold_delta_y': args.threshold_delta_y,
+        'threshold_num_groups': args.threshold_num_groups,
+        'num_dilations': args.num_dilations,
+        'inpaint_radius': args.inpaint_radius,
+        'bounding_box_mask': args.bounding_box_mask,
+        'largest_dimension': args.largest_dimension,
+        'roi_inpaint': args.roi_inpaint,
+        'inpaint_workers': args.inpaint_workers,
+        'inpaint_backend': args.inpaint_backend,
+        'flat_backend': args.flat_backend,
+        'flat_threshold': args.flat_threshold,
+        'min_region_points': args.min_region_points,
+        'max_aspect_ratio': args.max_aspect_ratio,
+        'min_fill_ratio': args.min_fill_ratio,
+        'max_stroke_width_ratio': args.max_stroke_width_ratio,
+    }
+    if args.tuning_profile is not None:
+        kwargs['tuning_profile'] = args.tuning_profile
+    if args.time_budget is not None:
+        kwargs['time_budget'] = args.time_budget
+    if args.cache_dir is not None:
+        kwargs['cache_dir'] = args.cache_dir
+    return kwargs
+
+
+def print_profile(results, file=sys.stdout):
+    totals = {}
+    for result in results:
+        for stage, seconds in result.timings.items():
+            totals.setdefault(stage, []).append(seconds)
+
+    if len(totals) == 0:
+        print("No images processed.", file=file)
+        return
+
+    grand_total = sum(sum(seconds) for seconds in totals.values())
+    print("{:<16}{:>10}{:>12}{:>12}{:>8}".format("stage", "images", "total (s)", "mean (ms)", "%"),
+          file=file)
+    for stage, seconds in totals.items():
+        total = sum(seconds)
+        print("{:<16}{:>10}{:>12.3f}{:>12.1f}{:>8.1f}".format(
+            stage, len(seconds), total, 1000 * total / len(seconds),
+            100 * total / grand_total if grand_total else 0.
+        ), file=file)
+
+    pixel_counts = {}
+    for result in results:
+        for stage in result.stages:
+            if stage['name'] == 'inpaint':
+                for backend, count in stage['details'].items():
+                    pixel_counts[backend] = pixel_counts.get(backend, 0) + count
+    if pixel_counts:
+        total = sum(pixel_counts.values())
+        print("inpainted pixels: " + ", ".join(
+            "{} {:.1f}%".format(backend, 100 * count / total) for backend, count in pixel_counts.items()
+        ), file=file)
+
+
+def main(argv: [str] = None) -> int:
+    args = build_parser().parse_args(argv)
+
+    # Deferred so that argument errors and --help return without loading OpenCV
+    from batch import process_paths
+
+    results = process_paths(iter_input_paths(args.inputs),
+                            args.output_dir,
+                            detector_kwargs=detector_kwargs_from_args(args),
+                            workers=args.workers,
+                            max_in_flight=args.max_in_flight,
+                            overwrite=args.overwrite,
+                            mask_only=args.mask_only,
+                            mask_format=args.mask_format)
+
+    num_failed = 0
+    processed = []
+    for result in results:
+        if result.error:
+            num_failed += 1
+            print(result, file=sys.stderr)
+        elif not args.quiet:
+            print(result)
+        if not result.skipped and not result.error:
+            processed.append(result)
+
+    if args.profile:
+        print_profile(processed)
+
+    return 1 if num_failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,128 @@
+"""Inpainting backends filling the masked pixels of an image.
+
+TextDetection picks a backend per mask component: components surrounded by
+a near-uniform ring of pixels, like text on the paper of a scanned document,
+are filled with the ring's median or mean, all others go to the configured
+backend.
+"""
+from abc import ABC, abstractmethod
+
+import numpy as np
+import cv2
+
+# Width of the ring of pixels around a mask component that FillInpaint and
+# is_flat read
+RING_WIDTH = 3
+
+
+class InpaintBackend(ABC):
+    """Fills the masked pixels of an image"""
+    name = ''
+
+    @abstractmethod
+    def inpaint(self, data: np.ndarray, mask: np.ndarray, radius: int) -> np.ndarray:
+        """Return a copy of data with the pixels where mask is non zero filled in"""
+
+
+class OpenCVInpaint(InpaintBackend):
+    """cv2.inpaint with the Navier-Stokes or Telea method"""
+    def __init__(self, name: str, flags: int):
+        self.name = name
+        self._flags = flags
+
+    def inpaint(self, data: np.ndarray, mask: np.ndarray, radius: int) -> np.ndarray:
+        return cv2.inpaint(data, mask, radius, self._flags)
+
+
+class FillInpaint(InpaintBackend):
+    """Fills the masked pixels with the median or mean of the ring around them.
+
+    Only suited to near-uniform surroundings, see is_flat.
+    """
+    def __init__(self, statistic: str = 'median', ring_width: int = RING_WIDTH):
+        if statistic not in ('median', 'mean'):
+            raise ValueError("Unknown fill statistic {}".format(statistic))
+        self.name = statistic
+        self._statistic = np.median if statistic == 'median' else np.mean
+        self._ring_width = ring_width
+
+    def inpaint(self, data: np.ndarray, mask: np.ndarray, radius: int) -> np.ndarray:
+        inpainted = np.copy(data)
+        ring = ring_mask(mask, self._ring_width)
+        if not ring.any():
+            return inpainted
+        # Rounded rather than truncated, as the mean and the median of an
+        # even number of pixels fall between integers
+        inpainted[mask > 0] = np.rint(self._statistic(data[ring], axis=0)).astype(data.dtype)
+        return inpainted
+
+
+class PyramidInpaint(InpaintBackend):
+    """Inpaints a downsampled copy and upsamples the filled pixels.
+
+    Every level halves the resolution, so the inpainting backend processes
+    4 ** levels fewer pixels, at the cost of blurrier fills.
+    """
+    name = 'pyramid'
+
+    def __init__(self, levels: int = 2, backend: InpaintBackend = None):
+        self._levels = levels
+        self._backend = backend or OpenCVInpaint('ns', cv2.INPAINT_NS)
+
+    def inpaint(self, data: np.ndarray, mask: np.ndarray, radius: int) -> np.ndarray:
+        height, width = mask.shape[:2]
+        scale = 2 ** self._levels
+        small_size = (max(1, width // scale), max(1, height // scale))
+
+        small_data = cv2.resize(data, small_size, interpolation=cv2.INTER_AREA)
+        # Pixels partially covered by the mask are masked at low resolution
+        small_mask = cv2.resize(mask, small_size, interpolation=cv2.INTER_AREA)
+        small_mask = np.where(small_mask > 0, 255, 0).astype(np.uint8)
+        small_inpainted = self._backend.inpaint(small_data, small_mask, max(1, radius // scale))
+
+        upsampled = cv2.resize(small_inpainted, (width, height), interpolation=cv2.INTER_LINEAR)
+        inpainted = np.copy(data)
+        masked = mask > 0
+        inpainted[masked] = upsampled[masked]
+        return inpainted
+
+
+BACKENDS = {
+    'ns': OpenCVInpaint('ns', cv2.INPAINT_NS),
+    'telea': OpenCVInpaint('telea', cv2.INPAINT_TELEA),
+    'median': FillInpaint('median'),
+    'mean': FillInpaint('mean'),
+    'pyramid': PyramidInpaint(),
+}
+
+
+def get_backend(backend) -> InpaintBackend:
+    """Return the backend named backend in BACKENDS, or backend itself"""
+    if isinstance(backend, InpaintBackend):
+        return backend
+    if backend not in BACKENDS:
+        raise ValueError("Unknown inpainting backend {}, use one of {}".format(
+            backend, ", ".join(BACKENDS)))
+    return BACKENDS[backend]
+
+
+def ring_mask(mask: np.ndarray, width: int = RING_WIDTH) -> np.ndarray:
+    """Return the boolean mask of the unmasked pixels within width of mask"""
+    kernel = np.ones((2 * width + 1, 2 * width + 1), np.uint8)
+    return (cv2.dilate(mask, kernel) > 0) & (mask == 0)
+
+
+def is_flat(data: np.ndarray, mask: np.ndarray, threshold: float, width: int = RING_WIDTH) -> bool:
+    """Return whether the spread between the 10th and 90th percentile of
+    every channel of the ring of pixels around mask is at most threshold.
+
+    Unlike the standard deviation, the spread ignores the few pixels of
+    undetected glyphs and anti-aliasing that end up in most rings. For
+    Gaussian noise it is about 2.6 times the standard deviation.
+    """
+    ring = ring_mask(mask, width)
+    if not ring.any():
+        return False
+    low, high = np.percentile(data[ring], [10, 90], axis=0)
+    return bool(np.all(high - low <= threshold))
+
@@ -0,0 +1,90 @@
+from contextlib import contextmanager
+import time
+
+
+class StageRecord:
+    def __init__(self, name: str, count_in: int = None):
+        self.name = name
+        # Wall time spent in the stage
+        self.seconds = 0.
+        # Number of items (regions, groups, ...) entering and leaving the stage
+        self.count_in = count_in
+        self.count_out = None
+        # Size of the arrays allocated by the stage
+        self.nbytes = 0
+        # Stage specific counts, for example of dropped items by reason
+        self.details = {}
+
+    def as_dict(self) -> dict:
+        return {
+            'name': self.name,
+            'seconds': self.seconds,
+            'count_in': self.count_in,
+            'count_out': self.count_out,
+            'nbytes': self.nbytes,
+            'details': dict(self.details),
+        }
+
+    def __str__(self):
+        text = "{}: {:.2f}ms in={} out={} bytes={}".format(
+            self.name, 1000 * self.seconds, self.count_in, self.count_out, self.nbytes
+        )
+        if self.details:
+            text += " " + " ".join("{}={}".format(key, value) for key, value in self.details.items())
+        return text
+
+
+class StageRecorder:
+    """Records wall time, item counts and allocation sizes of pipeline stages.
+
+        recorder = StageRecorder()
+        detector.detect(image, recorder=recorder)
+        for record in recorder.records:
+            print(record)
+    """
+    def __init__(self):
+        self.records: [StageRecord] = []
+
+    @contextmanager
+    def stage(self, name: str, count_in: int = None):
+        record = StageRecord(name, count_in=count_in)
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record.seconds = time.perf_counter() - start
+            self.records.append(record)
+
+    @property
+    def timings(self) -> dict:
+        """Return the seconds spent in each stage, by stage name"""
+        timings = {}
+        for record in self.records:
+            timings[record.name] = timings.get(record.name, 0.) + record.seconds
+        return timings
+
+    @property
+    def total_seconds(self) -> float:
+        return sum(record.seconds for record in self.records)
+
+
+class _NullStage:
+    def __init__(self):
+        self._record = StageRecord('null')
+
+    def __enter__(self) -> StageRecord:
+        return self._record
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+class NullRecorder:
+    """Recorder that discards everything, used when instrumentation is off"""
+    _stage = _NullStage()
+
+    def stage(self, name: str, count_in: int = None) -> _NullStage:
+        return self._stage
+
+
+NULL_RECORDER = NullRecorder()
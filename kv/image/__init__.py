@@ -1,4 +1,23 @@
 from kv.image.image_mode import ImageMode
-from kv.image.grayscale_image import GrayscaleImage
-from kv.image.image import Image
+import importlib
 
+# Image and GrayscaleImage import OpenCV and NumPy, so they are only loaded
+# on first access
+_LAZY_ATTRIBUTES = {
+    'GrayscaleImage': 'kv.image.grayscale_image',
+    'Image': 'kv.image.image',
+}
+
+__all__ = ['ImageMode', 'GrayscaleImage', 'Image']
+
+
+def __getattr__(name):
+    if name not in _LAZY_ATTRIBUTES:
+        raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+    value = getattr(importlib.import_module(_LAZY_ATTRIBUTES[name]), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY_ATTRIBUTES))
@@ -6,14 +6,25 @@ import cv2
 
 
 class GrayscaleImage(Image):
-    def __init__(self, data):
+    def __init__(self, data, mode=ImageMode.GRAY):
+        if mode != ImageMode.GRAY:
+            raise ValueError("Grayscale image cannot be in mode {}".format(mode))
         super().__init__(data, mode=ImageMode.GRAY)
 
     def dilate(self, kernel_size: int=5, iterations: int=1):
         kernel = np.ones((kernel_size, kernel_size), np.uint8)
         self._data = cv2.dilate(self._data, kernel, iterations=iterations)
+        self.invalidate()
 
     @classmethod
     def black_canvas(cls, size: Size):
-        data = np.zeros((size.height, size.width)).astype(np.uint8)
+        data = np.zeros((size.height, size.width), dtype=np.uint8)
         return cls(data)
+
+    @classmethod
+    def from_file(cls, path: str, mode=ImageMode.GRAY, shape=None, writable=False):
+        return super().from_file(path, mode=mode, shape=shape, writable=writable)
+
+    @classmethod
+    def create_file(cls, path: str, size: Size, mode=ImageMode.GRAY):
+        return super().create_file(path, size, mode=mode)
@@ -12,6 +12,10 @@ class Image:
         self._data = data
         self._mode = mode
 
+        # Converted images by mode, see Image.view. Code changing data in
+        # place must call invalidate.
+        self._conversions = {}
+
     @property
     def data(self) -> np.ndarray:
         return self._data
@@ -40,46 +44,115 @@ class Image:
         top_left = rectangle.origin.as_tuple()
         bottom_right = rectangle.end.as_tuple()
         cv2.rectangle(self.data, top_left, bottom_right, color.as_tuple(), thickness)
+        self.invalidate()
+
+    def invalidate(self):
+        """Forget the conversions cached by as_mode, which must be called
+        after changing data in place"""
+        self._conversions.clear()
 
     def value_at_point(self, point: Point):
         return self.data[point.y, point.x]
 
-    @classmethod
-    def copy(cls, img, target_mode: ImageMode=None):
-        dst_mode = target_mode if target_mode else img.mode
-
-        if img.mode == ImageMode.GRAY:
+    @staticmethod
+    def _converter(src_mode: ImageMode, dst_mode: ImageMode):
+        if src_mode == ImageMode.GRAY:
             if dst_mode != ImageMode.GRAY:
                 raise ValueError("Cannot convert Gray scale image to Color.")
 
-        img_data_copy = np.copy(img.data)
-        if img.mode == dst_mode:
-            return cls(img_data_copy, mode=dst_mode)
-
         converter = None
-        if img.mode == ImageMode.BGR:
+        if src_mode == ImageMode.BGR:
             if dst_mode == ImageMode.RGB:
                 converter = cv2.COLOR_BGR2RGB
             elif dst_mode == ImageMode.GRAY:
                 converter = cv2.COLOR_BGR2GRAY
-        elif img.mode == ImageMode.RGB:
+        elif src_mode == ImageMode.RGB:
             if dst_mode == ImageMode.BGR:
                 converter = cv2.COLOR_RGB2BGR
             elif dst_mode == ImageMode.GRAY:
                 converter = cv2.COLOR_RGB2GRAY
 
         if not converter:
-            raise ValueError("Cannot convert from {} to {}".format(img.mode, dst_mode))
+            raise ValueError("Cannot convert from {} to {}".format(src_mode, dst_mode))
+        return converter
+
+    def as_mode(self, mode: ImageMode, copy: bool = False, cache: bool = True):
+        """Return this image in mode.
+
+        Without copy, the image itself is returned when it already is in mode
+        and conversions are cached on the image, so repeated requests for the
+        same mode convert only once. The returned data must then be treated
+        as read-only, and changes to the data of this image in place must be
+        followed by invalidate, or later requests return stale conversions.
+
+        Without cache, a conversion cached earlier is still returned, but a
+        new one is not stored, so that it does not live as long as the image.
+        Code converting images it does not own, like TextDetection, uses it.
+        """
+        if copy:
+            return Image.copy(self, target_mode=mode)
+        if mode == self.mode:
+            return self
+
+        converted = self._conversions.get(mode)
+        if converted is None:
+            data = cv2.cvtColor(self.data, self._converter(self.mode, mode))
+            converted = Image(data, mode=mode)
+            if cache:
+                self._conversions[mode] = converted
+        return converted
+
+    @classmethod
+    def view(cls, img, target_mode: ImageMode=None, cache: bool = True):
+        """Return img in target_mode without copying its data, see Image.as_mode"""
+        return img.as_mode(target_mode if target_mode else img.mode, cache=cache)
 
-        img_data_copy = cv2.cvtColor(img_data_copy, converter)
+    @classmethod
+    def copy(cls, img, target_mode: ImageMode=None):
+        dst_mode = target_mode if target_mode else img.mode
+        converter = None if img.mode == dst_mode else cls._converter(img.mode, dst_mode)
 
-        return cls(img_data_copy, mode=dst_mode)
+        # cvtColor allocates its output, so data is only copied explicitly
+        # when no conversion is needed
+        if converter is None:
+            return cls(np.copy(img.data), mode=dst_mode)
+        return cls(cv2.cvtColor(img.data, converter), mode=dst_mode)
+
+    @classmethod
+    def from_file(cls, path: str, mode=ImageMode.BGR, shape=None, writable=False):
+        """Open an image stored on disk without reading it into memory.
+
+        NPY files carry their own shape, raw files hold uint8 pixels and need
+        shape, (height, width) or (height, width, channels). The data is a
+        np.memmap, so pixels are only read from disk when they are accessed.
+        """
+        memmap_mode = 'r+' if writable else 'r'
+        if path.endswith('.npy'):
+            data = np.load(path, mmap_mode=memmap_mode)
+        else:
+            if shape is None:
+                raise ValueError("The shape of raw image {} is required.".format(path))
+            data = np.memmap(path, dtype=np.uint8, mode=memmap_mode, shape=tuple(shape))
+        return cls(data, mode=mode)
+
+    @classmethod
+    def create_file(cls, path: str, size: Size, mode=ImageMode.BGR):
+        """Create a black NPY image of size on disk, backed by a writable np.memmap"""
+        shape = (size.height, size.width)
+        if mode != ImageMode.GRAY:
+            shape += (3,)
+        data = np.lib.format.open_memmap(path, mode='w+', dtype=np.uint8, shape=shape)
+        return cls(data, mode=mode)
+
+    def flush(self):
+        """Write changes of a file backed image to disk"""
+        if isinstance(self.data, np.memmap):
+            self.data.flush()
 
     @classmethod
     def downsize(cls, img, largest_dimension):
-        img_copy = cls.copy(img)
         if img.size.max_dimension <= largest_dimension:
-            return img_copy
+            return cls.copy(img)
 
         target_size = None
         if img.aspect_ratio >= 1:
@@ -95,8 +168,6 @@ class Image:
 
     @classmethod
     def resize(cls, img, target_size):
-        img_copy = cls.copy(img)
-
         interpolation = None
         # When upscaling
         if img.size.max_dimension < target_size.max_dimension:
@@ -105,7 +176,8 @@ class Image:
         else:
             interpolation = cv2.INTER_AREA
 
-        data = cv2.resize(img_copy.data,
+        # cv2.resize allocates its output, so the source is not copied
+        data = cv2.resize(img.data,
                           target_size.as_tuple(),
                           interpolation=interpolation)
         return Image(data, mode=img.mode)
@@ -1,2 +1,23 @@
-from kv.mser.mser_region import MSERRegion
-from kv.mser.mser_detector import MSERDetector
\ No newline at end of file
+from kv.mser.mser_configuration import MSERConfiguration
+import importlib
+
+# MSERRegion and MSERDetector import OpenCV and NumPy, so they are only
+# loaded on first access
+_LAZY_ATTRIBUTES = {
+    'MSERRegion': 'kv.mser.mser_region',
+    'MSERDetector': 'kv.mser.mser_detector',
+}
+
+__all__ = ['MSERRegion', 'MSERConfiguration', 'MSERDetector']
+
+
+def __getattr__(name):
+    if name not in _LAZY_ATTRIBUTES:
+        raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+    value = getattr(importlib.import_module(_LAZY_ATTRIBUTES[name]), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY_ATTRIBUTES))
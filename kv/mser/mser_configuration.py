@@ -0,0 +1,18 @@
+class MSERConfiguration:
+    """Parameters of one MSER pass of an MSERDetector"""
+    def __init__(self, delta: int = 35, invert: bool = False):
+        self.delta = delta
+        # Detect on the inverted image, for light text on a dark background
+        self.invert = invert
+
+    def __eq__(self, other):
+        return (self.delta, self.invert) == (other.delta, other.invert)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((self.delta, self.invert))
+
+    def __repr__(self):
+        return "MSERConfiguration(delta={}, invert={})".format(self.delta, self.invert)
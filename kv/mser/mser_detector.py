@@ -1,42 +1,120 @@
 import cv2
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from kv.image import ImageMode, Image
-from kv import Rectangle, Point
+from kv import Rectangle
+from kv.mser.mser_configuration import MSERConfiguration
 from kv.mser.mser_region import MSERRegion
 
 
 class MSERDetector:
-    def __init__(self, delta=35):
-        self._mser = cv2.MSER_create(delta)
+    """Detects MSER regions with a single delta, or with several
+    configurations whose regions are fused. Configurations run concurrently
+    on up to workers threads, OpenCV releases the GIL while detecting.
+
+    The threads are started on the first detection with several
+    configurations and reused by the following ones until close is called.
+    """
+    def __init__(self, delta=35, configurations: [MSERConfiguration]=None, workers: int=None):
+        if not configurations:
+            configurations = [MSERConfiguration(delta)]
+        self._configurations = list(configurations)
+        self._msers = [cv2.MSER_create(configuration.delta)
+                       for configuration in self._configurations]
+        self._workers = workers or len(self._configurations)
+        self._executor = None
+
+    @property
+    def configurations(self) -> [MSERConfiguration]:
+        return list(self._configurations)
 
     def detect(self, image):
-        image = Image.copy(image, target_mode=ImageMode.GRAY)
+        data = Image.view(image, target_mode=ImageMode.GRAY, cache=False).data
+
+        inverted_data = None
+        if any(configuration.invert for configuration in self._configurations):
+            inverted_data = cv2.bitwise_not(data)
+        inputs = [inverted_data if configuration.invert else data
+                  for configuration in self._configurations]
+
+        if len(self._msers) == 1:
+            return self._detect(self._msers[0], inputs[0])
+
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self._workers,
+                                                thread_name_prefix='mser')
+        results = list(self._executor.map(self._detect, self._msers, inputs))
+        return self._fuse(results)
+
+    def close(self):
+        """Stop the detection threads, a later detection starts new ones"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    @staticmethod
+    def _detect(mser, data) -> [MSERRegion]:
+        regs, bboxes = mser.detectRegions(data)
+        if len(regs) == 0:
+            return []
+
+        bboxes = np.asarray(bboxes, dtype=np.int64).reshape(-1, 4)
+        starts = MSERDetector._similar_origin_starts(bboxes[:, 0].tolist(), bboxes[:, 1].tolist())
+
+        # Enclosing rectangle of every run of regions with similar origins
+        x0 = np.minimum.reduceat(bboxes[:, 0], starts).tolist()
+        y0 = np.minimum.reduceat(bboxes[:, 1], starts).tolist()
+        x1 = np.maximum.reduceat(bboxes[:, 0] + bboxes[:, 2], starts).tolist()
+        y1 = np.maximum.reduceat(bboxes[:, 1] + bboxes[:, 3], starts).tolist()
 
         regions = []
-        regs, bboxes = self._mser.detectRegions(image.data)
-        for points, (x, y, w, h) in zip(regs, bboxes):
-            bounding_box = Rectangle.from_xy_wh(x, y, w, h)
-
-            # Create a new region if no regions are created till
-            if len(regions) == 0:
-                regions.append(MSERRegion(bounding_box))
-
-            # During the first iteration both prev_region and current_region
-            # are same
-            prev_region = regions[-1]
-            current_region = None
-
-            if Rectangle.has_similar_origins(prev_region.bounding_box, bounding_box):
-                new_bounding_box = Rectangle.enclosing_rectangle(
-                    prev_region.bounding_box,
-                    bounding_box)
-                prev_region.bounding_box = new_bounding_box
-                current_region = prev_region
+        stops = starts[1:] + [len(regs)]
+        for index, (start, stop) in enumerate(zip(starts, stops)):
+            bounding_box = Rectangle.from_xy_wh(x0[index], y0[index],
+                                                x1[index] - x0[index],
+                                                y1[index] - y0[index])
+            region = MSERRegion(bounding_box)
+            for points in regs[start:stop]:
+                region.add_coordinates(points)
+            regions.append(region)
+        return regions
+
+    @staticmethod
+    def _similar_origin_starts(xs: [int], ys: [int], delta: int=5) -> [int]:
+        """Return the indices where runs of regions with similar origins start.
+
+        A region joins the current run when its origin is closer than delta
+        to the origin of the rectangle enclosing the run, as
+        Rectangle.has_similar_origins does. That origin is the running
+        minimum of the run, which makes this a sequential pass, so it works
+        on plain ints and compares squared distances.
+        """
+        starts = [0]
+        run_x, run_y = xs[0], ys[0]
+        max_distance_squared = delta * delta
+        for index in range(1, len(xs)):
+            x, y = xs[index], ys[index]
+            dx, dy = run_x - x, run_y - y
+            if dx * dx + dy * dy < max_distance_squared:
+                run_x = x if x < run_x else run_x
+                run_y = y if y < run_y else run_y
             else:
-                current_region = MSERRegion(bounding_box)
-                regions.append(current_region)
+                starts.append(index)
+                run_x, run_y = x, y
+        return starts
 
-            for pt_x, pt_y in points:
-                point = Point(pt_x, pt_y)
-                current_region.add_point(point)
+    @staticmethod
+    def _fuse(results: [[MSERRegion]]) -> [MSERRegion]:
+        """Concatenate the regions of several configurations, keeping only the
+        first of the regions sharing the same bounding box"""
+        regions = [region for result in results for region in result]
+        if len(regions) == 0:
+            return regions
 
-        return regions
+        bboxes = np.array([
+            (region.bounding_box.origin.x, region.bounding_box.origin.y,
+             region.bounding_box.size.width, region.bounding_box.size.height)
+            for region in regions
+        ], dtype=np.int64)
+        _, first_indices = np.unique(bboxes, axis=0, return_index=True)
+        return [regions[index] for index in np.sort(first_indices)]
@@ -1,34 +1,69 @@
 import numpy as np
 from kv.image import ImageMode, GrayscaleImage
-from kv import Rectangle
+from kv import Rectangle, Point
 
 
 class MSERRegion:
-    def __init__(self, bbox):
+    def __init__(self, bbox, coordinates: np.ndarray = None):
         self.bounding_box = bbox
-        self.points = []
 
-    def add_point(self, point):
-        self.points.append(point)
+        # Pixel coordinates are kept as the (N, 2) int32 (x, y) arrays
+        # returned by OpenCV. Merged regions hold one array per source
+        # region and are only concatenated when the coordinates are read.
+        self._coordinates = []
+        if coordinates is not None:
+            self._coordinates.append(coordinates)
+
+    @property
+    def coordinates(self) -> np.ndarray:
+        """Return the (N, 2) array of (x, y) pixel coordinates of the region"""
+        if len(self._coordinates) == 0:
+            return np.empty((0, 2), dtype=np.int32)
+        if len(self._coordinates) > 1:
+            self._coordinates = [np.concatenate(self._coordinates)]
+        return self._coordinates[0]
+
+    @property
+    def num_points(self) -> int:
+        return sum(len(coordinates) for coordinates in self._coordinates)
+
+    @property
+    def points(self) -> [Point]:
+        """Return the pixels of the region as Point objects"""
+        return [Point(x, y) for x, y in self.coordinates.tolist()]
+
+    def add_point(self, point: Point):
+        self._coordinates.append(np.array([[point.x, point.y]], dtype=np.int32))
+
+    def add_coordinates(self, coordinates: np.ndarray):
+        self._coordinates.append(coordinates)
+
+    def translate(self, dx: int, dy: int):
+        """Move the region by (dx, dy) in place"""
+        origin = self.bounding_box.origin
+        size = self.bounding_box.size
+        self.bounding_box = Rectangle.from_xy_wh(origin.x + dx, origin.y + dy,
+                                                 size.width, size.height)
+        offset = np.array([dx, dy], dtype=np.int32)
+        self._coordinates = [coordinates + offset for coordinates in self._coordinates]
 
     def add_region(self, region):
         self.bounding_box = Rectangle.enclosing_rectangle(
             self.bounding_box,
             region.bounding_box
         )
-        self.points = self.points + region.points
+        self._coordinates = self._coordinates + region._coordinates
 
     @property
     def image(self) -> GrayscaleImage:
         w, h = self.bounding_box.size.as_tuple()
         x, y = self.bounding_box.origin.as_tuple()
-        data = np.zeros((h, w))
-        for point, value in self.points:
-            data[point.y - y, point.x - x] = value
+        data = np.zeros((h, w), dtype=np.uint8)
+        coordinates = self.coordinates
+        data[coordinates[:, 1] - y, coordinates[:, 0] - x] = 255
         img = GrayscaleImage(data)
         return img
 
     def plot_in_mask(self, mask: GrayscaleImage):
-        for point in self.points:
-            mask.data[point.y, point.x] = 255
-
+        coordinates = self.coordinates
+        mask.data[coordinates[:, 1], coordinates[:, 0]] = 255
@@ -1,8 +1,11 @@
 from kv.size import Size
 from kv.point import Point
+import math
 
 
 class Rectangle:
+    __slots__ = ('origin', 'size')
+
     def __init__(self, origin: Point, size: Size):
         self.origin = origin
         self.size = size
@@ -43,6 +46,20 @@ class Rectangle:
         size = Size.from_origin_end_points(origin, end)
         return cls(origin, size)
 
+    @classmethod
+    def scale(cls, rect, scale_x, scale_y):
+        """Construct the smallest integer rectangle enclosing rect scaled by (scale_x, scale_y)"""
+        origin = Point(
+            math.floor(rect.origin.x * scale_x),
+            math.floor(rect.origin.y * scale_y)
+        )
+        end = Point(
+            math.ceil(rect.end.x * scale_x),
+            math.ceil(rect.end.y * scale_y)
+        )
+        size = Size.from_origin_end_points(origin, end)
+        return cls(origin, size)
+
     @staticmethod
     def has_similar_origins(rect1, rect2, delta=5) -> bool:
         return rect1.origin.distance_from_point(rect2.origin) < delta
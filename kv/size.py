@@ -1,4 +1,6 @@
 class Size:
+    __slots__ = ('width', 'height')
+
     def __init__(self, w, h):
         self.width = w
         self.height = h
@@ -0,0 +1,312 @@
+"""Text removal for videos and image sequences.
+
+    python sequence_text_detection.py INPUT OUTPUT [--fps 25]
+
+INPUT is a video file or a folder of frames, OUTPUT a video file or a folder
+the inpainted frames and masks are written to.
+
+Burned-in captions barely move between frames, so the text mask of the last
+detected frame is reused as long as the frame stays close to it inside the
+text bounding boxes. Frames are decoded, processed and encoded on separate
+threads.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from kv.image import GrayscaleImage, Image, ImageMode
+from instrumentation import StageRecorder
+from detection_result import DetectionResult
+from text_detection import TextDetection
+import argparse
+import os
+import queue
+import sys
+import threading
+import time
+
+import numpy as np
+import cv2
+
+
+class FrameResult:
+    def __init__(self, index: int, image: Image, mask: GrayscaleImage,
+                 reused: bool, difference: float = None, timings: dict = None):
+        self.index = index
+
+        # Inpainted frame in RGB and its dilated text mask
+        self.image = image
+        self.mask = mask
+
+        # Whether the mask of an earlier frame was reused instead of running
+        # detection, and the mean absolute difference that decided it
+        self.reused = reused
+        self.difference = difference
+
+        # Seconds spent in each stage, by stage name
+        self.timings = timings or {}
+
+    def __str__(self):
+        return "frame {}: {} {:.2f}ms".format(self.index,
+                                              "reused" if self.reused else "detected",
+                                              1000 * sum(self.timings.values()))
+
+
+class SequenceTextDetection(TextDetection):
+    """Text detection over the frames of a video or an image sequence.
+
+    Detection runs on key frames only. The following frames reuse the key
+    frame's mask while the mean absolute gray level difference to the key
+    frame inside its text bounding boxes, or over the whole frame when it has
+    no text, stays below difference_threshold. Detection runs again when the
+    difference exceeds the threshold, the frame size changes or
+    keyframe_interval frames were reused in a row, which catches text
+    appearing outside the previous boxes.
+    """
+    def __init__(self,
+                 difference_threshold: float=6.,
+                 keyframe_interval: int=30,
+                 prefetch: int=4,
+                 **kwargs):
+        super().__init__(**kwargs)
+
+        # Mean absolute gray level difference above which a frame is detected
+        self._difference_threshold = difference_threshold
+
+        # Maximum number of frames in a row reusing a mask, None for no limit
+        self._keyframe_interval = keyframe_interval
+
+        # Number of frames decoded ahead and encoded behind the processed one
+        self._prefetch = prefetch
+
+    def detect_sequence(self, frames) -> [FrameResult]:
+        """Yield a FrameResult for every Image of the iterable frames.
+
+        Frames are read from frames on a background thread, so decoding
+        overlaps with detection and inpainting.
+        """
+        key_result: DetectionResult = None
+        key_gray: np.ndarray = None
+        key_roi: np.ndarray = None
+        num_reused = 0
+
+        for index, frame in enumerate(_prefetched(frames, self._prefetch)):
+            recorder = StageRecorder()
+            with recorder.stage('difference') as stage:
+                gray = frame.as_mode(ImageMode.GRAY, cache=False).data
+                difference = None
+                if (key_result is not None
+                        and gray.shape == key_gray.shape
+                        and (self._keyframe_interval is None or num_reused < self._keyframe_interval)):
+                    difference = cv2.mean(cv2.absdiff(gray, key_gray), mask=key_roi)[0]
+                stage.count_out = 0 if difference is None else 1
+
+            reused = difference is not None and difference <= self._difference_threshold
+            if reused:
+                result = self._reused_result(frame, key_result, recorder)
+                num_reused += 1
+            else:
+                result = self.detect_regions(frame, recorder=recorder)
+                self.build_mask(result, recorder=recorder)
+                key_result, key_gray = result, gray
+                key_roi = self._roi_mask(result.bboxes, gray.shape)
+                num_reused = 0
+
+            inpainted = self.inpaint(result, recorder=recorder)
+            yield FrameResult(index, inpainted, result.mask, reused,
+                              difference=difference, timings=recorder.timings)
+
+    def process_sequence(self, frames, sink) -> dict:
+        """Remove the text of every frame and pass the FrameResults to sink.
+
+        sink is called in frame order on a separate thread, so encoding
+        overlaps with processing the next frames. Return frame counts and
+        the total time.
+        """
+        start = time.perf_counter()
+        counts = {'frames': 0, 'detected': 0, 'reused': 0}
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=1) as encoder:
+            for result in self.detect_sequence(frames):
+                counts['frames'] += 1
+                counts['reused' if result.reused else 'detected'] += 1
+                pending.append(encoder.submit(sink, result))
+                # Bound the number of frames waiting to be encoded
+                while len(pending) > self._prefetch:
+                    pending.popleft().result()
+            while pending:
+                pending.popleft().result()
+
+        counts['seconds'] = time.perf_counter() - start
+        return counts
+
+    def _reused_result(self, frame: Image, key_result: DetectionResult, recorder) -> DetectionResult:
+        """Return a detection of frame with the regions and masks of key_result"""
+        with recorder.stage('color') as stage:
+            rgb_frame = Image.view(frame, target_mode=ImageMode.RGB, cache=False)
+            stage.nbytes = 0 if rgb_frame is frame else rgb_frame.data.nbytes
+        result = DetectionResult(rgb_frame)
+        result.bboxes = key_result.bboxes
+        result.group_ids = key_result.group_ids
+        result.detection_size = key_result.detection_size
+        result.undilated_mask = key_result.undilated_mask
+        result.mask = key_result.mask
+        return result
+
+    @staticmethod
+    def _roi_mask(bboxes: np.ndarray, shape: (int, int)) -> np.ndarray:
+        """Return the mask of the bounding boxes, None to compare whole frames"""
+        if len(bboxes) == 0:
+            return None
+        roi = np.zeros(shape, dtype=np.uint8)
+        for x0, y0, x1, y1 in bboxes.tolist():
+            roi[y0:y1, x0:x1] = 255
+        return roi
+
+
+def _prefetched(iterable, size: int):
+    """Iterate over iterable on a background thread, at most size items ahead"""
+    items = queue.Queue(maxsize=max(1, size))
+    stop = threading.Event()
+    end = object()
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put(item):
+                    return
+            put(end)
+        except Exception as e:
+            put(e)
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = items.get()
+            if item is end:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+
+def video_frames(source):
+    """Yield the frames of a video file path or cv2.VideoCapture as BGR Images"""
+    capture = cv2.VideoCapture(source) if isinstance(source, str) else source
+    if not capture.isOpened():
+        raise IOError("Could not open video {}".format(source))
+    try:
+        while True:
+            ok, data = capture.read()
+            if not ok:
+                break
+            yield Image(data, mode=ImageMode.BGR)
+    finally:
+        if capture is not source:
+            capture.release()
+
+
+def folder_frames(folder: str):
+    """Yield the images of folder in name order as BGR Images, skipping
+    unreadable files"""
+    from batch import iter_image_paths
+
+    for path in iter_image_paths(folder):
+        data = cv2.imread(path)
+        if data is not None:
+            yield Image(data, mode=ImageMode.BGR)
+
+
+class VideoSink:
+    """Sink writing the inpainted frames to a video file"""
+    def __init__(self, path: str, fps: float = 25., fourcc: str = 'mp4v'):
+        self._path = path
+        self._fps = fps
+        self._fourcc = cv2.VideoWriter_fourcc(*fourcc)
+        self._writer = None
+
+    def __call__(self, result: FrameResult):
+        data = Image.copy(result.image, target_mode=ImageMode.BGR).data
+        if self._writer is None:
+            height, width = data.shape[:2]
+            self._writer = cv2.VideoWriter(self._path, self._fourcc, self._fps, (width, height))
+        self._writer.write(data)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.release()
+            self._writer = None
+
+
+class FolderSink:
+    """Sink writing every inpainted frame and its mask as PNG files"""
+    def __init__(self, folder: str, mask_only: bool = False):
+        self._folder = folder
+        self._mask_only = mask_only
+        os.makedirs(folder, exist_ok=True)
+
+    def __call__(self, result: FrameResult):
+        stem = os.path.join(self._folder, "frame_{:06d}".format(result.index))
+        if not self._mask_only:
+            cv2.imwrite(stem + ".png", Image.copy(result.image, target_mode=ImageMode.BGR).data)
+        cv2.imwrite(stem + "_mask.png", result.mask.data)
+
+    def close(self):
+        pass
+
+
+def main(argv: [str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Remove burned-in text from a video or image sequence.")
+    parser.add_argument("input", help="video file or folder of frames")
+    parser.add_argument("output", help="video file or folder to write the frames and masks to")
+    parser.add_argument("--fps", type=float, default=None,
+                        help="frame rate of the output video (default: the input's, or 25)")
+    parser.add_argument("--difference-threshold", type=float, default=6.,
+                        help="mean gray level difference in the text boxes that triggers detection")
+    parser.add_argument("--keyframe-interval", type=int, default=30,
+                        help="maximum number of frames in a row reusing a mask")
+    args = parser.parse_args(argv)
+
+    detector = SequenceTextDetection(difference_threshold=args.difference_threshold,
+                                     keyframe_interval=args.keyframe_interval)
+
+    fps = args.fps
+    capture = None
+    if os.path.isdir(args.input):
+        frames = folder_frames(args.input)
+    else:
+        # Opened here for its frame rate, video_frames leaves it open
+        capture = cv2.VideoCapture(args.input)
+        fps = fps or capture.get(cv2.CAP_PROP_FPS) or None
+        frames = video_frames(capture)
+
+    try:
+        if os.path.splitext(args.output)[1]:
+            sink = VideoSink(args.output, fps=fps or 25.)
+        else:
+            sink = FolderSink(args.output)
+
+        try:
+            counts = detector.process_sequence(frames, sink)
+        finally:
+            sink.close()
+    finally:
+        if capture is not None:
+            capture.release()
+    print("{frames} frames in {seconds:.2f}s, {detected} detected, {reused} reused".format(**counts))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
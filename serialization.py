@@ -0,0 +1,252 @@
+"""Compact serialization of detection results.
+
+Masks are run-length encoded like COCO: runs of alternating background and
+text pixels in column-major order, starting with background, stored as
+{'size': [height, width], 'counts': str} with the counts compressed into
+the COCO string format, so pycocotools can decode them as well.
+
+A record holds the image size, the bounding boxes and group ids of the kept
+regions and the RLE of a mask. Records are written to NPZ files, with the
+regions packed in the smallest integer type, or streamed as JSON lines:
+
+    with JsonLinesWriter('masks.jsonl') as writer:
+        writer.write(result_record(result), image='page.png')
+
+    mask = None
+    for record in read_json_lines('masks.jsonl'):
+        mask = decode_rle(record['mask'], out=mask)
+"""
+from detection_result import DetectionResult
+import json
+
+import numpy as np
+
+
+def rle_counts(mask: np.ndarray) -> np.ndarray:
+    """Return the uncompressed COCO run lengths of the non zero pixels of mask"""
+    flat = np.ravel(mask, order='F') != 0
+    if len(flat) == 0:
+        return np.empty(0, dtype=np.int64)
+    changes = np.flatnonzero(flat[1:] != flat[:-1]) + 1
+    boundaries = np.concatenate([[0], changes, [len(flat)]])
+    counts = np.diff(boundaries)
+    # Counts start with a run of background pixels, possibly empty
+    if flat[0]:
+        counts = np.concatenate([[0], counts])
+    return counts
+
+
+def encode_rle(mask: np.ndarray) -> dict:
+    """Return the compressed COCO RLE of the non zero pixels of mask"""
+    height, width = mask.shape[:2]
+    return {'size': [height, width], 'counts': _counts_to_string(rle_counts(mask))}
+
+
+def decode_rle(rle: dict, out: np.ndarray = None) -> np.ndarray:
+    """Return the uint8 mask of rle, 255 for text and 0 for background.
+
+    When out is given, the mask is written into it, which must be a uint8
+    array of the mask's shape. Only the text pixels are indexed, so decoding
+    allocates memory in proportion to them rather than to the image.
+    """
+    height, width = rle['size']
+    if out is None:
+        out = np.zeros((height, width), dtype=np.uint8)
+    elif out.shape != (height, width) or out.dtype != np.uint8:
+        raise ValueError("Cannot decode a {}x{} mask into a {} array of shape {}".format(
+            width, height, out.dtype, out.shape))
+    else:
+        out.fill(0)
+
+    counts = rle['counts']
+    if isinstance(counts, (str, bytes)):
+        counts = _string_to_counts(counts)
+    counts = np.asarray(counts, dtype=np.int64)
+    if counts.sum() != height * width:
+        raise ValueError("The RLE counts do not cover a {}x{} mask".format(width, height))
+
+    starts = np.cumsum(counts) - counts
+    lengths = counts[1::2]
+    starts = starts[1::2][lengths > 0]
+    lengths = lengths[lengths > 0]
+    if len(lengths) == 0:
+        return out
+
+    # Column-major indices of the text pixels, concatenating the runs
+    steps = np.ones(int(lengths.sum()), dtype=np.int64)
+    steps[0] = starts[0]
+    steps[np.cumsum(lengths)[:-1]] = starts[1:] - (starts[:-1] + lengths[:-1] - 1)
+    indices = np.cumsum(steps)
+    out[indices % height, indices // height] = 255
+    return out
+
+
+def _counts_to_string(counts: np.ndarray) -> str:
+    """Compress run lengths like pycocotools' rleToString.
+
+    From the fourth count on, the difference to the count two before is
+    stored. Every value is written as 5 bit groups, least significant
+    first, in characters from '0' with bit 0x20 set when more follow.
+    """
+    values = np.asarray(counts, dtype=np.int64).copy()
+    values[3:] -= np.asarray(counts, dtype=np.int64)[1:-2]
+
+    columns = []
+    written = []
+    active = np.ones(len(values), dtype=bool)
+    while active.any():
+        group = values & 0x1f
+        values >>= 5
+        more = np.where(group & 0x10, values != -1, values != 0)
+        columns.append((group | (more << 5)) + 48)
+        written.append(active.copy())
+        active &= more
+    if not columns:
+        return ''
+    characters = np.stack(columns, axis=1)[np.stack(written, axis=1)]
+    return characters.astype(np.uint8).tobytes().decode('ascii')
+
+
+def _string_to_counts(string) -> np.ndarray:
+    """Decompress run lengths like pycocotools' rleFrString"""
+    if isinstance(string, str):
+        string = string.encode('ascii')
+    characters = np.frombuffer(string, dtype=np.uint8).astype(np.int64) - 48
+    if len(characters) == 0:
+        return np.empty(0, dtype=np.int64)
+
+    last = (characters & 0x20) == 0
+    value_starts = np.concatenate([[0], np.flatnonzero(last)[:-1] + 1])
+    value_lengths = np.diff(np.append(value_starts, len(characters)))
+    positions = np.arange(len(characters)) - np.repeat(value_starts, value_lengths)
+    values = np.add.reduceat((characters & 0x1f) << (5 * positions), value_starts)
+    # Sign extend the values whose last group has bit 0x10 set
+    negative = (characters[last] & 0x10) != 0
+    values[negative] -= np.left_shift(1, 5 * (positions[last][negative] + 1))
+
+    counts = values.copy()
+    counts[1::2][1:] = np.cumsum(values[1::2])[1:]
+    counts[2::2] = np.cumsum(values[2::2])
+    return counts
+
+
+def result_record(result: DetectionResult, dilated: bool = True) -> dict:
+    """Return the record of a detection, with the RLE of its dilated mask,
+    or of its undilated mask when dilated is False. The mask is None when
+    it was not built."""
+    mask = result.mask if dilated else result.undilated_mask
+    return {
+        'size': result.image.size.as_tuple(),
+        'bboxes': result.bboxes,
+        'group_ids': result.group_ids,
+        'mask': None if mask is None else encode_rle(mask.data),
+    }
+
+
+def _packed_dtype(max_value: int) -> np.dtype:
+    for dtype in (np.uint8, np.uint16, np.uint32):
+        if max_value <= np.iinfo(dtype).max:
+            return np.dtype(dtype)
+    return np.dtype(np.int64)
+
+
+def save_npz(file, record: dict):
+    """Save a record to file, a path or a binary file object.
+
+    The bounding boxes and group ids are packed into one (N, 5) array of the
+    smallest unsigned type holding them, the mask is kept as its run
+    lengths.
+    """
+    bboxes = np.asarray(record['bboxes']).reshape(-1, 4)
+    group_ids = np.asarray(record['group_ids']).reshape(-1, 1)
+    regions = np.concatenate([bboxes, group_ids], axis=1)
+    regions = regions.astype(_packed_dtype(int(regions.max()) if regions.size else 0))
+
+    arrays = {'size': np.array(record['size'], dtype=np.uint32), 'regions': regions}
+    if record.get('mask') is not None:
+        counts = record['mask']['counts']
+        if isinstance(counts, (str, bytes)):
+            counts = _string_to_counts(counts)
+        counts = np.asarray(counts)
+        arrays['mask_counts'] = counts.astype(_packed_dtype(int(counts.max()) if counts.size else 0))
+    np.savez_compressed(file, **arrays)
+
+
+def load_npz(file) -> dict:
+    """Load a record saved by save_npz, with int32 bounding boxes and group
+    ids and the mask's run lengths uncompressed"""
+    with np.load(file) as npz:
+        width, height = (int(d) for d in npz['size'])
+        regions = npz['regions'].astype(np.int32)
+        mask = None
+        if 'mask_counts' in npz:
+            mask = {'size': [height, width], 'counts': npz['mask_counts'].astype(np.int64)}
+    return {
+        'size': (width, height),
+        'bboxes': regions[:, :4],
+        'group_ids': regions[:, 4],
+        'mask': mask,
+    }
+
+
+class JsonLinesWriter:
+    """Writes records as JSON lines, one per image, flushing every line so
+    that readers of a running batch only ever miss the line being written"""
+    def __init__(self, file, append: bool = False):
+        if isinstance(file, str):
+            self._file = open(file, 'a+' if append else 'w')
+            self._owns_file = True
+            # A line cut short by a crash is ended so that it stays the
+            # only unreadable one
+            if append and self._file.tell() > 0:
+                self._file.seek(self._file.tell() - 1)
+                if self._file.read(1) != '\n':
+                    self._file.write('\n')
+        else:
+            self._file = file
+            self._owns_file = False
+
+    def write(self, record: dict, **fields):
+        """Write record, with the extra fields, like the image name"""
+        line = dict(fields)
+        line['size'] = list(record['size'])
+        line['bboxes'] = np.asarray(record['bboxes']).tolist()
+        line['group_ids'] = np.asarray(record['group_ids']).tolist()
+        mask = record.get('mask')
+        if mask is not None and not isinstance(mask['counts'], str):
+            mask = {'size': list(mask['size']), 'counts': _counts_to_string(mask['counts'])}
+        line['mask'] = mask
+        self._file.write(json.dumps(line, separators=(',', ':')) + '\n')
+        self._file.flush()
+
+    def close(self):
+        if self._owns_file:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def read_json_lines(file):
+    """Yield the records of a file written by JsonLinesWriter, a path or a
+    text file object, with int32 bounding boxes and group ids. Lines cut
+    short by a crash of the writer are skipped."""
+    lines = open(file) if isinstance(file, str) else file
+    try:
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            record['size'] = tuple(record['size'])
+            record['bboxes'] = np.array(record['bboxes'], dtype=np.int32).reshape(-1, 4)
+            record['group_ids'] = np.array(record['group_ids'], dtype=np.int32)
+            yield record
+    finally:
+        if lines is not file:
+            lines.close()
@@ -0,0 +1,301 @@
+"""HTTP service removing text from uploaded images.
+
+    python service.py --port 8080 --workers 4
+
+    POST /remove           body: encoded image, response: inpainted PNG
+    POST /remove?mask=1    response: PNG of the text mask
+    GET  /metrics          queue depth, counters and p50/p99 latency as JSON
+    GET  /health
+
+Requests wait in a bounded queue and are rejected with 503 when it is full.
+Decoding, detection and encoding run in a process pool whose workers each
+keep a warmed TextDetection.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+from urllib.parse import urlsplit, parse_qs
+from batch import worker_detector, worker_pool
+from kv.image import Image, ImageMode
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import cv2
+
+
+class ServiceError(Exception):
+    def __init__(self, status: int, message: str):
+        # Both arguments are passed on so that errors raised in worker
+        # processes can be pickled
+        super().__init__(status, message)
+        self.status = status
+        self.message = message
+
+    def __str__(self):
+        return self.message
+
+
+def _remove_text(body: bytes, mask_only: bool) -> bytes:
+    """Decode an image, remove its text and return the result as PNG"""
+    img_data = cv2.imdecode(np.frombuffer(body, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if img_data is None:
+        raise ServiceError(400, "The body is not a supported image.")
+    image = Image(img_data, mode=ImageMode.BGR)
+
+    detector = worker_detector()
+    if mask_only:
+        output = detector.detect_mask(image).data
+    else:
+        inpainted, _ = detector.detect(image)
+        output = Image.copy(inpainted, target_mode=ImageMode.BGR).data
+
+    ok, encoded = cv2.imencode('.png', output)
+    if not ok:
+        raise ServiceError(500, "Could not encode the result.")
+    return encoded.tobytes()
+
+
+class LatencyWindow:
+    """Latencies of the most recent requests"""
+    def __init__(self, size: int = 1024):
+        self._latencies = deque(maxlen=size)
+
+    def add(self, seconds: float):
+        self._latencies.append(seconds)
+
+    def percentile(self, percent: float) -> float:
+        if len(self._latencies) == 0:
+            return 0.
+        return float(np.percentile(self._latencies, percent))
+
+
+class TextRemovalService:
+    STATUS_TEXT = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+                   411: 'Length Required', 413: 'Payload Too Large', 500: 'Internal Server Error',
+                   503: 'Service Unavailable', 504: 'Gateway Timeout'}
+
+    def __init__(self,
+                 detector_kwargs: dict = None,
+                 workers: int = None,
+                 queue_size: int = 32,
+                 timeout: float = 30.,
+                 max_body_bytes: int = 64 * 1024 * 1024,
+                 chunk_size: int = 64 * 1024):
+        self._detector_kwargs = detector_kwargs or {}
+        self._workers = workers or os.cpu_count() or 1
+        self._queue_size = queue_size
+        self._timeout = timeout
+        self._max_body_bytes = max_body_bytes
+        self._chunk_size = chunk_size
+
+        self._queue: asyncio.Queue = None
+        self._executor: ProcessPoolExecutor = None
+        self._dispatchers = []
+        self._server = None
+
+        self._latencies = LatencyWindow()
+        self._counters = {'completed': 0, 'failed': 0, 'rejected': 0, 'timeouts': 0}
+        self._in_flight = 0
+
+    async def start(self, host: str = '127.0.0.1', port: int = 8080):
+        self._queue = asyncio.Queue(maxsize=self._queue_size)
+        self._executor = worker_pool(self._workers, self._detector_kwargs)
+        self._dispatchers = [asyncio.ensure_future(self._dispatch())
+                             for _ in range(self._workers)]
+        self._server = await asyncio.start_server(self._handle_connection, host, port)
+        return self._server
+
+    @property
+    def port(self) -> int:
+        return self._server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        for dispatcher in self._dispatchers:
+            dispatcher.cancel()
+        await asyncio.gather(*self._dispatchers, return_exceptions=True)
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+
+    def metrics(self) -> dict:
+        metrics = {
+            'queue_depth': self._queue.qsize() if self._queue else 0,
+            'queue_size': self._queue_size,
+            'in_flight': self._in_flight,
+            'workers': self._workers,
+            'latency_p50_ms': 1000 * self._latencies.percentile(50),
+            'latency_p99_ms': 1000 * self._latencies.percentile(99),
+        }
+        metrics.update(self._counters)
+        return metrics
+
+    async def _dispatch(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            body, mask_only, future = await self._queue.get()
+            try:
+                # The request timed out while waiting in the queue
+                if future.cancelled():
+                    continue
+                self._in_flight += 1
+                try:
+                    result = await loop.run_in_executor(self._executor, _remove_text, body, mask_only)
+                except Exception as e:
+                    if not future.done():
+                        future.set_exception(e)
+                else:
+                    if not future.done():
+                        future.set_result(result)
+                finally:
+                    self._in_flight -= 1
+            finally:
+                self._queue.task_done()
+
+    async def _submit(self, body: bytes, mask_only: bool) -> bytes:
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self._queue.put_nowait((body, mask_only, future))
+        except asyncio.QueueFull:
+            raise self._busy_error()
+
+        try:
+            return await asyncio.wait_for(future, timeout=self._timeout)
+        except asyncio.TimeoutError:
+            self._counters['timeouts'] += 1
+            raise ServiceError(504, "The request timed out.")
+
+    def _busy_error(self) -> ServiceError:
+        self._counters['rejected'] += 1
+        return ServiceError(503, "The service is busy, retry later.")
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            try:
+                method, path, headers = await self._read_head(reader)
+                status, content_type, body = await self._route(reader, method, path, headers)
+            except ServiceError as e:
+                status, content_type = e.status, 'application/json'
+                body = json.dumps({'error': e.message}).encode()
+            await self._write_response(writer, status, content_type, body)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _read_head(self, reader: asyncio.StreamReader) -> (str, str, dict):
+        request_line = (await reader.readline()).decode('latin-1').strip()
+        parts = request_line.split()
+        if len(parts) != 3:
+            raise ServiceError(400, "Malformed request line.")
+        method, path, _ = parts
+
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode('latin-1')
+            if line in ('\r\n', '\n', ''):
+                break
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+        return method, path, headers
+
+    async def _route(self, reader, method: str, path: str, headers: dict) -> (int, str, bytes):
+        url = urlsplit(path)
+        if url.path == '/health':
+            return 200, 'application/json', b'{"status": "ok"}'
+        if url.path == '/metrics':
+            return 200, 'application/json', json.dumps(self.metrics()).encode()
+        if url.path != '/remove':
+            raise ServiceError(404, "Unknown path {}.".format(url.path))
+        if method != 'POST':
+            raise ServiceError(405, "Use POST to upload an image.")
+
+        if 'content-length' not in headers:
+            raise ServiceError(411, "A Content-Length header is required.")
+        try:
+            content_length = int(headers['content-length'])
+        except ValueError:
+            raise ServiceError(400, "The Content-Length header must be an integer.")
+        if content_length < 0:
+            raise ServiceError(400, "The Content-Length header must not be negative.")
+        if content_length > self._max_body_bytes:
+            raise ServiceError(413, "The image is larger than {} bytes.".format(self._max_body_bytes))
+        # A busy service rejects the request before receiving the image. The
+        # queue may still fill up while the image is received.
+        if self._queue.full():
+            raise self._busy_error()
+        body = await reader.readexactly(content_length)
+
+        query = parse_qs(url.query)
+        mask_only = query.get('mask', ['0'])[0] not in ('0', 'false', '')
+
+        start = time.perf_counter()
+        try:
+            png = await self._submit(body, mask_only)
+        except ServiceError:
+            raise
+        except Exception as e:
+            self._counters['failed'] += 1
+            raise ServiceError(500, str(e))
+        self._latencies.add(time.perf_counter() - start)
+        self._counters['completed'] += 1
+        return 200, 'image/png', png
+
+    async def _write_response(self, writer: asyncio.StreamWriter, status: int,
+                              content_type: str, body: bytes):
+        head = ("HTTP/1.1 {} {}\r\n"
+                "Content-Type: {}\r\n"
+                "Content-Length: {}\r\n"
+                "Connection: close\r\n\r\n").format(status, self.STATUS_TEXT.get(status, ''),
+                                                    content_type, len(body))
+        writer.write(head.encode('latin-1'))
+        for offset in range(0, len(body), self._chunk_size):
+            writer.write(body[offset:offset + self._chunk_size])
+            await writer.drain()
+        await writer.drain()
+
+
+def main(argv: [str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Serve text removal over HTTP.")
+    parser.add_argument("--host", default='127.0.0.1')
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("-w", "--workers", type=int, default=None,
+                        help="number of worker processes (default: number of CPUs)")
+    parser.add_argument("--queue-size", type=int, default=32,
+                        help="requests waiting beyond this are rejected with 503")
+    parser.add_argument("--timeout", type=float, default=30.,
+                        help="seconds before a request fails with 504")
+    parser.add_argument("--tuning-profile", default=None,
+                        help="profile written by tuning.py, loaded by every worker")
+    args = parser.parse_args(argv)
+
+    detector_kwargs = {}
+    if args.tuning_profile:
+        detector_kwargs['tuning_profile'] = args.tuning_profile
+
+    async def serve():
+        service = TextRemovalService(detector_kwargs=detector_kwargs,
+                                     workers=args.workers,
+                                     queue_size=args.queue_size,
+                                     timeout=args.timeout)
+        server = await service.start(args.host, args.port)
+        print("Serving on http://{}:{}".format(args.host, service.port))
+        try:
+            await server.serve_forever()
+        finally:
+            await service.close()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,23 @@
+import os
+import sys
+
+import numpy as np
+import cv2
+import pytest
+
+# The modules of the repository are top level modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def document():
+    """Return a function rendering an RGB Image of a white document with two
+    lines of black text, of the given size"""
+    from kv.image import Image, ImageMode
+
+    def render(width: int = 320, height: int = 120):
+        data = np.full((height, width, 3), 255, dtype=np.uint8)
+        for index, line in enumerate(["lorem ipsum dolor", "sit amet elit"]):
+            cv2.putText(data, line, (10, 40 + 45 * index), cv2.FONT_HERSHEY_SIMPLEX, 1., (0, 0, 0), 2)
+        return Image(data, mode=ImageMode.RGB)
+    return render
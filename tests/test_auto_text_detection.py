@@ -0,0 +1,92 @@
+from auto_text_detection import AutoTunedTextDetection
+from instrumentation import StageRecorder
+from kv.image import Image, ImageMode
+from tuning import CostModel, TuningProfile
+
+import numpy as np
+import cv2
+import pytest
+
+
+def noisy_image(width: int = 1000, height: int = 800) -> Image:
+    random = np.random.default_rng(0)
+    data = random.integers(100, 200, (height, width, 3)).astype(np.uint8)
+    for y in range(60, height, 80):
+        cv2.putText(data, "lorem ipsum dolor", (20, y), cv2.FONT_HERSHEY_SIMPLEX, 1., (0, 0, 0), 2)
+    return Image(cv2.GaussianBlur(data, (0, 0), 1.), mode=ImageMode.RGB)
+
+
+def banded_profile(**kwargs) -> TuningProfile:
+    return TuningProfile(bands=[
+        {'max_density': 100., 'parameters': {'mser_delta': 25, 'threshold_num_groups': 2}},
+        {'max_density': 1000., 'parameters': {'mser_delta': 35, 'threshold_num_groups': 3}},
+        {'max_density': None, 'parameters': {'mser_delta': 50, 'threshold_num_groups': 4}},
+    ], **kwargs)
+
+
+def test_cost_model_fits_the_samples():
+    expected = CostModel(0.3, 2e-4, 5e-9)
+    random = np.random.default_rng(0)
+    samples = [(num_pixels, num_regions, expected.predict(num_pixels, num_regions))
+               for num_pixels, num_regions in zip(random.integers(1e5, 1e7, 20),
+                                                  random.integers(0, 20000, 20))]
+    model = CostModel.fit(samples)
+    assert model.as_dict() == pytest.approx(expected.as_dict())
+
+    # Too few samples keep the defaults, negative coefficients are clipped
+    assert CostModel.fit(samples[:2]).as_dict() == CostModel().as_dict()
+    samples = [(1e6, num_regions, 1. - 1e-5 * num_regions) for num_regions in range(0, 5000, 500)]
+    model = CostModel.fit(samples)
+    assert min(model.as_dict().values()) == 0.
+    assert model.seconds_per_megapixel > 0.
+
+
+def test_profiles_are_saved_and_loaded(tmp_path):
+    profile = banded_profile(time_budget=0.25, deltas=(35, 50), largest_dimensions=(1024,),
+                             probe_dimension=256, region_exponent=0.8,
+                             cost_model=CostModel(0.5, 3e-4, 0.))
+    path = str(tmp_path / 'profile.json')
+    profile.save(path)
+    loaded = TuningProfile.load(path)
+    assert isinstance(loaded.cost_model, CostModel)
+    assert loaded.as_dict() == profile.as_dict()
+
+
+def test_bands_are_selected_by_density():
+    profile = banded_profile()
+    assert profile.parameters_for_density(0.)['mser_delta'] == 25
+    assert profile.parameters_for_density(100.)['mser_delta'] == 25
+    assert profile.parameters_for_density(100.5)['mser_delta'] == 35
+    assert profile.parameters_for_density(1e9)['mser_delta'] == 50
+    assert TuningProfile().parameters_for_density(10.) == {}
+
+    # The returned parameters are copies
+    profile.parameters_for_density(0.)['mser_delta'] = 15
+    assert profile.parameters_for_density(0.)['mser_delta'] == 25
+
+
+def test_images_within_budget_keep_their_size():
+    detector = AutoTunedTextDetection(profile=banded_profile(cost_model=CostModel(0., 0., 0.)))
+    parameters = detector.tune(noisy_image())
+    assert parameters['largest_dimension'] is None
+    assert parameters['threshold_num_groups'] in (2, 3, 4)
+
+
+def test_images_over_budget_are_downsized():
+    # Half a second per megapixel, a 0.8 megapixel image only fits in 0.15
+    # seconds at 512 pixels wide, whatever the delta
+    profile = banded_profile(time_budget=0.15, largest_dimensions=(2048, 768, 512, 256),
+                             cost_model=CostModel(0.5, 0., 0.))
+    detector = AutoTunedTextDetection(profile=profile)
+    image = noisy_image()
+    assert detector.tune(image)['largest_dimension'] == 512
+
+    recorder = StageRecorder()
+    result = detector.detect_regions(image, recorder=recorder)
+    assert result.detection_size.as_tuple() == (512, 410)
+    assert recorder.records[0].name == 'tune'
+    assert recorder.records[0].details['largest_dimension'] == 512
+
+    # The tuning time is part of the result's timings
+    assert result.timings['tune'] == recorder.records[0].seconds
+    assert sum(result.timings.values()) == pytest.approx(recorder.total_seconds)
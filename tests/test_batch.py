@@ -0,0 +1,91 @@
+from batch import process_paths
+from imagetextremover import iter_input_paths
+from kv.image import Image, ImageMode
+from serialization import read_json_lines
+from text_detection import TextDetection
+import os
+
+import cv2
+
+
+def write_image(path: str, image: Image):
+    cv2.imwrite(path, image.as_mode(ImageMode.BGR).data)
+
+
+def test_failing_image_does_not_end_the_batch(tmp_path, monkeypatch, document):
+    detect_regions = TextDetection.detect_regions
+
+    def failing_detect_regions(self, image, recorder=None):
+        if image.width == 321:
+            raise ValueError("bad image")
+        return detect_regions(self, image, recorder=recorder)
+
+    monkeypatch.setattr(TextDetection, 'detect_regions', failing_detect_regions)
+
+    paths = [str(tmp_path / 'a.png'), str(tmp_path / 'b.png'), str(tmp_path / 'c.png')]
+    write_image(paths[0], document())
+    write_image(paths[1], document(width=321))
+    write_image(paths[2], document())
+
+    results = list(process_paths(paths, str(tmp_path / 'out'), workers=1))
+    assert [result.input_path for result in results] == paths
+    assert results[0].error is None and results[2].error is None
+    assert results[1].error == "ValueError: bad image"
+
+
+def test_same_output_name_fails_instead_of_overwriting(tmp_path, document):
+    for folder in ('a', 'b'):
+        (tmp_path / 'in' / folder).mkdir(parents=True)
+        write_image(str(tmp_path / 'in' / folder / 'page.png'), document())
+    inputs = [str(tmp_path / 'in' / 'a'), str(tmp_path / 'in' / 'b')]
+
+    results = list(process_paths(iter_input_paths(inputs), str(tmp_path / 'out'), workers=1))
+    assert results[0].error is None
+    assert results[1].error == "same output name as {}".format(results[0].input_path)
+
+    # A resumed run reports the collision again instead of skipping it
+    results = list(process_paths(iter_input_paths(inputs), str(tmp_path / 'out'), workers=1))
+    assert results[0].skipped
+    assert results[1].error is not None
+
+
+def test_glob_inputs_keep_their_folders(tmp_path, document):
+    for folder in ('a', 'b'):
+        (tmp_path / 'in' / folder).mkdir(parents=True)
+        write_image(str(tmp_path / 'in' / folder / 'page.png'), document())
+    pattern = str(tmp_path / 'in' / '**' / '*.png')
+
+    results = list(process_paths(iter_input_paths([pattern]), str(tmp_path / 'out'), workers=1))
+    assert [result.error for result in results] == [None, None]
+    assert sorted(result.name for result in results) == [os.path.join('a', 'page.png'),
+                                                         os.path.join('b', 'page.png')]
+    for folder in ('a', 'b'):
+        assert (tmp_path / 'out' / folder / 'page.png').exists()
+        assert (tmp_path / 'out' / folder / 'page_mask.png').exists()
+
+
+def test_rle_records_make_runs_resumable(tmp_path, document):
+    paths = [str(tmp_path / 'a.png'), str(tmp_path / 'b.png')]
+    for path in paths:
+        write_image(path, document())
+    output_folder = tmp_path / 'out'
+    records_path = output_folder / 'masks.jsonl'
+
+    def run(**kwargs):
+        return list(process_paths(paths, str(output_folder), workers=1, mask_format='rle', **kwargs))
+
+    results = run(mask_only=True)
+    assert [result.skipped for result in results] == [False, False]
+    results = run(mask_only=True)
+    assert [result.skipped for result in results] == [True, True]
+    assert [record['image'] for record in read_json_lines(str(records_path))] == ['a.png', 'b.png']
+
+    # An inpainted image without a record, left by a crash before the record
+    # was appended, is processed again, and a torn last line is ignored
+    write_image(str(output_folder / 'a.png'), document())
+    with open(str(records_path), 'w') as records_file:
+        records_file.write('{"image": "a.png", "si')
+    results = run()
+    assert [result.skipped for result in results] == [False, False]
+    assert [record['image'] for record in read_json_lines(str(records_path))] == ['a.png', 'b.png']
+    assert [result.skipped for result in run()] == [True, True]
@@ -0,0 +1,28 @@
+from benchmark import DOCUMENTS, compare, render_document
+from text_detection import TextDetection
+
+import numpy as np
+import pytest
+
+
+@pytest.mark.parametrize('spec', DOCUMENTS, ids=[spec.name for spec in DOCUMENTS])
+def test_documents_have_detectable_text(spec):
+    detector = TextDetection()
+    result = detector.detect_regions(render_document(spec))
+    mask = detector.build_mask(result)
+    assert len(np.unique(result.group_ids)) >= 3
+    assert mask.data.any()
+
+
+def test_compare_flags_changed_counts():
+    def results(seconds, groups):
+        return {'results': {'page': {'timings': {'group': seconds},
+                                     'counts': {'mser': 10, 'group': groups}}}}
+
+    lines = compare(results(0.010, 3), results(0.010, 3))
+    assert len(lines) == 1 and not lines[0].endswith(("REGRESSION", "COUNT CHANGED"))
+
+    lines = compare(results(0.020, 2), results(0.010, 3))
+    assert lines[0].endswith("REGRESSION")
+    assert len(lines) == 2 and lines[1].endswith("COUNT CHANGED")
+    assert lines[1].split()[:4] == ['page', 'group', '3', '2']
@@ -0,0 +1,107 @@
+from auto_text_detection import create_detector
+from detection_cache import CacheEntry, DetectionCache
+from imagetextremover import build_parser, detector_kwargs_from_args
+from kv import Size
+from kv.image import Image, ImageMode
+from text_detection import TextDetection
+
+import numpy as np
+
+
+def entry(seed: int, size: int = 64) -> CacheEntry:
+    random = np.random.default_rng(seed)
+    mask = (random.random((size, size)) < 0.3).astype(np.uint8) * 255
+    bboxes = random.integers(0, size, (5, 4)).astype(np.int32)
+    group_ids = np.array([0, 0, 1, 1, 2], dtype=np.int64)
+    return CacheEntry(mask, bboxes, group_ids, Size(size // 2, size // 2))
+
+
+def assert_same_entry(first: CacheEntry, second: CacheEntry):
+    assert np.array_equal(first.mask, second.mask)
+    assert np.array_equal(first.bboxes, second.bboxes)
+    assert np.array_equal(first.group_ids, second.group_ids)
+    assert first.detection_size.as_tuple() == second.detection_size.as_tuple()
+
+
+def test_least_recently_used_entries_are_evicted():
+    entries = [entry(seed) for seed in range(4)]
+    cache = DetectionCache(max_bytes=2 * entries[0].nbytes)
+    cache.put('a', entries[0])
+    cache.put('b', entries[1])
+    assert cache.get('a') is entries[0]
+
+    # 'b' was used least recently
+    cache.put('c', entries[2])
+    assert len(cache) == 2
+    assert cache.nbytes == 2 * entries[0].nbytes
+    assert cache.get('b') is None
+    assert cache.get('a') is entries[0]
+    assert cache.get('c') is entries[2]
+    assert (cache.hits, cache.misses) == (3, 1)
+
+    # Entries larger than the whole cache are not kept
+    cache.put('d', entry(4, size=128))
+    assert cache.get('d') is None
+    assert len(cache) == 2
+
+
+def test_entries_are_reloaded_from_disk(tmp_path):
+    stored = entry(0)
+    DetectionCache(directory=str(tmp_path)).put('a', stored)
+
+    cache = DetectionCache(directory=str(tmp_path))
+    assert len(cache) == 0
+    assert_same_entry(cache.get('a'), stored)
+    assert len(cache) == 1
+    assert cache.get('b') is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_keys_depend_on_pixels_and_detection_parameters(document):
+    image = document()
+    cache = DetectionCache()
+
+    def key(image: Image, **kwargs) -> str:
+        return cache.key(image, TextDetection(**kwargs)._detection_parameters())
+
+    assert key(image) == key(document())
+    assert key(image) == key(image, num_dilations=3, inpaint_radius=5)
+
+    other = document()
+    other.data[0, 0] = 0
+    keys = [key(image), key(other),
+            key(image, mser_delta=30), key(image, threshold_delta_x=2.5),
+            key(image, bounding_box_mask=True), key(image, largest_dimension=200),
+            key(image, min_region_points=10), key(Image(image.data, mode=ImageMode.BGR))]
+    assert len(set(keys)) == len(keys)
+
+
+def test_cached_detections_match_detecting_again(tmp_path, document):
+    image = document()
+    kwargs = {'largest_dimension': 200, 'num_dilations': 1}
+    expected = TextDetection(**kwargs).detect_regions(image)
+    expected_image, expected_mask = TextDetection(**kwargs).detect(image)
+
+    TextDetection(cache=DetectionCache(directory=str(tmp_path)), **kwargs).detect(image)
+    # A fresh process only finds the detection on disk
+    detector = create_detector(dict(kwargs, cache_dir=str(tmp_path)))
+    result = detector.detect_regions(image)
+    assert (detector._cache.hits, detector._cache.misses) == (1, 0)
+    assert 'mser' not in result.timings
+    assert result.detection_size.as_tuple() == expected.detection_size.as_tuple()
+    assert result.detection_size.as_tuple() != image.size.as_tuple()
+    assert np.array_equal(result.bboxes, expected.bboxes)
+
+    mask = detector.build_mask(result)
+    assert np.array_equal(mask.data, expected_mask.data)
+    assert np.array_equal(detector.inpaint(result).data, expected_image.data)
+
+
+def test_cache_dir_option_is_passed_to_the_workers(tmp_path):
+    args = build_parser().parse_args(['in.png', '-o', str(tmp_path)])
+    assert 'cache_dir' not in detector_kwargs_from_args(args)
+
+    args = build_parser().parse_args(['in.png', '-o', str(tmp_path), '--cache-dir', str(tmp_path)])
+    detector = create_detector(detector_kwargs_from_args(args))
+    assert isinstance(detector._cache, DetectionCache)
+    assert detector._cache._directory == str(tmp_path)
@@ -0,0 +1,68 @@
+from benchmark import DOCUMENTS, render_document
+from inpainting import FillInpaint, InpaintBackend
+from kv.image import GrayscaleImage, Image, ImageMode
+from text_detection import TextDetection
+
+import numpy as np
+import cv2
+import pytest
+
+
+def test_backends_must_implement_inpaint():
+    class Incomplete(InpaintBackend):
+        name = 'incomplete'
+
+    with pytest.raises(TypeError):
+        InpaintBackend()
+    with pytest.raises(TypeError):
+        Incomplete()
+
+
+def test_fill_rounds_the_statistic():
+    data = np.full((9, 9, 3), 100, dtype=np.uint8)
+    mask = np.zeros((9, 9), dtype=np.uint8)
+    mask[3:6, 3:6] = 255
+    # 50 of the 72 ring pixels are one brighter, a mean of 100.69
+    ring = np.argwhere(mask == 0)[:50]
+    data[ring[:, 0], ring[:, 1]] = 101
+
+    assert (FillInpaint('mean').inpaint(data, mask, 3)[3:6, 3:6] == 101).all()
+    assert (FillInpaint('median').inpaint(data, mask, 3)[3:6, 3:6] == 101).all()
+
+
+def test_whole_image_inpainting_selects_the_backend_per_component():
+    # A blob on flat paper and one on a gradient, in the same image
+    data = np.full((60, 120, 3), 240, dtype=np.uint8)
+    data[:, 60:] = np.linspace(0, 255, 60, dtype=np.uint8)[None, :, None]
+    mask_data = np.zeros((60, 120), dtype=np.uint8)
+    mask_data[20:30, 20:40] = 255
+    mask_data[20:30, 80:100] = 255
+    data[mask_data > 0] = 0
+
+    detector = TextDetection(roi_inpaint=False, flat_threshold=10)
+    pixel_counts = {}
+    inpainted = detector._inpaint(Image(data, mode=ImageMode.RGB), GrayscaleImage(mask_data),
+                                  pixel_counts=pixel_counts)
+
+    assert pixel_counts == {'median': 200, 'ns': 200}
+    assert (inpainted[20:30, 20:40] == 240).all()
+    assert inpainted[20:30, 80:100].min() > 0
+    assert np.array_equal(inpainted[mask_data == 0], data[mask_data == 0])
+
+
+@pytest.mark.parametrize('spec', DOCUMENTS[:2], ids=[spec.name for spec in DOCUMENTS[:2]])
+@pytest.mark.parametrize('num_dilations', [0, 2])
+@pytest.mark.parametrize('inpaint_workers', [1, 4])
+def test_roi_inpainting_matches_whole_image_inpainting(spec, num_dilations, inpaint_workers):
+    image = render_document(spec)
+    detector = TextDetection(num_dilations=num_dilations, inpaint_workers=inpaint_workers)
+    mask = detector.build_mask(detector.detect_regions(image))
+    assert mask.data.any()
+
+    expected = cv2.inpaint(image.data, mask.data, detector._inpaint_radius, cv2.INPAINT_NS)
+    inpainted = detector._inpaint_rois(image.data, mask.data)
+    assert np.abs(inpainted.astype(int) - expected).max() == 0
+
+    whole_image = TextDetection(num_dilations=num_dilations, roi_inpaint=False)
+    assert np.array_equal(detector.detect(image)[0].data, whole_image.detect(image)[0].data)
+
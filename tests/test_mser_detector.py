@@ -0,0 +1,81 @@
+from kv import Rectangle
+from kv.mser import MSERConfiguration, MSERDetector, MSERRegion
+
+import numpy as np
+
+
+def described(regions) -> list:
+    return [(region.bounding_box.origin.as_tuple(), region.bounding_box.size.as_tuple(),
+             region.coordinates.tolist()) for region in regions]
+
+
+class ReplayedMSER:
+    """Stands in for cv2.MSER, returning the given regions whatever the data"""
+    def __init__(self, regs, bboxes):
+        self._regs = regs
+        self._bboxes = bboxes
+
+    def detectRegions(self, data):
+        return self._regs, self._bboxes
+
+
+def random_detections(seed: int, count: int = 400):
+    """Return MSER-like (points, bboxes), whose origins drift in small steps
+    so that runs of similar origins form and break"""
+    random = np.random.default_rng(seed)
+    origins = np.cumsum(random.integers(-4, 5, (count, 2)), axis=0) + 200
+    jumps = random.random(count) < 0.15
+    origins[jumps] = random.integers(0, 400, (int(jumps.sum()), 2))
+    sizes = random.integers(0, 30, (count, 2))
+    bboxes = np.concatenate([origins, sizes], axis=1).astype(np.int32)
+    regs = [random.integers(0, 400, (int(random.integers(1, 6)), 2)).astype(np.int32)
+            for _ in range(count)]
+    return regs, bboxes
+
+
+def reference_detect(regs, bboxes) -> [MSERRegion]:
+    """Region by region merge of consecutive regions with similar origins"""
+    regions = []
+    for points, (x, y, w, h) in zip(regs, bboxes):
+        bounding_box = Rectangle.from_xy_wh(int(x), int(y), int(w), int(h))
+        if len(regions) > 0 and Rectangle.has_similar_origins(regions[-1].bounding_box, bounding_box):
+            current_region = regions[-1]
+            current_region.bounding_box = Rectangle.enclosing_rectangle(current_region.bounding_box,
+                                                                        bounding_box)
+        else:
+            current_region = MSERRegion(bounding_box)
+            regions.append(current_region)
+        current_region.add_coordinates(points)
+    return regions
+
+
+def test_similar_origins_merge_matches_the_reference():
+    for seed in range(20):
+        regs, bboxes = random_detections(seed)
+        expected = described(reference_detect(regs, bboxes))
+        regions = MSERDetector._detect(ReplayedMSER(regs, bboxes), None)
+        assert len(expected) < len(regs)
+        assert described(regions) == expected
+
+    assert MSERDetector._detect(ReplayedMSER((), np.empty((0, 4), dtype=np.int32)), None) == []
+
+
+def test_configurations_reuse_the_detection_threads(document):
+    configurations = [MSERConfiguration(15), MSERConfiguration(25), MSERConfiguration(35, invert=True)]
+    detector = MSERDetector(configurations=configurations)
+    first = detector.detect(document())
+    executor = detector._executor
+    second = detector.detect(document())
+    assert detector._executor is executor
+    assert described(first) == described(second)
+
+    # Fusing the configurations run one after the other gives the same regions
+    sequential = [MSERDetector(configurations=[configuration]).detect(document())
+                  for configuration in configurations]
+    assert len(first) > 0
+    assert described(first) == described(MSERDetector._fuse(sequential))
+
+    detector.close()
+    assert detector._executor is None
+    assert described(detector.detect(document())) == described(first)
+    detector.close()
@@ -0,0 +1,86 @@
+from kv.image import Image, ImageMode
+from sequence_text_detection import FolderSink, SequenceTextDetection
+import os
+import sequence_text_detection
+
+import numpy as np
+import cv2
+import pytest
+
+
+def frame(caption: str, seed: int) -> Image:
+    """A frame with a caption over a gradient, softened like a camera would,
+    with a little sensor noise. MSER misses the hard edged glyphs of putText."""
+    data = np.empty((160, 480, 3), dtype=np.uint8)
+    data[:] = np.linspace(80, 200, 480, dtype=np.uint8)[None, :, None]
+    data[90:155] = 255
+    cv2.putText(data, caption, (10, 140), cv2.FONT_HERSHEY_SIMPLEX, 1.5, (0, 0, 0), 3, cv2.LINE_AA)
+    data = cv2.GaussianBlur(data, (0, 0), 1.)
+    noise = np.random.default_rng(seed).normal(0, 1.5, data.shape)
+    return Image(np.clip(data + noise, 0, 255).astype(np.uint8), mode=ImageMode.RGB)
+
+
+def test_masks_are_reused_until_the_caption_changes():
+    frames = ([frame("lorem ipsum dolor", seed) for seed in range(3)]
+              + [frame("sit amet elit", seed) for seed in range(3, 5)])
+    results = list(SequenceTextDetection(keyframe_interval=None).detect_sequence(frames))
+
+    assert [result.reused for result in results] == [False, True, True, False, True]
+    assert results[1].difference <= 6. and results[3].difference > 6.
+    assert results[0].mask.data.any() and results[3].mask.data.any()
+    assert results[2].mask is results[0].mask
+    assert results[4].mask is results[3].mask
+    assert not np.array_equal(results[3].mask.data, results[0].mask.data)
+
+
+def test_detection_runs_again_after_keyframe_interval_frames():
+    frames = [frame("lorem ipsum dolor", seed) for seed in range(7)]
+    results = list(SequenceTextDetection(keyframe_interval=2).detect_sequence(frames))
+
+    assert [result.reused for result in results] == [False, True, True, False, True, True, False]
+    assert results[3].difference is None
+    assert results[3].mask is not results[0].mask
+
+
+class FakeCapture:
+    """Stands in for cv2.VideoCapture, reading the given frames"""
+    def __init__(self, frames: [Image]):
+        self._frames = list(frames)
+        self.released = False
+
+    def isOpened(self) -> bool:
+        return not self.released
+
+    def get(self, property_id) -> float:
+        return 10.
+
+    def read(self):
+        if self.released or len(self._frames) == 0:
+            return False, None
+        return True, self._frames.pop(0).as_mode(ImageMode.BGR).data
+
+    def release(self):
+        self.released = True
+
+
+def test_main_releases_the_video(tmp_path, monkeypatch):
+    captures = []
+
+    def video_capture(path):
+        captures.append(FakeCapture([frame("lorem ipsum dolor", seed) for seed in range(2)]))
+        return captures[-1]
+
+    monkeypatch.setattr(sequence_text_detection.cv2, 'VideoCapture', video_capture)
+    output = tmp_path / 'out'
+    assert sequence_text_detection.main(['video.mp4', str(output)]) == 0
+    assert captures[0].released
+    assert sorted(os.listdir(str(output)))[:2] == ['frame_000000.png', 'frame_000000_mask.png']
+
+    # Also when writing the frames fails
+    def failing_sink(self, result):
+        raise IOError("disk full")
+
+    monkeypatch.setattr(FolderSink, '__call__', failing_sink)
+    with pytest.raises(IOError):
+        sequence_text_detection.main(['video.mp4', str(output)])
+    assert captures[1].released
@@ -0,0 +1,128 @@
+from serialization import (decode_rle, encode_rle, load_npz, rle_counts, save_npz,
+                           _counts_to_string, _string_to_counts)
+import io
+
+import numpy as np
+import pytest
+
+
+def reference_string(counts: [int]) -> str:
+    """pycocotools' rleToString, count by count"""
+    characters = []
+    for index, count in enumerate(counts):
+        value = count - counts[index - 2] if index > 2 else count
+        more = True
+        while more:
+            group = value & 0x1f
+            value >>= 5
+            more = value != -1 if group & 0x10 else value != 0
+            characters.append(chr((group | 0x20 if more else group) + 48))
+    return ''.join(characters)
+
+
+def random_mask(seed: int, height: int = 37, width: int = 53) -> np.ndarray:
+    random = np.random.default_rng(seed)
+    # Blocks of text make long runs, noise short ones
+    mask = np.zeros((height, width), dtype=np.uint8)
+    for x, y, w, h in random.integers(0, 40, (6, 4)):
+        mask[y:y + h, x:x + w] = 255
+    mask[random.random((height, width)) < 0.05] ^= 255
+    return mask
+
+
+@pytest.mark.parametrize('counts, string', [
+    ([], ''),
+    ([0, 4], '04'),
+    ([2, 3, 1], '231'),
+    ([5, 10, 20, 30], '5:d0d0'),
+    ([100], 'T3'),
+    # Differences to the count two before may be negative
+    ([0, 1, 2, 3, 0, 100, 7], '0122NQ37'),
+])
+def test_counts_match_known_coco_strings(counts, string):
+    assert _counts_to_string(np.array(counts, dtype=np.int64)) == string
+    assert _string_to_counts(string).tolist() == counts
+
+
+def test_counts_strings_match_the_reference():
+    random = np.random.default_rng(0)
+    for _ in range(50):
+        counts = random.integers(0, 2 ** int(random.integers(1, 30)), int(random.integers(1, 40)))
+        counts = counts.tolist()
+        assert _counts_to_string(np.array(counts)) == reference_string(counts)
+        assert _string_to_counts(reference_string(counts)).tolist() == counts
+
+
+def test_masks_are_encoded_column_major():
+    mask = np.array([[0, 255, 255],
+                     [0, 0, 255]], dtype=np.uint8)
+    assert rle_counts(mask).tolist() == [2, 1, 1, 2]
+    assert encode_rle(mask) == {'size': [2, 3], 'counts': '2111'}
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_masks_survive_a_round_trip(seed):
+    mask = random_mask(seed)
+    rle = encode_rle(mask)
+    assert np.array_equal(decode_rle(rle), mask)
+    assert np.array_equal(decode_rle({'size': rle['size'], 'counts': rle_counts(mask)}), mask)
+    assert np.array_equal(decode_rle(dict(rle, counts=rle['counts'].encode())), mask)
+
+
+@pytest.mark.parametrize('value', [0, 255])
+def test_empty_and_full_masks_survive_a_round_trip(value):
+    mask = np.full((7, 9), value, dtype=np.uint8)
+    counts = [63] if value == 0 else [0, 63]
+    assert rle_counts(mask).tolist() == counts
+    assert np.array_equal(decode_rle(encode_rle(mask)), mask)
+
+    empty = np.zeros((0, 4), dtype=np.uint8)
+    assert encode_rle(empty) == {'size': [0, 4], 'counts': ''}
+    assert decode_rle(encode_rle(empty)).shape == (0, 4)
+
+
+def test_masks_are_decoded_into_out():
+    out = None
+    for seed in range(3):
+        mask = random_mask(seed)
+        decoded = decode_rle(encode_rle(mask), out=out)
+        assert out is None or decoded is out
+        assert np.array_equal(decoded, mask)
+        out = decoded
+
+    # Pixels of the previous mask are cleared
+    assert decode_rle(encode_rle(np.zeros_like(out)), out=out) is out
+    assert not out.any()
+
+    with pytest.raises(ValueError):
+        decode_rle(encode_rle(random_mask(0)), out=np.zeros((37, 52), dtype=np.uint8))
+    with pytest.raises(ValueError):
+        decode_rle(encode_rle(random_mask(0)), out=np.zeros((37, 53), dtype=bool))
+    with pytest.raises(ValueError):
+        decode_rle({'size': [37, 53], 'counts': [10, 20]})
+
+
+@pytest.mark.parametrize('num_regions', [0, 4, 300])
+def test_records_survive_npz_files(tmp_path, num_regions):
+    random = np.random.default_rng(num_regions)
+    mask = random_mask(num_regions)
+    record = {
+        'size': (53, 37),
+        'bboxes': random.integers(0, 70000 if num_regions > 100 else 50, (num_regions, 4)).astype(np.int32),
+        'group_ids': np.arange(num_regions, dtype=np.int32) // 3,
+        'mask': encode_rle(mask),
+    }
+    path = str(tmp_path / 'record.npz')
+    save_npz(path, record)
+    loaded = load_npz(path)
+    assert loaded['size'] == record['size']
+    assert loaded['bboxes'].dtype == np.int32 and loaded['group_ids'].dtype == np.int32
+    assert np.array_equal(loaded['bboxes'], record['bboxes'])
+    assert np.array_equal(loaded['group_ids'], record['group_ids'])
+    assert np.array_equal(decode_rle(loaded['mask']), mask)
+
+    # File objects work as well, records without a mask keep none
+    file = io.BytesIO()
+    save_npz(file, dict(record, mask=None))
+    file.seek(0)
+    assert load_npz(file)['mask'] is None
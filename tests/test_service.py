@@ -0,0 +1,130 @@
+from kv.image import Image, ImageMode
+from service import TextRemovalService
+import asyncio
+import json
+
+import numpy as np
+import cv2
+
+
+def _png(image: Image) -> bytes:
+    ok, encoded = cv2.imencode('.png', image.as_mode(ImageMode.BGR).data)
+    assert ok
+    return encoded.tobytes()
+
+
+async def _request(port: int, method: str, path: str, body: bytes = b'', headers: dict = None):
+    """Send one request and return the status, headers and body of the response"""
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    if headers is None:
+        headers = {'Content-Length': str(len(body))}
+    head = "{} {} HTTP/1.1\r\nHost: localhost\r\n".format(method, path)
+    head += "".join("{}: {}\r\n".format(name, value) for name, value in headers.items())
+    writer.write(head.encode('latin-1') + b"\r\n" + body)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+
+    response_head, _, response_body = response.partition(b"\r\n\r\n")
+    lines = response_head.decode('latin-1').split("\r\n")
+    status = int(lines[0].split()[1])
+    response_headers = {}
+    for line in lines[1:]:
+        name, _, value = line.partition(':')
+        response_headers[name.strip().lower()] = value.strip()
+    return status, response_headers, response_body
+
+
+def _with_service(test, **kwargs):
+    """Run the coroutine function test with a started service"""
+    async def run():
+        service = TextRemovalService(workers=1, **kwargs)
+        await service.start('127.0.0.1', 0)
+        try:
+            return await test(service)
+        finally:
+            await service.close()
+    return asyncio.run(run())
+
+
+def test_remove_text_and_mask_only(document):
+    body = _png(document())
+
+    async def test(service):
+        status, headers, inpainted = await _request(service.port, 'POST', '/remove', body)
+        assert status == 200
+        assert headers['content-type'] == 'image/png'
+        image = cv2.imdecode(np.frombuffer(inpainted, np.uint8), cv2.IMREAD_UNCHANGED)
+        assert image.shape == (120, 320, 3)
+
+        status, _, mask_png = await _request(service.port, 'POST', '/remove?mask=1', body)
+        assert status == 200
+        mask = cv2.imdecode(np.frombuffer(mask_png, np.uint8), cv2.IMREAD_UNCHANGED)
+        assert mask.shape == (120, 320)
+        assert mask.any()
+
+        # The inpainted pixels under the mask are no longer black text
+        assert image[mask > 0].mean() > 128
+        assert service.metrics()['completed'] == 2
+
+    _with_service(test)
+
+
+def test_bad_requests():
+    async def test(service):
+        status, _, body = await _request(service.port, 'POST', '/remove', b'not an image')
+        assert status == 400
+        assert 'error' in json.loads(body)
+
+        status, _, _ = await _request(service.port, 'GET', '/unknown')
+        assert status == 404
+
+        status, _, _ = await _request(service.port, 'GET', '/remove')
+        assert status == 405
+
+        status, _, _ = await _request(service.port, 'POST', '/remove', headers={})
+        assert status == 411
+
+        status, _, body = await _request(service.port, 'POST', '/remove',
+                                         headers={'Content-Length': 'twelve'})
+        assert status == 400
+        assert 'Content-Length' in json.loads(body)['error']
+
+        status, _, _ = await _request(service.port, 'POST', '/remove',
+                                      headers={'Content-Length': '-5'})
+        assert status == 400
+
+        status, _, body = await _request(service.port, 'GET', '/health')
+        assert status == 200
+
+    _with_service(test)
+
+
+def test_full_queue_is_rejected(document):
+    body = _png(document())
+
+    async def test(service):
+        # Without dispatchers the queued request is never taken
+        for dispatcher in service._dispatchers:
+            dispatcher.cancel()
+        await asyncio.gather(*service._dispatchers, return_exceptions=True)
+
+        queued = asyncio.ensure_future(_request(service.port, 'POST', '/remove', body))
+        while service.metrics()['queue_depth'] == 0:
+            await asyncio.sleep(0.01)
+
+        status, _, _ = await _request(service.port, 'POST', '/remove', body)
+        assert status == 503
+        assert service.metrics()['rejected'] == 1
+
+        # The image is not waited for, the request is rejected on its head
+        headers = {'Content-Length': str(len(body))}
+        status, _, _ = await asyncio.wait_for(
+            _request(service.port, 'POST', '/remove', headers=headers), timeout=0.2)
+        assert status == 503
+        assert service.metrics()['rejected'] == 2
+
+        status, _, _ = await queued
+        assert status == 504
+
+    _with_service(test, queue_size=1, timeout=0.5)
@@ -0,0 +1,271 @@
+from kv import Rectangle, Size
+from kv.image import GrayscaleImage, Image, ImageMode
+from kv.mser import MSERRegion
+from text_detection import TextDetection
+from operator import attrgetter
+
+import numpy as np
+import cv2
+import pytest
+
+
+def random_boxes(seed: int, count: int = 300) -> [(int, int, int, int)]:
+    """Return (x, y, w, h) boxes crowded enough to enclose each other, with
+    zero sized and identical boxes among them"""
+    random = np.random.default_rng(seed)
+    boxes = np.stack([random.integers(0, 60, count), random.integers(0, 60, count),
+                      random.integers(0, 25, count), random.integers(0, 12, count)], axis=1)
+    boxes[random.random(count) < 0.1, 2:] = 0
+    duplicates = random.random(count) < 0.2
+    boxes[duplicates] = boxes[random.integers(0, count, int(duplicates.sum()))]
+    return [tuple(box) for box in boxes.tolist()]
+
+
+def regions_of(boxes: [(int, int, int, int)]) -> [MSERRegion]:
+    """Return a region per box, whose single point is its index"""
+    return [MSERRegion(Rectangle.from_xy_wh(*box), np.array([[index, index]], dtype=np.int32))
+            for index, box in enumerate(boxes)]
+
+
+def described(regions: [MSERRegion]) -> [((int, int, int, int), [[int]])]:
+    return [(region.bounding_box.origin.as_tuple() + region.bounding_box.size.as_tuple(),
+             region.coordinates.tolist()) for region in regions]
+
+
+def reference_combine(regions: [MSERRegion]) -> [MSERRegion]:
+    """The quadratic merge of enclosed regions the detector started with"""
+    sorted_regions = sorted(regions, key=attrgetter('bounding_box.origin.y', 'bounding_box.origin.x'))
+    for i in range(len(sorted_regions) - 1):
+        if not sorted_regions[i]:
+            continue
+        for j in range(i + 1, len(sorted_regions)):
+            if sorted_regions[j] and sorted_regions[i].bounding_box.encloses(sorted_regions[j].bounding_box):
+                sorted_regions[i].add_region(sorted_regions[j])
+                sorted_regions[j] = None
+    return [region for region in sorted_regions if region]
+
+
+def reference_group(regions: [MSERRegion], threshold_delta_x: float,
+                    threshold_delta_y: float) -> [[[MSERRegion]]]:
+    """The grouping on region objects the detector started with"""
+    v_groups = [[]]
+    for region in sorted(regions, key=attrgetter('bounding_box.end.y')):
+        if len(v_groups[-1]) > 0:
+            delta_y = abs(v_groups[-1][0].bounding_box.end.y - region.bounding_box.end.y)
+            median_height = np.median([r.bounding_box.size.height for r in v_groups[-1]])
+            if delta_y / median_height > threshold_delta_y:
+                v_groups.append([])
+        v_groups[-1].append(region)
+
+    groups = []
+    for v_group in v_groups:
+        groups.append([[]])
+        median_width = np.median([r.bounding_box.size.width for r in v_group])
+        for region in sorted(v_group, key=attrgetter('bounding_box.origin.x')):
+            if len(groups[-1][-1]) > 0:
+                delta_x = abs(groups[-1][-1][-1].bounding_box.origin.x - region.bounding_box.origin.x)
+                if delta_x / median_width > threshold_delta_x:
+                    groups[-1].append([])
+            groups[-1][-1].append(region)
+    return groups
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_combine_matches_the_quadratic_merge(seed):
+    boxes = random_boxes(seed)
+    expected = reference_combine(regions_of(boxes))
+    combined = TextDetection._combine_enclosing_regions(regions_of(boxes))
+    assert len(expected) < len(boxes)
+    assert described(combined) == described(expected)
+
+
+@pytest.mark.parametrize('seed', range(20))
+@pytest.mark.parametrize('threshold_delta_x, threshold_delta_y', [(1.8, 1.), (0.3, 0.2), (4., 3.)])
+def test_grouping_matches_the_grouping_of_regions(seed, threshold_delta_x, threshold_delta_y):
+    regions = reference_combine(regions_of(random_boxes(seed)))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        expected = reference_group(regions, threshold_delta_x, threshold_delta_y)
+    groups = TextDetection._group_mser_regions(regions,
+                                               threshold_delta_x=threshold_delta_x,
+                                               threshold_delta_y=threshold_delta_y)
+    assert [[described(h_group) for h_group in v_group] for v_group in groups] \
+        == [[described(h_group) for h_group in v_group] for v_group in expected]
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_stages_on_rows_match_the_stages_on_regions(seed):
+    # The stages share the table of all regions and only see the rows of
+    # the regions left by the previous stage
+    boxes = random_boxes(seed)
+    subset = np.random.default_rng(seed).permutation(len(boxes))[:len(boxes) // 2]
+
+    regions = regions_of(boxes)
+    table = TextDetection._bounding_box_table(regions)
+    rows = TextDetection._combine_rows(regions, table, subset)
+    grouped_rows = TextDetection._group_rows(table, rows)
+
+    expected_regions = regions_of(boxes)
+    expected = reference_combine([expected_regions[row] for row in subset.tolist()])
+    assert described([regions[row] for row in rows.tolist()]) == described(expected)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        expected = reference_group(expected, 1.8, 1.)
+    assert [[described([regions[row] for row in h_group.tolist()]) for h_group in v_group]
+            for v_group in grouped_rows] \
+        == [[described(h_group) for h_group in v_group] for v_group in expected]
+    assert np.array_equal(table[rows], TextDetection._bounding_box_table([regions[row] for row in rows.tolist()]))
+
+
+def region_of_pixels(pixels: np.ndarray, x: int = 0, y: int = 0) -> MSERRegion:
+    """Return the region of the non zero pixels, placed at (x, y)"""
+    ys, xs = np.nonzero(pixels)
+    coordinates = np.stack([xs + x, ys + y], axis=1).astype(np.int32)
+    x0, y0 = coordinates.min(axis=0)
+    x1, y1 = coordinates.max(axis=0) + 1
+    return MSERRegion(Rectangle.from_xy_wh(int(x0), int(y0), int(x1 - x0), int(y1 - y0)), coordinates)
+
+
+def ring(size: int = 20, stroke: int = 2) -> np.ndarray:
+    pixels = np.ones((size, size), dtype=np.uint8)
+    pixels[stroke:-stroke, stroke:-stroke] = 0
+    return pixels
+
+
+def test_prefilter_drops_regions_by_reason():
+    detector = TextDetection(min_region_points=20, max_aspect_ratio=8,
+                             min_fill_ratio=0.1, max_stroke_width_ratio=0.5)
+    blob = np.ones((40, 60), dtype=np.uint8)
+    regions = [
+        region_of_pixels(np.ones((3, 3)), 0, 0),            # points
+        region_of_pixels(np.ones((3, 80)), 0, 10),          # aspect_ratio
+        region_of_pixels(np.eye(30), 100, 0),               # fill_ratio
+        region_of_pixels(blob, 100, 100),                   # stroke_width
+        # Glyphs inside the blob, which keep their own thin strokes
+        region_of_pixels(ring(), 110, 110),
+        region_of_pixels(ring(16), 135, 112),
+        region_of_pixels(ring(), 0, 50),
+    ]
+    rows, dropped = detector._prefilter_rows(regions, TextDetection._bounding_box_table(regions))
+
+    assert dropped == {'points': 1, 'aspect_ratio': 1, 'fill_ratio': 1, 'stroke_width': 1}
+    assert rows.tolist() == [4, 5, 6]
+
+
+def test_stroke_widths_are_measured_per_region():
+    # A ring nested in a blob has the stroke of the ring, not of the blob
+    regions = [region_of_pixels(np.ones((40, 60)), 100, 100), region_of_pixels(ring(), 110, 110)]
+    stroke_widths = TextDetection._stroke_widths(regions, TextDetection._bounding_box_table(regions))
+    assert stroke_widths.tolist() == [40., 4.]
+
+
+def test_reinpaint_matches_inpainting_the_new_mask(document):
+    detector = TextDetection()
+    result = detector.detect_regions(document())
+    detector.build_mask(result)
+    inpainted = detector.inpaint(result)
+    stale_bgr = inpainted.as_mode(ImageMode.BGR).data.copy()
+
+    # Drop the second line from the mask and add a box
+    new_mask_data = result.mask.data.copy()
+    new_mask_data[60:, :] = 0
+    new_mask_data[5:15, 250:300] = 255
+    new_mask = GrayscaleImage(new_mask_data)
+    removed = (result.mask.data > 0) & (new_mask_data == 0)
+    expected = detector._inpaint(result.image, new_mask)
+
+    assert detector.reinpaint(result, inpainted, new_mask) is inpainted
+    assert result.mask is new_mask
+    assert np.abs(inpainted.data.astype(int) - expected).max() <= 8
+
+    # The pixels of the removed second line are restored from the image
+    assert removed.any()
+    assert np.array_equal(inpainted.data[removed], result.image.data[removed])
+
+    # Conversions cached before the edit are not returned
+    bgr = inpainted.as_mode(ImageMode.BGR).data
+    assert not np.array_equal(bgr, stale_bgr)
+    assert np.array_equal(bgr, cv2.cvtColor(inpainted.data, cv2.COLOR_RGB2BGR))
+
+
+def test_reinpaint_without_changes_keeps_the_image(document):
+    detector = TextDetection()
+    result = detector.detect_regions(document())
+    detector.build_mask(result)
+    inpainted = detector.inpaint(result)
+    before = inpainted.data.copy()
+
+    detector.reinpaint(result, inpainted, GrayscaleImage(result.mask.data.copy()))
+    assert np.array_equal(inpainted.data, before)
+
+
+def test_detection_caches_no_conversions_on_the_input(document):
+    rgb = document()
+    bgr = Image.copy(rgb, target_mode=ImageMode.BGR)
+    small = Image.copy(document(width=100, height=60), target_mode=ImageMode.BGR)
+    detector = TextDetection()
+    for image in (rgb, bgr):
+        detector.detect(image)
+        assert image._conversions == {}
+    detector.detect_batch([bgr, small])
+    assert bgr._conversions == {} and small._conversions == {}
+
+    # Conversions asked for by the caller are still cached
+    assert bgr.as_mode(ImageMode.GRAY) is bgr.as_mode(ImageMode.GRAY)
+
+
+def labels(document, count: int = 12) -> [Image]:
+    """Return small noisy images of words away from their borders, in
+    various sizes, colors and modes"""
+    random = np.random.default_rng(0)
+    images = []
+    for index in range(count):
+        width, height = int(random.integers(100, 129)), int(random.integers(40, 100))
+        data = np.full((height, width, 3), int(random.integers(170, 240)), dtype=np.float32)
+        data = np.clip(data + random.normal(0, 8, data.shape), 0, 255).astype(np.uint8)
+        color = tuple(int(c) for c in random.integers(0, 80, 3))
+        word = ["lorem", "ipsum", "dolor", "amet", "elit"][index % 5]
+        cv2.putText(data, word, (12, height // 2 + 8), cv2.FONT_HERSHEY_SIMPLEX, 0.8, color, 2,
+                    cv2.LINE_AA)
+        # MSER misses most hard edged glyphs
+        image = Image(cv2.GaussianBlur(data, (0, 0), 0.5), mode=ImageMode.RGB)
+        if index % 3 == 2:
+            image = Image.copy(image, target_mode=ImageMode.BGR)
+        images.append(image)
+    # Too large to be packed
+    images.insert(5, document())
+    return images
+
+
+@pytest.mark.parametrize('kwargs', [{}, {'num_dilations': 2}, {'bounding_box_mask': True},
+                                    {'bounding_box_mask': True, 'num_dilations': 1}])
+def test_batches_match_detecting_every_image(kwargs, document):
+    images = labels(document)
+    detector = TextDetection(**kwargs)
+    expected = [detector.detect(image) for image in images]
+    results = detector.detect_batch(images, atlas_size=256)
+    assert len(results) == len(images)
+    for (inpainted, mask), (expected_inpainted, expected_mask) in zip(results, expected):
+        assert np.array_equal(mask.data, expected_mask.data)
+        assert np.array_equal(inpainted.data, expected_inpainted.data)
+    assert sum(mask.data.any() for _, mask in results) >= len(images) // 2
+
+
+@pytest.mark.parametrize('gutter', [2, 6])
+def test_atlas_cells_do_not_overlap(gutter):
+    random = np.random.default_rng(gutter)
+    atlas_size = 256
+    sizes = [Size(int(width), int(height))
+             for width, height in random.integers(1, atlas_size - 2 * gutter + 1, (200, 2))]
+    sizes += [Size(atlas_size - 2 * gutter, atlas_size - 2 * gutter), Size(1, 1)]
+    atlases = TextDetection._pack_atlases(sizes, atlas_size, gutter)
+
+    placed = sorted(index for atlas in atlases for index, _, _ in atlas)
+    assert placed == list(range(len(sizes)))
+    for atlas in atlases:
+        cells = np.zeros((atlas_size, atlas_size), dtype=np.int32)
+        for index, x, y in atlas:
+            size = sizes[index]
+            assert x >= gutter and y >= gutter
+            assert x + size.width + gutter <= atlas_size
+            assert y + size.height + gutter <= atlas_size
+            cells[y - gutter:y + size.height + gutter, x - gutter:x + size.width + gutter] += 1
+        assert cells.max() == 1
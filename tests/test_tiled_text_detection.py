@@ -0,0 +1,72 @@
+from benchmark import DOCUMENTS, render_document
+from detection_cache import DetectionCache
+from kv.image import GrayscaleImage
+from text_detection import TextDetection
+from tiled_text_detection import TiledTextDetection
+
+import numpy as np
+import pytest
+
+
+def test_single_tile_matches_the_untiled_detection(document):
+    image = document()
+    inpainted, mask = TiledTextDetection(tile_size=512).detect(image)
+    expected_inpainted, expected_mask = TextDetection().detect(image)
+    assert mask.data.any()
+    assert np.array_equal(mask.data, expected_mask.data)
+    assert np.array_equal(inpainted.data, expected_inpainted.data)
+
+
+@pytest.mark.parametrize('kwargs', [{}, {'num_dilations': 2},
+                                    {'min_region_points': 10, 'max_stroke_width_ratio': 0.5},
+                                    {'bounding_box_mask': True, 'num_dilations': 1}])
+def test_tiles_match_the_untiled_detection(kwargs):
+    # 12 tiles, with glyphs and lines across the seams
+    image = render_document(DOCUMENTS[0])
+    inpainted, mask = TiledTextDetection(tile_size=200, tile_overlap=48, **kwargs).detect(image)
+    expected_inpainted, expected_mask = TextDetection(**kwargs).detect(image)
+    assert mask.data.any()
+    assert np.array_equal(mask.data, expected_mask.data)
+    assert np.array_equal(inpainted.data, expected_inpainted.data)
+
+
+def test_batches_are_detected_tile_by_tile(document):
+    detector = TiledTextDetection(tile_size=128, tile_overlap=32)
+    images = [document(), document(width=400)]
+    for (inpainted, mask), image in zip(detector.detect_batch(images), images):
+        expected_inpainted, expected_mask = detector.detect(image)
+        assert np.array_equal(mask.data, expected_mask.data)
+        assert np.array_equal(inpainted.data, expected_inpainted.data)
+
+
+def test_results_match_the_untiled_results():
+    image = render_document(DOCUMENTS[0])
+    detector = TiledTextDetection(tile_size=200, tile_overlap=48)
+    untiled = TextDetection()
+    result = detector.detect_regions(image)
+    expected = untiled.detect_regions(image)
+    assert result.mask is None
+    assert result.num_groups > 3
+    assert np.array_equal(result.bboxes, expected.bboxes)
+    assert np.array_equal(result.group_ids, expected.group_ids)
+    assert 'mser' in result.timings and 'group' in result.timings
+
+    mask = detector.build_mask(result)
+    assert result.mask is mask
+    assert np.array_equal(mask.data, untiled.build_mask(expected).data)
+    inpainted = detector.inpaint(result)
+    expected_inpainted = untiled.inpaint(expected)
+    assert np.array_equal(inpainted.data, expected_inpainted.data)
+
+    # Dropping half of the mask updates the inpainting like the untiled one
+    new_mask = GrayscaleImage(mask.data.copy())
+    new_mask.data[:, :320] = 0
+    detector.reinpaint(result, inpainted, new_mask)
+    untiled.reinpaint(expected, expected_inpainted, GrayscaleImage(new_mask.data.copy()))
+    assert np.array_equal(inpainted.data, expected_inpainted.data)
+
+
+@pytest.mark.parametrize('kwargs', [{'cache': DetectionCache()}, {'largest_dimension': 1024}])
+def test_whole_image_options_are_rejected(kwargs):
+    with pytest.raises(ValueError):
+        TiledTextDetection(**kwargs)
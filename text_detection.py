@@ -1,7 +1,12 @@
 from kv import Size, Rectangle
 from kv.image import GrayscaleImage, Image, ImageMode
-from kv.mser import MSERRegion, MSERDetector
-from operator import attrgetter
+from kv.mser import MSERRegion, MSERDetector, MSERConfiguration
+from instrumentation import StageRecorder, NULL_RECORDER
+from detection_cache import CacheEntry
+from detection_result import DetectionResult
+from inpainting import RING_WIDTH, InpaintBackend, get_backend, is_flat
+from concurrent.futures import ThreadPoolExecutor
+import heapq
 import numpy as np
 import cv2
 
@@ -13,9 +18,24 @@ class TextDetection:
                  threshold_delta_y: float=1.0,
                  threshold_num_groups: int=2,
                  num_dilations:int=0,
-                 inpaint_radius:int=10):
-        # Value for MSER Delta
-        self._mser = MSERDetector(delta=mser_delta)
+                 inpaint_radius:int=10,
+                 bounding_box_mask: bool=False,
+                 largest_dimension: int=None,
+                 roi_inpaint: bool=True,
+                 inpaint_workers: int=1,
+                 cache=None,
+                 mser_configurations: [MSERConfiguration]=None,
+                 min_region_points: int=None,
+                 max_aspect_ratio: float=None,
+                 min_fill_ratio: float=None,
+                 max_stroke_width_ratio: float=None,
+                 inpaint_backend='ns',
+                 flat_backend='median',
+                 flat_threshold: float=None):
+        # Value for MSER Delta, or several MSER configurations whose
+        # regions are fused, which overrides the delta
+        self._mser_delta = mser_delta
+        self._mser = MSERDetector(delta=mser_delta, configurations=mser_configurations)
 
         # Value defining the minimum distance between horizontal groups
         self._threshold_delta_x = threshold_delta_x
@@ -32,106 +52,705 @@ class TextDetection:
         # Inpaint radius
         self._inpaint_radius = inpaint_radius
 
-    def detect(self, image: Image) -> (Image, GrayscaleImage):
-        image_copy = Image.copy(image, target_mode=ImageMode.RGB)
-        regions = self._mser.detect(image_copy)
-        combined_regions = self._combine_enclosing_regions(regions)
-        grouped_regions = self._group_mser_regions(combined_regions,
-                                                   threshold_delta_x= self._threshold_delta_x,
-                                                   threshold_delta_y=self._threshold_delta_y)
-        flattened_groups = self._flatten_and_filter(grouped_regions,
-                                                    threshold_num_groups=self._threshold_num_groups)
-        mask = self._mask_from_groups(flattened_groups, image_copy.size)
-        mask.dilate(iterations=self._num_dilations)
-        inpainted_data = cv2.inpaint(image_copy.data,
-                                     mask.data,
-                                     self._inpaint_radius,
-                                     cv2.INPAINT_NS)
-        inpainted_image = Image(inpainted_data, mode=image_copy.mode)
+        # Mask the bounding boxes of the regions instead of their pixels
+        self._bounding_box_mask = bounding_box_mask
+
+        # Largest dimension of the image regions are detected on. Larger
+        # images are downsized for detection and the mask is scaled back up.
+        self._largest_dimension = largest_dimension
+
+        # Inpaint padded crops around the text instead of the whole image
+        self._roi_inpaint = roi_inpaint
+
+        # Number of threads inpainting crops concurrently
+        self._inpaint_workers = inpaint_workers
+
+        # DetectionCache of undilated masks and kept regions, so that only
+        # the dilation and inpainting run again for a cached image
+        self._cache = cache
+
+        # Thresholds of the pre-filter dropping regions that are obviously
+        # not text before they are combined and grouped, None disables one.
+        # Minimum number of pixels of a region
+        self._min_region_points = min_region_points
+
+        # Maximum ratio of the longer to the shorter side of a bounding box
+        self._max_aspect_ratio = max_aspect_ratio
+
+        # Minimum ratio of the number of pixels to the bounding box area
+        self._min_fill_ratio = min_fill_ratio
+
+        # Maximum ratio of the widest stroke to the longer bounding box side.
+        # A solid blob scores its shorter to longer side ratio, glyphs made
+        # of thin strokes score well below.
+        self._max_stroke_width_ratio = max_stroke_width_ratio
+
+        # InpaintBackend, or name of one in inpainting.BACKENDS, for the mask
+        # components
+        self._inpaint_backend: InpaintBackend = get_backend(inpaint_backend)
+
+        # Backend for mask components whose surrounding ring is near-uniform,
+        # with a spread of at most flat_threshold between the 10th and 90th
+        # percentile of every channel (see inpainting.is_flat). None
+        # disables the test.
+        self._flat_backend: InpaintBackend = get_backend(flat_backend)
+        self._flat_threshold = flat_threshold
+
+        # Scratch buffers of detect_batch, reused across calls, by name, shape
+        # and type
+        self._buffers = {}
+
+    def detect(self, image: Image, recorder=None) -> (Image, GrayscaleImage):
+        """Detect and inpaint the text in image.
+
+        When a StageRecorder is passed as recorder, the wall time, item counts
+        and allocation sizes of every stage are recorded on it.
+        """
+        result = self.detect_regions(image, recorder=recorder)
+        mask = self.build_mask(result, recorder=recorder)
+        inpainted_image = self.inpaint(result, recorder=recorder)
         return inpainted_image, mask
 
+    def detect_batch(self, images: [Image], recorder=None,
+                     atlas_size: int=512,
+                     max_packed_dimension: int=128) -> [(Image, GrayscaleImage)]:
+        """Detect and inpaint the text in many images, return the inpainted
+        image and mask of every image like detect.
+
+        Images no larger than max_packed_dimension are packed into atlases of
+        atlas_size, so that MSER, mask rasterization and dilation run once
+        per atlas instead of once per image. A gutter replicating the border
+        of every image keeps their regions and masks apart. Regions are
+        mapped back to their image before grouping, and inpainting runs per
+        image.
+        The results match detect except for text touching image borders.
+        Larger images, downsized or cached detections go through detect.
+
+        The atlas, its mask and lookup tables are scratch buffers kept on the
+        detector, which must therefore not run detect_batch on several
+        threads at once.
+        """
+        recorder = recorder or StageRecorder()
+        results = [None] * len(images)
+        packed = []
+        for index, image in enumerate(images):
+            if (self._cache is None and not self._is_downsized(image)
+                    and image.size.max_dimension <= max_packed_dimension):
+                packed.append(index)
+            else:
+                results[index] = self.detect(image, recorder=recorder)
+
+        # Dilation grows the mask by 2 pixels per iteration
+        gutter = 2 * self._num_dilations + 2
+        atlas_size = max(atlas_size, max_packed_dimension + 2 * gutter)
+        sizes = [images[index].size for index in packed]
+        for atlas in self._pack_atlases(sizes, atlas_size, gutter):
+            atlas_images = [Image.view(images[packed[item]], target_mode=ImageMode.RGB,
+                                       cache=False)
+                            for item, _, _ in atlas]
+            offsets = [(x, y) for _, x, y in atlas]
+            atlas_results = self._detect_atlas(atlas_images, offsets, atlas_size, gutter, recorder)
+            for (item, _, _), result in zip(atlas, atlas_results):
+                results[packed[item]] = result
+        return results
+
+    def detect_mask(self, image: Image, recorder=None) -> GrayscaleImage:
+        """Return the dilated text mask of image without inpainting it"""
+        result = self.detect_regions(image, recorder=recorder)
+        return self.build_mask(result, recorder=recorder)
+
+    def detect_regions(self, image: Image, recorder=None) -> DetectionResult:
+        """Detect the text regions of image without building a mask"""
+        recorder = recorder or StageRecorder()
+        first_record = len(recorder.records)
+
+        with recorder.stage('color') as stage:
+            rgb_image = Image.view(image, target_mode=ImageMode.RGB, cache=False)
+            stage.nbytes = 0 if rgb_image is image else rgb_image.data.nbytes
+        result = DetectionResult(rgb_image)
+
+        if self._cache is not None:
+            with recorder.stage('cache') as stage:
+                result.cache_key = self._cache.key(rgb_image, self._detection_parameters())
+                entry = self._cache.get(result.cache_key)
+                stage.count_out = 0 if entry is None else 1
+            if entry is not None:
+                result.bboxes = entry.bboxes
+                result.group_ids = entry.group_ids
+                result.detection_size = entry.detection_size
+                result.undilated_mask = GrayscaleImage(entry.mask)
+                result.add_timings(recorder.records[first_record:])
+                return result
+
+        detection_image = rgb_image
+        if self._is_downsized(rgb_image):
+            with recorder.stage('downsize') as stage:
+                detection_image = Image.downsize(rgb_image, self._largest_dimension)
+                stage.nbytes = detection_image.data.nbytes
+
+        with recorder.stage('mser') as stage:
+            regions = self._mser.detect(detection_image)
+            stage.count_out = len(regions)
+            # Pixel coordinates are stored as pairs of int32
+            stage.nbytes = 8 * sum(region.num_points for region in regions)
+        result.groups, bboxes, result.group_ids = self._filtered_groups(regions, recorder)
+        result.detection_size = detection_image.size
+
+        if detection_image is not rgb_image:
+            scale = np.array([rgb_image.width / detection_image.width,
+                              rgb_image.height / detection_image.height] * 2)
+            bboxes = np.concatenate([np.floor(bboxes[:, :2] * scale[:2]),
+                                     np.ceil(bboxes[:, 2:] * scale[2:])], axis=1).astype(np.int32)
+        result.bboxes = bboxes
+
+        result.add_timings(recorder.records[first_record:])
+        return result
+
+    def build_mask(self, result: DetectionResult, recorder=None) -> GrayscaleImage:
+        """Build the dilated text mask of a detection and store it on the result"""
+        recorder = recorder or StageRecorder()
+        first_record = len(recorder.records)
+
+        with recorder.stage('mask', count_in=len(result.bboxes)) as stage:
+            if result.undilated_mask is None:
+                result.undilated_mask = self._undilated_mask(result)
+                if self._cache is not None and result.cache_key is not None:
+                    self._cache.put(result.cache_key, CacheEntry(result.undilated_mask.data,
+                                                                 result.bboxes,
+                                                                 result.group_ids,
+                                                                 result.detection_size))
+            # Dilation allocates new data, so the undilated mask is kept intact
+            mask = GrayscaleImage(result.undilated_mask.data)
+            mask.dilate(iterations=self._num_dilations)
+            stage.count_out = len(result.bboxes)
+            stage.nbytes = mask.data.nbytes
+        result.mask = mask
+
+        result.add_timings(recorder.records[first_record:])
+        return mask
+
+    def inpaint(self, result: DetectionResult, recorder=None) -> Image:
+        """Inpaint the masked text of a detection, building the mask if needed.
+
+        Images without text are copied instead of inpainted.
+        """
+        recorder = recorder or StageRecorder()
+        if result.mask is None:
+            self.build_mask(result, recorder=recorder)
+        first_record = len(recorder.records)
+
+        with recorder.stage('inpaint') as stage:
+            if result.has_text:
+                # Number of masked pixels filled by every backend
+                pixel_counts = {}
+                inpainted_data = self._inpaint(result.image, result.mask, pixel_counts=pixel_counts)
+                stage.details = pixel_counts
+            else:
+                inpainted_data = np.copy(result.image.data)
+            stage.nbytes = inpainted_data.nbytes
+
+        result.add_timings(recorder.records[first_record:])
+        return Image(inpainted_data, mode=result.image.mode)
+
+    def reinpaint(self, result: DetectionResult, inpainted: Image, new_mask: GrayscaleImage,
+                  old_mask: GrayscaleImage=None, recorder=None, tile_size: int=64) -> Image:
+        """Update inpainted, the inpainting of result with old_mask, in place
+        to the inpainting with new_mask, and store new_mask on the result.
+
+        old_mask defaults to the mask of the result, so edits can be chained.
+        A mask with other dilations is GrayscaleImage(result.undilated_mask.data)
+        dilated again. Pixels leaving the mask are restored from the image.
+        Only the tiles of tile_size holding changed pixels are inpainted
+        again, from the image of the result and a band of the inpaint radius
+        around them in which the masked pixels keep their inpainted values,
+        so that the tiles join the unchanged inpainting without seams.
+        """
+        recorder = recorder or StageRecorder()
+        if old_mask is None:
+            old_mask = result.mask
+        if inpainted.mode != result.image.mode or inpainted.size != result.image.size:
+            raise ValueError("The inpainted image must have the size and mode of the detected image")
+        first_record = len(recorder.records)
+
+        with recorder.stage('reinpaint') as stage:
+            data, mask_data = result.image.data, new_mask.data
+            changed = cv2.compare(old_mask.data, mask_data, cv2.CMP_NE)
+            x, y, w, h = cv2.boundingRect(changed)
+            removed = (old_mask.data[y:y + h, x:x + w] > 0) & (mask_data[y:y + h, x:x + w] == 0)
+            inpainted.data[y:y + h, x:x + w][removed] = data[y:y + h, x:x + w][removed]
+
+            pixel_counts = {}
+            windows = self._dirty_windows(changed, (x, y, x + w, y + h), tile_size)
+            for (x0, y0, x1, y1), (cx0, cy0, cx1, cy1) in windows:
+                roi_mask = np.copy(mask_data[y0:y1, x0:x1])
+                core = (slice(cy0 - y0, cy1 - y0), slice(cx0 - x0, cx1 - x0))
+                masked = roi_mask[core] > 0
+                if not masked.any():
+                    continue
+
+                # The masked pixels of the band are known from the current
+                # inpainting, the mask did not change there
+                band = roi_mask > 0
+                band[core] = False
+                roi_data = np.copy(data[y0:y1, x0:x1])
+                roi_data[band] = inpainted.data[y0:y1, x0:x1][band]
+                roi_mask[band] = 0
+
+                backend = self._select_backend(roi_data, roi_mask)
+                roi_inpainted = backend.inpaint(roi_data, roi_mask, self._inpaint_radius)
+                inpainted.data[cy0:cy1, cx0:cx1][masked] = roi_inpainted[core][masked]
+                pixel_counts[backend.name] = pixel_counts.get(backend.name, 0) + int(np.count_nonzero(masked))
+
+            stage.count_in = len(windows)
+            stage.count_out = sum(pixel_counts.values())
+            stage.details = pixel_counts
+        inpainted.invalidate()
+        result.mask = new_mask
+
+        result.add_timings(recorder.records[first_record:])
+        return inpainted
+
+    def _dirty_windows(self, changed: np.ndarray, bounds: (int, int, int, int),
+                       tile_size: int) -> [((int, int, int, int), (int, int, int, int))]:
+        """Return the (x0, y0, x1, y1) windows to inpaint again around the
+        non zero pixels of changed, which lie within bounds, and the core of
+        every window without its band, see reinpaint"""
+        height, width = changed.shape[:2]
+        x0, y0, x1, y1 = bounds
+        if x1 <= x0 or y1 <= y0:
+            return []
+
+        # Flag the tiles holding changed pixels, on the tile grid of the
+        # changed bounding box only
+        tile_y0, tile_x0 = y0 // tile_size, x0 // tile_size
+        tile_y1, tile_x1 = (y1 - 1) // tile_size + 1, (x1 - 1) // tile_size + 1
+        box = changed[tile_y0 * tile_size:tile_y1 * tile_size, tile_x0 * tile_size:tile_x1 * tile_size]
+        padded = np.zeros(((tile_y1 - tile_y0) * tile_size, (tile_x1 - tile_x0) * tile_size), np.uint8)
+        padded[:box.shape[0], :box.shape[1]] = box
+        tiles = padded.reshape(tile_y1 - tile_y0, tile_size, tile_x1 - tile_x0, tile_size).any(axis=(1, 3))
+
+        # Connected dirty tiles form one window. Bands may overlap the
+        # cores of other windows, their pixels are then read once updated
+        margin = self._inpaint_radius + 1
+        _, _, stats, _ = cv2.connectedComponentsWithStats(tiles.astype(np.uint8), connectivity=8)
+        windows = []
+        for tile_x, tile_y, tile_w, tile_h, _ in stats[1:]:
+            cx0, cy0 = (tile_x0 + tile_x) * tile_size, (tile_y0 + tile_y) * tile_size
+            cx1 = min((tile_x0 + tile_x + tile_w) * tile_size, width)
+            cy1 = min((tile_y0 + tile_y + tile_h) * tile_size, height)
+            window = (max(cx0 - margin, 0), max(cy0 - margin, 0),
+                      min(cx1 + margin, width), min(cy1 + margin, height))
+            windows.append((window, (cx0, cy0, cx1, cy1)))
+        return windows
+
+    def _detect_atlas(self, images: [Image], offsets: [(int, int)], atlas_size: int, gutter: int,
+                      recorder) -> [(Image, GrayscaleImage)]:
+        """Detect and inpaint the RGB images placed at offsets in one atlas"""
+        # Only the used rows of the atlas are processed, full rows keep the
+        # views on the scratch buffers contiguous
+        width = atlas_size
+        height = max(y + image.height for image, (_, y) in zip(images, offsets)) + gutter
+
+        # MSER runs on gray scale, so the atlas is built in gray scale
+        with recorder.stage('atlas', count_in=len(images)) as stage:
+            canvas = self._buffer('canvas', (atlas_size, atlas_size))[:height]
+            cells = self._buffer('cells', (atlas_size, atlas_size), dtype=np.int32)[:height]
+            canvas[:] = 0
+            cells[:] = -1
+            for index, (image, (x, y)) in enumerate(zip(images, offsets)):
+                self._paste_with_gutter(canvas, image.as_mode(ImageMode.GRAY, cache=False).data,
+                                        x, y, gutter)
+                cells[y - gutter:y + image.height + gutter, x - gutter:x + image.width + gutter] = index
+            stage.nbytes = 0
+
+        with recorder.stage('mser') as stage:
+            regions = self._mser.detect(GrayscaleImage(canvas))
+            stage.count_out = len(regions)
+            stage.nbytes = 8 * sum(region.num_points for region in regions)
+
+        # Regions belong to the image whose cell contains their bounding box.
+        # Their rows in the bounding box table of the atlas, moved into the
+        # image and clipped like the regions, make the table of every image.
+        image_regions = [[] for _ in images]
+        image_rows = [[] for _ in images]
+        table = self._bounding_box_table(regions)
+        if len(regions) > 0:
+            x0, y0, x1, y1 = table.T
+            first_cells = cells[y0, x0]
+            last_cells = cells[y1 - 1, x1 - 1]
+            for index in np.flatnonzero((first_cells == last_cells) & (first_cells >= 0)):
+                cell = first_cells[index]
+                region = self._clipped_region(regions[index], offsets[cell], images[cell].size)
+                if region is not None:
+                    image_regions[cell].append(region)
+                    image_rows[cell].append(index)
+
+        # Per image stages would cost more than the work they time
+        with recorder.stage('group', count_in=len(regions)) as stage:
+            groups = []
+            for image, (x, y), regions, rows in zip(images, offsets, image_regions, image_rows):
+                image_table = np.clip(table[rows] - np.array([x, y, x, y], dtype=np.int32), 0,
+                                      np.array([image.width, image.height] * 2, dtype=np.int32))
+                groups.append(self._filtered_groups(regions, NULL_RECORDER, table=image_table))
+            stage.count_out = sum(len(image_groups) for image_groups, _, _ in groups)
+
+        with recorder.stage('mask', count_in=len(images)) as stage:
+            mask = self._buffer('mask', (atlas_size, atlas_size))[:height]
+            mask[:] = 0
+            num_regions = 0
+            for (image_groups, bboxes, _), (x, y) in zip(groups, offsets):
+                regions = [region for group in image_groups for region in group]
+                num_regions += len(regions)
+                if len(regions) == 0:
+                    continue
+                if self._bounding_box_mask:
+                    for x0, y0, x1, y1 in bboxes.tolist():
+                        mask[y + y0:y + y1, x + x0:x + x1] = 255
+                else:
+                    coordinates = np.concatenate([region.coordinates for region in regions])
+                    mask[coordinates[:, 1] + y, coordinates[:, 0] + x] = 255
+            if self._num_dilations > 0:
+                mask = cv2.dilate(mask, np.ones((5, 5), np.uint8), iterations=self._num_dilations)
+            stage.count_out = num_regions
+            stage.nbytes = 0 if self._num_dilations == 0 else mask.nbytes
+
+        # Inpainting runs per image, as it reads pixels up to the inpaint
+        # radius away, well into the neighbouring images
+        with recorder.stage('inpaint') as stage:
+            pixel_counts = {}
+            results = []
+            for image, (x, y), (image_groups, _, _) in zip(images, offsets, groups):
+                image_mask = GrayscaleImage(np.copy(mask[y:y + image.height, x:x + image.width]))
+                if len(image_groups) > 0:
+                    inpainted_data = self._inpaint(image, image_mask, pixel_counts=pixel_counts)
+                else:
+                    inpainted_data = np.copy(image.data)
+                results.append((Image(inpainted_data, mode=ImageMode.RGB), image_mask))
+            stage.details = pixel_counts
+            stage.nbytes = sum(image.data.nbytes for image in images)
+        return results
+
+    def _buffer(self, name: str, shape: tuple, dtype=np.uint8) -> np.ndarray:
+        """Return the scratch buffer name of shape, allocated on first use"""
+        key = (name, shape, np.dtype(dtype).str)
+        buffer = self._buffers.get(key)
+        if buffer is None:
+            buffer = np.empty(shape, dtype=dtype)
+            self._buffers[key] = buffer
+        return buffer
+
+    @staticmethod
+    def _paste_with_gutter(canvas: np.ndarray, data: np.ndarray, x: int, y: int, gutter: int):
+        """Copy data to canvas at (x, y) and replicate its border over the gutter"""
+        height, width = data.shape[:2]
+        cell = canvas[y - gutter:y + height + gutter, x - gutter:x + width + gutter]
+        cell[gutter:gutter + height, gutter:gutter + width] = data
+        cell[:gutter, gutter:gutter + width] = data[:1]
+        cell[gutter + height:, gutter:gutter + width] = data[-1:]
+        cell[:, :gutter] = cell[:, gutter:gutter + 1]
+        cell[:, gutter + width:] = cell[:, gutter + width - 1:gutter + width]
+
+    @staticmethod
+    def _clipped_region(region: MSERRegion, offset: (int, int), size: Size) -> MSERRegion:
+        """Return region moved from the atlas into the image at offset, without
+        its pixels in the gutter, or None when none are left"""
+        x, y = offset
+        region.translate(-x, -y)
+        origin, region_size = region.bounding_box.origin, region.bounding_box.size
+        if (origin.x >= 0 and origin.y >= 0 and origin.x + region_size.width <= size.width
+                and origin.y + region_size.height <= size.height):
+            return region
+
+        coordinates = region.coordinates
+        inside = ((coordinates[:, 0] >= 0) & (coordinates[:, 0] < size.width)
+                  & (coordinates[:, 1] >= 0) & (coordinates[:, 1] < size.height))
+        if not inside.any():
+            return None
+        x0 = max(origin.x, 0)
+        y0 = max(origin.y, 0)
+        x1 = min(origin.x + region_size.width, size.width)
+        y1 = min(origin.y + region_size.height, size.height)
+        return MSERRegion(Rectangle.from_xy_wh(x0, y0, x1 - x0, y1 - y0), coordinates[inside])
+
+    @staticmethod
+    def _pack_atlases(sizes: [Size], atlas_size: int, gutter: int) -> [[(int, int, int)]]:
+        """Pack images of sizes into square atlases with shelves of images.
+
+        Return every atlas as a list of (index, x, y), the position of the
+        image with that index in sizes, leaving a gutter around every image.
+        """
+        order = sorted(range(len(sizes)), key=lambda index: -sizes[index].height)
+        atlases = []
+        atlas, shelf_x, shelf_y, shelf_height = [], 0, 0, 0
+        for index in order:
+            cell_width = sizes[index].width + 2 * gutter
+            cell_height = sizes[index].height + 2 * gutter
+            if shelf_x + cell_width > atlas_size and shelf_x > 0:
+                shelf_x, shelf_y, shelf_height = 0, shelf_y + shelf_height, 0
+            if shelf_y + cell_height > atlas_size and len(atlas) > 0:
+                atlases.append(atlas)
+                atlas, shelf_x, shelf_y, shelf_height = [], 0, 0, 0
+            atlas.append((index, shelf_x + gutter, shelf_y + gutter))
+            shelf_x += cell_width
+            shelf_height = max(shelf_height, cell_height)
+        if len(atlas) > 0:
+            atlases.append(atlas)
+        return atlases
+
+    def _is_downsized(self, image: Image) -> bool:
+        return (self._largest_dimension is not None
+                and image.size.max_dimension > self._largest_dimension)
+
+    def _detection_parameters(self) -> dict:
+        """Return the parameters that the undilated mask depends on"""
+        return {
+            'mser_delta': self._mser_delta,
+            'mser_configurations': self._mser.configurations,
+            'threshold_delta_x': self._threshold_delta_x,
+            'threshold_delta_y': self._threshold_delta_y,
+            'threshold_num_groups': self._threshold_num_groups,
+            'bounding_box_mask': self._bounding_box_mask,
+            'largest_dimension': self._largest_dimension,
+            'min_region_points': self._min_region_points,
+            'max_aspect_ratio': self._max_aspect_ratio,
+            'min_fill_ratio': self._min_fill_ratio,
+            'max_stroke_width_ratio': self._max_stroke_width_ratio,
+        }
+
+    def _undilated_mask(self, result: DetectionResult) -> GrayscaleImage:
+        size = result.image.size
+        if result.detection_size == size:
+            return self._mask_from_groups(result.groups,
+                                          size,
+                                          bounding_boxes_only=self._bounding_box_mask)
+        return self._upscaled_mask_from_groups(result.groups,
+                                               result.detection_size,
+                                               size,
+                                               bounding_boxes_only=self._bounding_box_mask)
+
+    def _filtered_groups(self, regions: [MSERRegion], recorder,
+                         table: np.ndarray = None,
+                         prefilter: bool = True) -> ([[MSERRegion]], np.ndarray, np.ndarray):
+        """Pre-filter, combine, group and filter the detected regions into text
+        groups. Return the groups with the bounding box table of their regions
+        and the index of the group of every region.
+
+        The bounding box table of regions, given or built once here, is shared
+        by all stages, which pass on the indices of the surviving rows.
+        Combining never grows the enclosing boxes, so the table stays valid.
+        Without prefilter, the regions must have been pre-filtered already.
+        """
+        if table is None:
+            table = self._bounding_box_table(regions)
+        rows = np.arange(len(regions))
+        if prefilter and self._has_prefilter():
+            with recorder.stage('prefilter', count_in=len(rows)) as stage:
+                rows, stage.details = self._prefilter_rows(regions, table)
+                stage.count_out = len(rows)
+        with recorder.stage('combine', count_in=len(rows)) as stage:
+            rows = self._combine_rows(regions, table, rows)
+            stage.count_out = len(rows)
+        with recorder.stage('group', count_in=len(rows)) as stage:
+            grouped_rows = self._group_rows(table, rows,
+                                            threshold_delta_x=self._threshold_delta_x,
+                                            threshold_delta_y=self._threshold_delta_y)
+            num_groups = sum(len(v_group) for v_group in grouped_rows)
+            stage.count_out = num_groups
+        with recorder.stage('filter', count_in=num_groups) as stage:
+            kept_rows = self._flatten_and_filter(grouped_rows,
+                                                 threshold_num_groups=self._threshold_num_groups)
+            stage.count_out = len(kept_rows)
+
+        groups = [[regions[row] for row in group_rows.tolist()] for group_rows in kept_rows]
+        group_ids = np.repeat(np.arange(len(kept_rows), dtype=np.int32),
+                              [len(group_rows) for group_rows in kept_rows])
+        rows = np.concatenate(kept_rows) if kept_rows else np.empty(0, dtype=np.intp)
+        return groups, table[rows], group_ids
+
+    def _has_prefilter(self) -> bool:
+        return any(threshold is not None for threshold in (self._min_region_points,
+                                                           self._max_aspect_ratio,
+                                                           self._min_fill_ratio,
+                                                           self._max_stroke_width_ratio))
+
+    def _prefilter_rows(self, regions: [MSERRegion], table: np.ndarray) -> (np.ndarray, dict):
+        """Drop regions that are obviously not text and return the rows of
+        the kept regions in their bounding box table with the number of
+        dropped regions by reason.
+
+        The point count, aspect ratio and fill ratio are computed on the
+        bounding box table of all regions at once. The stroke width, which
+        needs a distance transform per region, is only estimated for the
+        regions that pass the other tests.
+        """
+        if len(regions) == 0:
+            return np.arange(0), {}
+
+        x0, y0, x1, y1 = table.T
+        widths = (x1 - x0).astype(np.float64)
+        heights = (y1 - y0).astype(np.float64)
+        num_points = np.array([region.num_points for region in regions], dtype=np.float64)
+
+        keep = np.ones(len(regions), dtype=bool)
+        dropped = {}
+
+        def drop(reason, rejected):
+            rejected &= keep
+            dropped[reason] = int(np.count_nonzero(rejected))
+            keep[rejected] = False
+
+        if self._min_region_points is not None:
+            drop('points', num_points < self._min_region_points)
+        if self._max_aspect_ratio is not None:
+            aspect_ratios = np.maximum(widths, heights) / np.maximum(np.minimum(widths, heights), 1)
+            drop('aspect_ratio', aspect_ratios > self._max_aspect_ratio)
+        if self._min_fill_ratio is not None:
+            # Merged regions can hold the same pixel several times, so the
+            # fill ratio may exceed 1
+            fill_ratios = num_points / np.maximum(widths * heights, 1)
+            drop('fill_ratio', fill_ratios < self._min_fill_ratio)
+        if self._max_stroke_width_ratio is not None:
+            candidates = np.flatnonzero(keep)
+            if len(candidates) == 0:
+                # The other tests dropped every region
+                dropped['stroke_width'] = 0
+            else:
+                stroke_widths = self._stroke_widths([regions[index] for index in candidates],
+                                                    table[candidates])
+                stroke_width_ratios = np.zeros(len(regions))
+                stroke_width_ratios[candidates] = (stroke_widths
+                                                   / np.maximum(np.maximum(widths, heights)[candidates], 1))
+                drop('stroke_width', stroke_width_ratios > self._max_stroke_width_ratio)
+
+        return np.flatnonzero(keep), dropped
+
+    @staticmethod
+    def _stroke_widths(regions: [MSERRegion], bboxes: np.ndarray) -> np.ndarray:
+        """Estimate the width of the widest stroke of every region.
+
+        An L1 distance transform runs on every region on its own, in the
+        crop of its (x0, y0, x1, y1) bounding box in bboxes, and twice the
+        largest distance from a region pixel to the background is its widest
+        stroke. MSER regions nest, so a transform over their union would give
+        inner regions the strokes of the regions around them.
+        """
+        stroke_widths = np.empty(len(regions))
+        for index, (region, (x0, y0, x1, y1)) in enumerate(zip(regions, bboxes.tolist())):
+            # The padding makes the border of the crop count as background
+            crop = np.zeros((y1 - y0 + 2, x1 - x0 + 2), dtype=np.uint8)
+            coordinates = region.coordinates
+            crop[coordinates[:, 1] - (y0 - 1), coordinates[:, 0] - (x0 - 1)] = 255
+            stroke_widths[index] = 2 * cv2.distanceTransform(crop, cv2.DIST_L1, 3).max()
+        return stroke_widths
 
     @staticmethod
     def _combine_enclosing_regions(regions: [MSERRegion]) -> [MSERRegion]:
-        sort_key = attrgetter('bounding_box.origin.y', 'bounding_box.origin.x')
-        sorted_regions = sorted(regions, key=sort_key)
+        rows = __class__._combine_rows(regions,
+                                       __class__._bounding_box_table(regions),
+                                       np.arange(len(regions)))
+        return [regions[row] for row in rows.tolist()]
 
-        for i in range(len(sorted_regions) - 1):
-            if not sorted_regions[i]:
+    @staticmethod
+    def _combine_rows(regions: [MSERRegion], table: np.ndarray, rows: np.ndarray) -> np.ndarray:
+        """Merge the regions at rows into the regions enclosing them and
+        return the rows of the remaining regions, sorted by origin"""
+        # Sorted by origin y, then x, like a stable sort on both
+        rows = rows[np.lexsort((table[rows, 0], table[rows, 1]))]
+        if len(rows) == 0:
+            return rows
+
+        x0, y0, x1, y1 = table[rows].T
+        alive = np.ones(len(rows), dtype=bool)
+
+        # A region can only enclose regions whose origin lies in its own
+        # vertical span, which is a contiguous slice of the sorted regions.
+        # Enclosing a region never grows the enclosing bounding box, so the
+        # boxes stay fixed while merging.
+        stops = np.searchsorted(y0, y1, side='right')
+        for i in range(len(rows) - 1):
+            if not alive[i]:
                 continue
-            for j in range(i + 1, len(sorted_regions)):
-                if not sorted_regions[j]:
-                    continue
-                reg1_bbox: Rectangle = sorted_regions[i].bounding_box
-                reg2_bbox: Rectangle = sorted_regions[j].bounding_box
-                if reg1_bbox.encloses(reg2_bbox):
-                    sorted_regions[i].add_region(sorted_regions[j])
-                    sorted_regions[j] = None
+            start, stop = i + 1, stops[i]
+            if start >= stop:
+                continue
+            enclosed = (alive[start:stop]
+                        & (x0[start:stop] >= x0[i])
+                        & (x1[start:stop] <= x1[i])
+                        & (y1[start:stop] <= y1[i]))
+            for j in rows[np.flatnonzero(enclosed) + start].tolist():
+                regions[rows[i]].add_region(regions[j])
+            alive[start:stop] &= ~enclosed
 
-        return [region for region in sorted_regions if region]
+        return rows[alive]
 
     @staticmethod
     def _group_mser_regions(regions: [MSERRegion],
                            threshold_delta_x: float = 1.8,
                            threshold_delta_y: float = 1.0) -> [[[MSERRegion]]]:
-        # Initially sort regions by baseline
-        v_sorted_regions: [MSERRegion] = sorted(regions, key=attrgetter('bounding_box.end.y'))
-
-        # Group vertically nearby areas
-        v_groups: [[MSERRegion]] = [[]]
-        for v_sorted_region in v_sorted_regions:
-            # Add initial region and do nothing
-            if len(v_groups[-1]) == 0:
-                v_groups[-1].append(v_sorted_region)
-                continue
+        if len(regions) == 0:
+            return [[[]]]
+        grouped_rows = __class__._group_rows(__class__._bounding_box_table(regions),
+                                             np.arange(len(regions)),
+                                             threshold_delta_x=threshold_delta_x,
+                                             threshold_delta_y=threshold_delta_y)
+        return [[[regions[row] for row in h_group.tolist()] for h_group in v_group]
+                for v_group in grouped_rows]
 
-            v_group_first_region = v_groups[-1][0]
-            delta_y = abs(
-                v_group_first_region.bounding_box.end.y - v_sorted_region.bounding_box.end.y
-            )
-            median_height = np.median(
-                [region.bounding_box.size.height for region in v_groups[-1]]
-            )
-            norm_delta_y = delta_y / median_height
-            if norm_delta_y > threshold_delta_y:
-                v_groups.append([v_sorted_region])
-                continue
+    @staticmethod
+    def _group_rows(table: np.ndarray, rows: np.ndarray,
+                    threshold_delta_x: float = 1.8,
+                    threshold_delta_y: float = 1.0) -> [[np.ndarray]]:
+        """Group the regions at rows of their bounding box table into lines,
+        then words, and return the rows of every group"""
+        if len(rows) == 0:
+            return [[rows]]
+
+        x0, y0, x1, y1 = table[rows].T
+        widths = x1 - x0
+        heights = y1 - y0
 
-            v_groups[-1].append(v_sorted_region)
+        # Initially sort regions by baseline
+        v_order = np.argsort(y1, kind='stable')
+
+        # Group vertically nearby areas. The median height of the current
+        # group is maintained incrementally as regions are appended.
+        v_sorted_baselines = y1[v_order].tolist()
+        v_sorted_heights = heights[v_order].tolist()
+        v_groups: [np.ndarray] = []
+        v_group_start = 0
+        median_height = _RunningMedian()
+        median_height.add(v_sorted_heights[0])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for position in range(1, len(v_order)):
+                delta_y = abs(v_sorted_baselines[v_group_start] - v_sorted_baselines[position])
+                norm_delta_y = np.float64(delta_y) / median_height.median
+                if norm_delta_y > threshold_delta_y:
+                    v_groups.append(v_order[v_group_start:position])
+                    v_group_start = position
+                    median_height = _RunningMedian()
+                median_height.add(v_sorted_heights[position])
+        v_groups.append(v_order[v_group_start:])
 
         total_regions_in_vertical_groups = sum([len(v_group) for v_group in v_groups])
-        assert (len(regions) == total_regions_in_vertical_groups)
+        assert (len(rows) == total_regions_in_vertical_groups)
 
-        # Group each vertical group into horizontal groups
-        groups: [[[MSERRegion]]] = []
+        # Group each vertical group into horizontal groups, splitting where
+        # the gap between neighbouring origins exceeds the threshold
+        groups: [[np.ndarray]] = []
         for v_group in v_groups:
-            groups.append([[]])
-            median_width = np.median(
-                [region.bounding_box.size.width for region in v_group]
-            )
-            h_sorted_regions: [MSERRegion] = sorted(v_group,
-                                                    key=attrgetter('bounding_box.origin.x'))
-            for h_sorted_region in h_sorted_regions:
-                if len(groups[-1][-1]) == 0:
-                    groups[-1][-1].append(h_sorted_region)
-                    continue
-
-                h_prev_region = groups[-1][-1][-1]
-                delta_x = abs(
-                    h_prev_region.bounding_box.origin.x - h_sorted_region.bounding_box.origin.x
-                )
+            median_width = np.median(widths[v_group])
+            h_order = v_group[np.argsort(x0[v_group], kind='stable')]
+            delta_x = np.abs(np.diff(x0[h_order]))
+            with np.errstate(divide='ignore', invalid='ignore'):
                 norm_delta_x = delta_x / median_width
-                if norm_delta_x > threshold_delta_x:
-                    groups[-1].append([h_sorted_region])
-                    continue
-
-                groups[-1][-1].append(h_sorted_region)
+            split_points = np.flatnonzero(norm_delta_x > threshold_delta_x) + 1
+            groups.append([rows[h_group] for h_group in np.split(h_order, split_points)])
 
         total_regions_in_groups = 0
         for v_grp in groups:
             for h_grp in v_grp:
                 total_regions_in_groups += len(h_grp)
-        assert (len(regions) == total_regions_in_groups)
+        assert (len(rows) == total_regions_in_groups)
 
         return groups
 
@@ -145,20 +764,201 @@ class TextDetection:
         return filtered_groups
 
     @staticmethod
-    def _mask_from_groups(groups: [[MSERRegion]], size: Size) -> GrayscaleImage:
+    def _mask_from_groups(groups: [[MSERRegion]],
+                          size: Size,
+                          bounding_boxes_only: bool = False) -> GrayscaleImage:
         regions = []
         for group in groups:
             regions += group
-        return __class__._mask_from_mser_regions(regions, size)
+        return __class__._mask_from_mser_regions(regions,
+                                                 size,
+                                                 bounding_boxes_only=bounding_boxes_only)
 
 
     @staticmethod
-    def _mask_from_mser_regions(regions: [MSERRegion], size: Size) -> GrayscaleImage:
+    def _mask_from_mser_regions(regions: [MSERRegion],
+                                size: Size,
+                                bounding_boxes_only: bool = False) -> GrayscaleImage:
         mask = GrayscaleImage.black_canvas(size)
-        for region in regions:
-            region.plot_in_mask(mask)
+        if len(regions) == 0:
+            return mask
+
+        if bounding_boxes_only:
+            for region in regions:
+                x, y = region.bounding_box.origin.as_tuple()
+                w, h = region.bounding_box.size.as_tuple()
+                mask.data[y:y + h, x:x + w] = 255
+            return mask
+
+        # Write the pixels of all regions in a single fancy-index assignment
+        coordinates = np.concatenate([region.coordinates for region in regions])
+        mask.data[coordinates[:, 1], coordinates[:, 0]] = 255
         return mask
 
+    @staticmethod
+    def _upscaled_mask_from_groups(groups: [[MSERRegion]],
+                                   detection_size: Size,
+                                   size: Size,
+                                   bounding_boxes_only: bool = False) -> GrayscaleImage:
+        """Build the mask of size for groups detected on an image of detection_size"""
+        if bounding_boxes_only:
+            scale_x = size.width / detection_size.width
+            scale_y = size.height / detection_size.height
+            scaled_groups = [
+                [MSERRegion(Rectangle.scale(region.bounding_box, scale_x, scale_y))
+                 for region in group]
+                for group in groups
+            ]
+            return __class__._mask_from_groups(scaled_groups, size, bounding_boxes_only=True)
+
+        # Pixels of the scaled up regions are too sparse to cover the text,
+        # so the mask is rasterized at detection size and resized instead
+        detection_mask = __class__._mask_from_groups(groups, detection_size)
+        data = cv2.resize(detection_mask.data,
+                          size.as_tuple(),
+                          interpolation=cv2.INTER_NEAREST)
+        return GrayscaleImage(data)
+
+    def _inpaint(self, image: Image, mask: GrayscaleImage, pixel_counts: dict=None) -> np.ndarray:
+        """Return the inpainted data of image. When pixel_counts is given, the
+        number of masked pixels every backend filled is added to it."""
+        if self._roi_inpaint or self._is_downsized(image):
+            return self._inpaint_rois(image.data, mask.data, pixel_counts=pixel_counts)
+        if self._flat_threshold is None:
+            if pixel_counts is not None:
+                name = self._inpaint_backend.name
+                pixel_counts[name] = pixel_counts.get(name, 0) + int(np.count_nonzero(mask.data))
+            return self._inpaint_backend.inpaint(image.data, mask.data, self._inpaint_radius)
+        return self._inpaint_components(image.data, mask.data, pixel_counts=pixel_counts)
+
+    def _inpaint_components(self, data: np.ndarray, mask_data: np.ndarray,
+                            pixel_counts: dict=None) -> np.ndarray:
+        """Fill the mask components of data with a near-uniform ring with the
+        flat backend, one at a time, and inpaint all others at once with the
+        inpainting backend on the whole image"""
+        inpainted_data = np.copy(data)
+        height, width = mask_data.shape[:2]
+        num_labels, labels, stats, _ = cv2.connectedComponentsWithStats(mask_data, connectivity=8)
+
+        remaining = np.zeros_like(mask_data)
+        counts = {}
+        for label in range(1, num_labels):
+            x, y, w, h, area = stats[label]
+            x0, y0 = max(x - RING_WIDTH, 0), max(y - RING_WIDTH, 0)
+            x1, y1 = min(x + w + RING_WIDTH, width), min(y + h + RING_WIDTH, height)
+            component = labels[y0:y1, x0:x1] == label
+            component_mask = np.where(component, 255, 0).astype(np.uint8)
+            backend = self._select_backend(data[y0:y1, x0:x1], component_mask)
+            if backend is self._flat_backend:
+                filled = backend.inpaint(data[y0:y1, x0:x1], component_mask, self._inpaint_radius)
+                inpainted_data[y0:y1, x0:x1][component] = filled[component]
+            else:
+                remaining[y0:y1, x0:x1][component] = 255
+                backend = self._inpaint_backend
+            counts[backend.name] = counts.get(backend.name, 0) + int(area)
+
+        if remaining.any():
+            inpainted_data = self._inpaint_backend.inpaint(inpainted_data, remaining, self._inpaint_radius)
+        if pixel_counts is not None:
+            for name, count in counts.items():
+                pixel_counts[name] = pixel_counts.get(name, 0) + count
+        return inpainted_data
+
+    def _select_backend(self, data: np.ndarray, mask_data: np.ndarray) -> InpaintBackend:
+        if self._flat_threshold is not None and is_flat(data, mask_data, self._flat_threshold):
+            return self._flat_backend
+        return self._inpaint_backend
+
+    def _inpaint_rois(self, data: np.ndarray, mask_data: np.ndarray, pixel_counts: dict=None) -> np.ndarray:
+        """Inpaint data in padded crops around the clusters of mask_data instead
+        of the whole image.
+
+        Mask components closer than the padding are merged into one cluster.
+        Clusters are labelled on a grid subsampled by half the padding, which
+        keeps the labelling cheap on large images. Every crop reads the
+        original image and only writes back the masked pixels of its own
+        cluster, so crops are independent and run on up to inpaint_workers
+        threads (cv2.inpaint releases the GIL). The backend is selected per
+        crop.
+        """
+        inpainted_data = np.copy(data)
+        height, width = mask_data.shape[:2]
+        padding = self._inpaint_radius + 1
+        kernel = np.ones((2 * padding + 1, 2 * padding + 1), np.uint8)
+
+        # Every masked pixel is within padding of the grid point at its
+        # top left, so all masked pixels are labelled
+        step = max(1, padding // 2)
+        padded_mask = cv2.dilate(mask_data, kernel)[::step, ::step]
+        num_labels, labels, stats, _ = cv2.connectedComponentsWithStats(padded_mask,
+                                                                        connectivity=8)
+        if num_labels <= 1:
+            return inpainted_data
+
+        def inpaint_cluster(label):
+            grid_x, grid_y, grid_w, grid_h, _ = stats[label]
+            grid_x0, grid_y0 = max(grid_x - 1, 0), max(grid_y - 1, 0)
+            grid_x1, grid_y1 = grid_x + grid_w + 1, grid_y + grid_h + 1
+            x0, y0 = grid_x0 * step, grid_y0 * step
+            x1, y1 = min(grid_x1 * step, width), min(grid_y1 * step, height)
+
+            roi_data = data[y0:y1, x0:x1]
+            roi_mask = mask_data[y0:y1, x0:x1]
+            backend = self._select_backend(roi_data, roi_mask)
+            roi_inpainted = backend.inpaint(roi_data, roi_mask, self._inpaint_radius)
+            roi_labels = labels[grid_y0:grid_y1, grid_x0:grid_x1]
+            roi_labels = np.repeat(np.repeat(roi_labels, step, axis=0), step, axis=1)
+            cluster = (roi_labels[:y1 - y0, :x1 - x0] == label) & (roi_mask > 0)
+            inpainted_data[y0:y1, x0:x1][cluster] = roi_inpainted[cluster]
+            return backend.name, int(np.count_nonzero(cluster))
+
+        if self._inpaint_workers > 1:
+            with ThreadPoolExecutor(max_workers=self._inpaint_workers) as executor:
+                filled = list(executor.map(inpaint_cluster, range(1, num_labels)))
+        else:
+            filled = [inpaint_cluster(label) for label in range(1, num_labels)]
+
+        if pixel_counts is not None:
+            for name, count in filled:
+                pixel_counts[name] = pixel_counts.get(name, 0) + count
+        return inpainted_data
+
+    @staticmethod
+    def _bounding_box_table(regions: [MSERRegion]) -> np.ndarray:
+        """Return the bounding boxes of regions as an (N, 4) array of (x0, y0, x1, y1)"""
+        table = np.empty((len(regions), 4), dtype=np.int32)
+        table[:, 0] = [region.bounding_box.origin.x for region in regions]
+        table[:, 1] = [region.bounding_box.origin.y for region in regions]
+        table[:, 2] = [region.bounding_box.size.width for region in regions]
+        table[:, 3] = [region.bounding_box.size.height for region in regions]
+        table[:, 2:] += table[:, :2]
+        return table
+
+
+class _RunningMedian:
+    """Median of a growing sequence of values, equal to np.median of the values"""
+    def __init__(self):
+        # Max-heap (negated) of the lower half and min-heap of the upper half
+        self._lower = []
+        self._upper = []
+
+    def add(self, value):
+        if len(self._lower) == 0 or value <= -self._lower[0]:
+            heapq.heappush(self._lower, -value)
+        else:
+            heapq.heappush(self._upper, value)
+
+        if len(self._lower) > len(self._upper) + 1:
+            heapq.heappush(self._upper, -heapq.heappop(self._lower))
+        elif len(self._upper) > len(self._lower):
+            heapq.heappush(self._lower, -heapq.heappop(self._upper))
+
+    @property
+    def median(self) -> np.float64:
+        if len(self._lower) > len(self._upper):
+            return np.float64(-self._lower[0])
+        return (np.float64(-self._lower[0]) + np.float64(self._upper[0])) / 2
+
 
 # def rectangle_for_regions(regions: [MSERRegion]):
 #     rect = None
@@ -0,0 +1,267 @@
+from detection_result import DetectionResult
+from kv import Size
+from kv.image import GrayscaleImage, Image, ImageMode
+from instrumentation import StageRecorder
+from text_detection import TextDetection
+import numpy as np
+
+
+class _TileRegion:
+    """Region kept by TiledTextDetection without its pixels, as the tile and
+    index in the tile's MSER regions of itself and of the regions merged
+    into it"""
+    __slots__ = ('sources', 'num_points')
+
+    def __init__(self, tile: int, index: int, num_points: int):
+        self.sources = [(tile, index)]
+        self.num_points = num_points
+
+    def add_region(self, region):
+        self.sources = self.sources + region.sources
+        self.num_points += region.num_points
+
+
+class TiledTextDetection(TextDetection):
+    """Text detection for images too large to process in one piece.
+
+    MSER runs on overlapping tiles and the mask and inpainting are computed
+    tile by tile. Only the bounding boxes and point counts of the regions
+    are kept across tiles, their pixels are detected again on their tile
+    when the mask is written, so memory use is bounded by the tile size
+    instead of the image size. Combined with file backed
+    images (Image.from_file and Image.create_file) this processes images
+    that do not fit in memory.
+
+    Caching and downsizing, which would hold whole image masks, are not
+    supported.
+    """
+    def __init__(self,
+                 tile_size: int=2048,
+                 tile_overlap: int=128,
+                 **kwargs):
+        for name in ('cache', 'largest_dimension'):
+            if kwargs.get(name) is not None:
+                raise ValueError("TiledTextDetection does not support {}".format(name))
+        super().__init__(**kwargs)
+
+        # Side of the square tiles the image is processed in
+        self._tile_size = tile_size
+
+        # Margin added around every tile, regions larger than this may be
+        # split at tile seams
+        self._tile_overlap = tile_overlap
+
+    def detect(self, image: Image, recorder=None,
+               output: Image=None, mask: GrayscaleImage=None) -> (Image, GrayscaleImage):
+        """Detect and inpaint the text in image.
+
+        The inpainted image and mask are written to output and mask when they
+        are given, for example file backed images from Image.create_file.
+        Otherwise they are allocated in memory, with output in RGB.
+        """
+        result = self.detect_regions(image, recorder=recorder)
+        mask = self.build_mask(result, recorder=recorder, mask=mask)
+        if output is None:
+            output = Image(np.empty((image.height, image.width, 3), dtype=np.uint8),
+                           mode=ImageMode.RGB)
+        return self.inpaint(result, recorder=recorder, output=output), mask
+
+    def detect_batch(self, images: [Image], recorder=None, **kwargs) -> [(Image, GrayscaleImage)]:
+        """Detect and inpaint the text in many images, one at a time like
+        detect. Images are not packed into atlases."""
+        return [self.detect(image, recorder=recorder) for image in images]
+
+    def detect_mask(self, image: Image, recorder=None, mask: GrayscaleImage=None) -> GrayscaleImage:
+        """Return the dilated text mask of image, written to mask when given"""
+        result = self.detect_regions(image, recorder=recorder)
+        return self.build_mask(result, recorder=recorder, mask=mask)
+
+    def detect_regions(self, image: Image, recorder=None) -> DetectionResult:
+        """Detect the text regions of image tile by tile without building a
+        mask.
+
+        Unlike TextDetection, the image of the result is image itself, in its
+        own mode, and the groups hold regions without pixels, which only
+        refer to their tile, see build_mask.
+        """
+        recorder = recorder or StageRecorder()
+        first_record = len(recorder.records)
+
+        result = DetectionResult(image)
+        regions, table = self._detect_tile_regions(image, recorder)
+        result.groups, result.bboxes, result.group_ids = self._filtered_groups(regions, recorder,
+                                                                               table=table,
+                                                                               prefilter=False)
+        result.add_timings(recorder.records[first_record:])
+        return result
+
+    def build_mask(self, result: DetectionResult, recorder=None,
+                   mask: GrayscaleImage=None) -> GrayscaleImage:
+        """Build the dilated text mask of a detection tile by tile and store it
+        on the result, written to mask when given"""
+        recorder = recorder or StageRecorder()
+        first_record = len(recorder.records)
+        if mask is None:
+            mask = GrayscaleImage.black_canvas(result.image.size)
+
+        with recorder.stage('mask', count_in=len(result.groups)) as stage:
+            kept_regions = [region for group in result.groups for region in group]
+            self._write_mask_tiles(result.image, kept_regions, result.bboxes, mask)
+            stage.count_out = len(kept_regions)
+        mask.invalidate()
+        mask.flush()
+        result.mask = mask
+
+        result.add_timings(recorder.records[first_record:])
+        return mask
+
+    def inpaint(self, result: DetectionResult, recorder=None, output: Image=None) -> Image:
+        """Inpaint the masked text of a detection tile by tile, building the
+        mask if needed. The inpainting is written to output when given,
+        otherwise it is allocated in memory in the mode of the detected
+        image."""
+        recorder = recorder or StageRecorder()
+        if result.mask is None:
+            self.build_mask(result, recorder=recorder)
+        first_record = len(recorder.records)
+        image = result.image
+        if output is None:
+            output = Image(np.empty_like(image.data), mode=image.mode)
+
+        with recorder.stage('inpaint') as stage:
+            self._inpaint_tiles(image, result.mask, output)
+            stage.nbytes = 0
+        output.invalidate()
+        output.flush()
+
+        result.add_timings(recorder.records[first_record:])
+        return output
+
+    def _tiles(self, size: Size, padding: int):
+        """Yield the (x0, y0, x1, y1) core and padded bounds of every tile"""
+        for y in range(0, size.height, self._tile_size):
+            for x in range(0, size.width, self._tile_size):
+                core = (x, y,
+                        min(x + self._tile_size, size.width),
+                        min(y + self._tile_size, size.height))
+                padded = (max(core[0] - padding, 0), max(core[1] - padding, 0),
+                          min(core[2] + padding, size.width), min(core[3] + padding, size.height))
+                yield core, padded
+
+    def _tile(self, image: Image, bounds: (int, int, int, int)) -> Image:
+        x0, y0, x1, y1 = bounds
+        return Image(np.asarray(image.data[y0:y1, x0:x1]), mode=image.mode)
+
+    def _detect_tile_regions(self, image: Image, recorder) -> ([_TileRegion], np.ndarray):
+        """Run MSER and the pre-filter on every padded tile and return the
+        kept regions with their bounding box table in image coordinates.
+
+        Regions found in the overlap of several tiles are only kept by the
+        tile whose core contains their origin. Their pixels are dropped with
+        the tile, the returned regions only refer to their tile and index in
+        its MSER regions, so that _write_mask_tiles detects them again.
+        """
+        regions = []
+        tables = []
+        for tile_index, (core, padded) in enumerate(self._tiles(image.size, self._tile_overlap)):
+            offset = np.array(padded[:2] * 2, dtype=np.int32)
+            with recorder.stage('mser') as stage:
+                tile_regions = self._mser.detect(self._tile(image, padded))
+                tile_table = self._bounding_box_table(tile_regions)
+                x0, y0 = tile_table[:, 0] + offset[0], tile_table[:, 1] + offset[1]
+                rows = np.flatnonzero((core[0] <= x0) & (x0 < core[2]) & (core[1] <= y0) & (y0 < core[3]))
+                stage.count_out = len(rows)
+                # Pixel coordinates are stored as pairs of int32
+                stage.nbytes = 8 * sum(region.num_points for region in tile_regions)
+            if self._has_prefilter():
+                # The pre-filter tests every region on its own, so it runs
+                # while the pixels of the tile are at hand
+                with recorder.stage('prefilter', count_in=len(rows)) as stage:
+                    kept, stage.details = self._prefilter_rows([tile_regions[row] for row in rows],
+                                                               tile_table[rows])
+                    rows = rows[kept]
+                    stage.count_out = len(rows)
+            regions += [_TileRegion(tile_index, row, tile_regions[row].num_points) for row in rows.tolist()]
+            tables.append(tile_table[rows] + offset)
+        return regions, np.concatenate(tables)
+
+    def _write_mask_tiles(self, image: Image, regions: [_TileRegion], bboxes: np.ndarray,
+                          mask: GrayscaleImage):
+        """Rasterize and dilate regions, with their bounding box table bboxes,
+        into mask one tile at a time.
+
+        The pixels of the regions are detected again on their MSER tiles,
+        each once, and kept until the last mask tile overlapping them.
+        """
+        if len(regions) == 0:
+            return
+
+        bx0, by0, bx1, by1 = bboxes.T
+        mser_tiles = [padded for _, padded in self._tiles(image.size, self._tile_overlap)]
+
+        # Each dilation with the default 5x5 kernel grows the mask by 2 pixels
+        padding = 2 * self._num_dilations
+        mask_tiles = []
+        last_uses = {}
+        for index, (core, padded) in enumerate(self._tiles(mask.size, padding)):
+            x0, y0, x1, y1 = padded
+            overlapping = np.flatnonzero((bx0 < x1) & (bx1 > x0) & (by0 < y1) & (by1 > y0))
+            mask_tiles.append((core, padded, overlapping))
+            if not self._bounding_box_mask:
+                for region in overlapping.tolist():
+                    for tile, _ in regions[region].sources:
+                        last_uses[tile] = index
+
+        # Coordinates of the region sources, by (tile, index in the tile)
+        wanted = {}
+        for region in regions:
+            for tile, row in region.sources:
+                wanted.setdefault(tile, []).append(row)
+        coordinates = {}
+
+        for index, (core, padded, overlapping) in enumerate(mask_tiles):
+            if len(overlapping) == 0:
+                continue
+            x0, y0, x1, y1 = padded
+            tile_mask = GrayscaleImage.black_canvas(Size(x1 - x0, y1 - y0))
+            if self._bounding_box_mask:
+                for region in overlapping:
+                    tile_mask.data[max(by0[region] - y0, 0):max(by1[region] - y0, 0),
+                                   max(bx0[region] - x0, 0):max(bx1[region] - x0, 0)] = 255
+            else:
+                sources = [source for region in overlapping.tolist() for source in regions[region].sources]
+                for tile in sorted({tile for tile, _ in sources}):
+                    if (tile, wanted[tile][0]) not in coordinates:
+                        tile_regions = self._mser.detect(self._tile(image, mser_tiles[tile]))
+                        offset = np.array(mser_tiles[tile][:2], dtype=np.int32)
+                        for row in wanted[tile]:
+                            coordinates[tile, row] = tile_regions[row].coordinates + offset
+                tile_coordinates = np.concatenate([coordinates[source] for source in sources])
+                tile_coordinates = tile_coordinates - np.array([x0, y0], dtype=np.int32)
+                inside = ((tile_coordinates[:, 0] >= 0) & (tile_coordinates[:, 0] < x1 - x0)
+                          & (tile_coordinates[:, 1] >= 0) & (tile_coordinates[:, 1] < y1 - y0))
+                tile_coordinates = tile_coordinates[inside]
+                tile_mask.data[tile_coordinates[:, 1], tile_coordinates[:, 0]] = 255
+                for tile in [tile for tile, last_use in last_uses.items() if last_use == index]:
+                    for row in wanted[tile]:
+                        del coordinates[tile, row]
+            tile_mask.dilate(iterations=self._num_dilations)
+
+            cx0, cy0, cx1, cy1 = core
+            mask.data[cy0:cy1, cx0:cx1] = tile_mask.data[cy0 - y0:cy1 - y0, cx0 - x0:cx1 - x0]
+
+    def _inpaint_tiles(self, image: Image, mask: GrayscaleImage, output: Image):
+        """Inpaint image into output one padded tile at a time"""
+        padding = max(self._tile_overlap, self._inpaint_radius + 1)
+        for core, padded in self._tiles(image.size, padding):
+            x0, y0, x1, y1 = padded
+            cx0, cy0, cx1, cy1 = core
+            tile = self._tile(image, padded).as_mode(output.mode, cache=False)
+            tile_mask = np.asarray(mask.data[y0:y1, x0:x1])
+
+            if tile_mask.any():
+                inpainted_data = self._inpaint(tile, GrayscaleImage(tile_mask))
+            else:
+                inpainted_data = tile.data
+            output.data[cy0:cy1, cx0:cx1] = inpainted_data[cy0 - y0:cy1 - y0, cx0 - x0:cx1 - x0]
+
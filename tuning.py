@@ -0,0 +1,276 @@
+"""Offline tuning of TextDetection parameters.
+
+    python tuning.py SAMPLE_FOLDER --output profile.json --time-budget 0.5
+
+Every image of the sample folder is detected with a sweep of MSER deltas and
+grouping thresholds. The measured times calibrate a CostModel, and the images
+are split into bands of region density, each keeping the parameters whose
+masks agree best with the reference masks within the time budget. The
+reference masks are read from --mask-folder when given (NAME_mask.png, as
+written by imagetextremover) and otherwise are the masks of the default
+parameters. The saved TuningProfile is loaded by AutoTunedTextDetection.
+"""
+from kv.image import Image, ImageMode
+from text_detection import TextDetection
+from kv.mser import MSERDetector
+import argparse
+import itertools
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import cv2
+
+
+class CostModel:
+    """Predicts the seconds detect_regions and build_mask take on an image
+    from its number of pixels and MSER regions"""
+    def __init__(self,
+                 seconds_per_megapixel: float = 0.2,
+                 seconds_per_region: float = 1e-4,
+                 seconds_per_region_squared: float = 1e-8):
+        self.seconds_per_megapixel = seconds_per_megapixel
+        self.seconds_per_region = seconds_per_region
+        self.seconds_per_region_squared = seconds_per_region_squared
+
+    def predict(self, num_pixels: float, num_regions: float) -> float:
+        return (self.seconds_per_megapixel * num_pixels / 1e6
+                + self.seconds_per_region * num_regions
+                + self.seconds_per_region_squared * num_regions ** 2)
+
+    @classmethod
+    def fit(cls, samples: [(int, int, float)]):
+        """Return the model fitting (num_pixels, num_regions, seconds) samples
+        best, with non-negative coefficients"""
+        samples = np.array(samples, dtype=np.float64).reshape(-1, 3)
+        if len(samples) < 3:
+            return cls()
+        num_pixels, num_regions, seconds = samples.T
+        features = np.stack([num_pixels / 1e6, num_regions, num_regions ** 2], axis=1)
+        coefficients, _, _, _ = np.linalg.lstsq(features, seconds, rcond=None)
+        return cls(*np.maximum(coefficients, 0.).tolist())
+
+    def as_dict(self) -> dict:
+        return dict(vars(self))
+
+
+class TuningProfile:
+    """Parameters of AutoTunedTextDetection, saved as JSON"""
+    def __init__(self,
+                 time_budget: float = 1.,
+                 deltas: [int] = (25, 35, 50, 75),
+                 largest_dimensions: [int] = (2048, 1536, 1024, 768),
+                 probe_dimension: int = 512,
+                 region_exponent: float = 1.,
+                 cost_model: CostModel = None,
+                 bands: [dict] = None):
+        # Seconds detecting an image may take, inpainting excluded
+        self.time_budget = time_budget
+
+        # MSER deltas tried in increasing order while over budget, larger
+        # deltas find fewer regions
+        self.deltas = list(deltas)
+
+        # Largest dimensions images are downsized to for detection, tried in
+        # decreasing order when no delta is within budget
+        self.largest_dimensions = list(largest_dimensions)
+
+        # Largest dimension of the probe image regions are counted on
+        self.probe_dimension = probe_dimension
+
+        # Exponent of the pixel ratio scaling the probe's region count to
+        # the full image's
+        self.region_exponent = region_exponent
+
+        self.cost_model = cost_model or CostModel()
+
+        # {'max_density': regions per megapixel or None, 'parameters': {...}}
+        # in increasing max_density, the last one without a maximum
+        self.bands = bands or []
+
+    def parameters_for_density(self, density: float) -> dict:
+        """Return the parameters of the band the density falls in"""
+        for band in self.bands:
+            if band['max_density'] is None or density <= band['max_density']:
+                return dict(band['parameters'])
+        return {}
+
+    def as_dict(self) -> dict:
+        return {
+            'time_budget': self.time_budget,
+            'deltas': self.deltas,
+            'largest_dimensions': self.largest_dimensions,
+            'probe_dimension': self.probe_dimension,
+            'region_exponent': self.region_exponent,
+            'cost_model': self.cost_model.as_dict(),
+            'bands': self.bands,
+        }
+
+    def save(self, path: str):
+        with open(path, 'w') as profile_file:
+            json.dump(self.as_dict(), profile_file, indent=2)
+
+    @classmethod
+    def load(cls, path: str):
+        with open(path) as profile_file:
+            values = json.load(profile_file)
+        values['cost_model'] = CostModel(**values.get('cost_model', {}))
+        return cls(**values)
+
+
+GROUPING_GRID = {
+    'threshold_delta_x': [1.8, 1.4, 2.2],
+    'threshold_delta_y': [1.0, 0.8],
+    'threshold_num_groups': [2, 3, 4],
+}
+
+
+def _iou(mask: np.ndarray, reference: np.ndarray) -> float:
+    mask, reference = mask > 0, reference > 0
+    union = np.count_nonzero(mask | reference)
+    if union == 0:
+        return 1.
+    return np.count_nonzero(mask & reference) / union
+
+
+def _grouping_combinations(grid: dict) -> [dict]:
+    names = list(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(grid[name] for name in names))]
+
+
+def tune(image_paths: [str],
+         detector_kwargs: dict = None,
+         time_budget: float = 1.,
+         deltas: [int] = (15, 25, 35, 50, 75),
+         grouping_grid: dict = None,
+         num_bands: int = 3,
+         mask_folder: str = None,
+         log=None) -> TuningProfile:
+    """Sweep deltas and grouping thresholds over the images and return the
+    tuned profile"""
+    detector_kwargs = detector_kwargs or {}
+    combinations = _grouping_combinations(grouping_grid or GROUPING_GRID)
+    base = TextDetection(**detector_kwargs)
+    base_delta = detector_kwargs.get('mser_delta', 25)
+    probe_dimension = TuningProfile().probe_dimension
+
+    cost_samples = []
+    exponent_samples = []
+    images = []
+    for path in image_paths:
+        data = cv2.imread(path)
+        if data is None:
+            continue
+        image = Image(cv2.cvtColor(data, cv2.COLOR_BGR2RGB), mode=ImageMode.RGB)
+        num_pixels = image.width * image.height
+        probe = image
+        if image.size.max_dimension > probe_dimension:
+            probe = Image.downsize(image, probe_dimension)
+        pixel_ratio = num_pixels / (probe.width * probe.height)
+
+        reference = None
+        if mask_folder is not None:
+            stem, _ = os.path.splitext(os.path.basename(path))
+            reference = cv2.imread(os.path.join(mask_folder, stem + "_mask.png"), cv2.IMREAD_GRAYSCALE)
+        if reference is None:
+            reference = base.build_mask(base.detect_regions(image)).data
+
+        # (delta, combination index) -> (seconds, agreement with the reference)
+        scores = {}
+        density = None
+        for delta in deltas:
+            detector = TextDetection(**dict(detector_kwargs, mser_delta=delta))
+            num_probe_regions = len(MSERDetector(delta=delta).detect(probe))
+
+            start = time.perf_counter()
+            rgb_image = Image.view(image, target_mode=ImageMode.RGB)
+            regions = detector._mser.detect(rgb_image)
+            num_regions = len(regions)
+            table = TextDetection._bounding_box_table(regions)
+            combined = TextDetection._combine_rows(regions, table, np.arange(num_regions))
+            mser_seconds = time.perf_counter() - start
+
+            if num_probe_regions > 0 and num_regions > 0 and pixel_ratio > 1:
+                exponent_samples.append(np.log(num_regions / num_probe_regions) / np.log(pixel_ratio))
+            if delta == base_delta:
+                density = num_regions / (num_pixels / 1e6)
+
+            for index, combination in enumerate(combinations):
+                start = time.perf_counter()
+                grouped_rows = TextDetection._group_rows(table, combined,
+                                                         threshold_delta_x=combination['threshold_delta_x'],
+                                                         threshold_delta_y=combination['threshold_delta_y'])
+                grouped_rows = TextDetection._flatten_and_filter(grouped_rows,
+                                                                 threshold_num_groups=combination['threshold_num_groups'])
+                groups = [[regions[row] for row in rows.tolist()] for rows in grouped_rows]
+                mask = TextDetection._mask_from_groups(groups, image.size,
+                                                       bounding_boxes_only=detector._bounding_box_mask)
+                mask.dilate(iterations=detector._num_dilations)
+                seconds = mser_seconds + time.perf_counter() - start
+                scores[delta, index] = (seconds, _iou(mask.data, reference))
+                if index == 0:
+                    cost_samples.append((num_pixels, num_regions, seconds))
+
+        if density is None:
+            density = len(MSERDetector(delta=base_delta).detect(probe)) * pixel_ratio / (num_pixels / 1e6)
+        images.append((density, scores))
+        if log is not None:
+            print("{}: {:.0f} regions/MP".format(path, density), file=log)
+
+    profile = TuningProfile(time_budget=time_budget,
+                            deltas=sorted(delta for delta in deltas if delta >= base_delta),
+                            cost_model=CostModel.fit(cost_samples))
+    if exponent_samples:
+        profile.region_exponent = float(np.median(exponent_samples))
+    if len(images) == 0:
+        return profile
+
+    # Split the images in bands of equal size by density
+    images.sort(key=lambda item: item[0])
+    for band_images in np.array_split(np.arange(len(images)), min(num_bands, len(images))):
+        keys = images[band_images[0]][1].keys()
+        best_key, best_score = None, None
+        for key in keys:
+            seconds = np.mean([images[i][1][key][0] for i in band_images])
+            agreement = np.mean([images[i][1][key][1] for i in band_images])
+            # Configurations within budget come first, then the best agreeing.
+            # Ties, common when images have no text, keep the base parameters.
+            is_base = key == (base_delta, 0)
+            score = (seconds <= time_budget, round(agreement, 3), is_base, -seconds)
+            if best_score is None or score > best_score:
+                best_key, best_score = key, score
+
+        delta, index = best_key
+        parameters = dict(combinations[index], mser_delta=delta)
+        profile.bands.append({'max_density': images[band_images[-1]][0], 'parameters': parameters})
+    profile.bands[-1]['max_density'] = None
+    return profile
+
+
+def main(argv: [str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Tune text detection parameters on sample images.")
+    parser.add_argument("folder", help="folder of sample images")
+    parser.add_argument("-o", "--output", required=True, help="file to write the JSON profile to")
+    parser.add_argument("--time-budget", type=float, default=1.,
+                        help="seconds detection may take per image, inpainting excluded")
+    parser.add_argument("--mask-folder", default=None,
+                        help="folder of reference masks NAME_mask.png, default: the masks of "
+                             "the default parameters")
+    parser.add_argument("--bands", type=int, default=3, help="number of region density bands")
+    parser.add_argument("--max-images", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    from batch import iter_image_paths
+
+    paths = itertools.islice(iter_image_paths(args.folder), args.max_images)
+    profile = tune(paths, time_budget=args.time_budget, num_bands=args.bands,
+                   mask_folder=args.mask_folder, log=sys.stdout)
+    profile.save(args.output)
+    print(json.dumps(profile.as_dict(), indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
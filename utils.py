@@ -1,10 +1,14 @@
 from kv.colors import RGB
-from kv.image import Image, ImageMode
+from kv.image import ImageMode
+from typing import TYPE_CHECKING
 import math
 import os
 
-from matplotlib.figure import Figure
-import cv2
+# OpenCV and the Image class are imported by the functions using them, so
+# importing utils stays cheap
+if TYPE_CHECKING:
+    from matplotlib.figure import Figure
+    from kv.image import Image
 
 class ContrastColorGenerator:
     colors: [RGB] = [
@@ -38,8 +42,8 @@ class ContrastColorGenerator:
         return color
 
 
-def generate_subplots_for_images(figure: Figure,
-                                 images: [Image],
+def generate_subplots_for_images(figure: 'Figure',
+                                 images: ['Image'],
                                  titles: [str] = [],
                                  ncols=1):
     if len(images) <= 0:
@@ -67,14 +71,18 @@ def generate_subplots_for_images(figure: Figure,
             ax.imshow(image.data)
 
 
-def load_images_from_folder(folder) -> [Image]:
-    images: [Image] = []
+def iter_images_from_folder(folder):
+    """Lazily load the images in folder one at a time"""
+    from kv.image import Image
+    import cv2
 
     for filename in os.listdir(folder):
         img_data = cv2.imread(os.path.join(folder, filename))
         if img_data is None:
             continue
         img_data_rgb = cv2.cvtColor(img_data, cv2.COLOR_BGR2RGB)
-        images.append(Image(img_data_rgb, mode=ImageMode.RGB))
+        yield Image(img_data_rgb, mode=ImageMode.RGB)
 
-    return images
+
+def load_images_from_folder(folder) -> ['Image']:
+    return list(iter_images_from_folder(folder))